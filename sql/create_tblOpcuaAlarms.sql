@@ -0,0 +1,25 @@
+-- Table for the OPC UA alarm events written by src/alarm_sink.py.
+-- Run once on RecipeDB before setting sql_sink.enabled to true in configs/opcua_server_alarm_config.json.
+-- If sql_sink.table_name is changed, change the table and index names below the same way.
+
+IF OBJECT_ID(N'[dbo].[tblOpcuaAlarms]', N'U') IS NULL
+BEGIN
+    CREATE TABLE [dbo].[tblOpcuaAlarms] (
+        [id] BIGINT IDENTITY(1,1) PRIMARY KEY,
+        [AlarmTime] DATETIME2 NULL,
+        [ReceivedTime] DATETIME2 NOT NULL,
+        [ServerAddress] NVARCHAR(255) NOT NULL,
+        [Severity] INT NULL,
+        [Message] NVARCHAR(1000) NULL,
+        [Identifier] NVARCHAR(255) NULL,
+        [ActiveState] NVARCHAR(50) NULL,
+        [AckedState] NVARCHAR(50) NULL,
+        [ConditionClassId] NVARCHAR(255) NULL,
+        [Retain] BIT NULL
+    );
+    CREATE INDEX [IX_tblOpcuaAlarms_AlarmTime] ON [dbo].[tblOpcuaAlarms] ([AlarmTime]);
+    CREATE INDEX [IX_tblOpcuaAlarms_Server_Time] ON [dbo].[tblOpcuaAlarms] ([ServerAddress], [AlarmTime]);
+    CREATE INDEX [IX_tblOpcuaAlarms_Severity_Time] ON [dbo].[tblOpcuaAlarms] ([Severity], [AlarmTime]);
+    CREATE INDEX [IX_tblOpcuaAlarms_Identifier_Time] ON [dbo].[tblOpcuaAlarms] ([Identifier], [AlarmTime]);
+END
+GO
@@ -0,0 +1,435 @@
+"""
+This file contains the AlarmSqlSink class, which stores the OPC UA alarm events in the database.
+Events are queued in memory and written in batches by a background thread. While the database
+can not be reached the batches are spooled to a local file and written when it is back. Events the
+database rejects are moved to a file of their own, so they do not block the ones after them.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from queue import Queue, Empty, Full
+from typing import Any, Dict, List, Optional, Tuple
+
+import pyodbc
+
+from .create_log import setup_logger
+from .sql_connection import SQLConnection
+
+
+logger = setup_logger("Alarm_sink")
+
+ROOT_PATH = Path(__file__).parent.parent
+
+# Errors caused by the values of a row, writing the row again gives the same error
+ROW_ERRORS = (pyodbc.DataError, pyodbc.IntegrityError, TypeError, ValueError, OverflowError)
+
+COLUMNS = ("AlarmTime", "ReceivedTime", "ServerAddress", "Severity", "Message", "Identifier",
+           "ActiveState", "AckedState", "ConditionClassId", "Retain")
+
+
+class AlarmSqlSink:
+    """
+    Writes alarm events to a SQL table in batches.
+
+    A batch is written when batch_size events are queued or flush_interval_ms has passed since
+    the first queued event. The spool is written in chunks of batch_size, and a chunk the database
+    rejects is written row by row so only the rejected rows are set aside.
+    The table is not created by the program, see sql/create_tblOpcuaAlarms.sql.
+    """
+
+    def __init__(
+        self,
+        table_name: str = "tblOpcuaAlarms",
+        batch_size: int = 50,
+        flush_interval_ms: int = 1000,
+        spool_file: str = "cache/alarm_spool.jsonl",
+        max_queue_size: int = 10000,
+        retry_interval_seconds: float = 30.0,
+        max_spool_mb: float = 20.0
+    ) -> None:
+        """
+        Parameters
+        ----------
+        table_name - The table the alarms are stored in
+        batch_size - Max number of events written in one batch
+        flush_interval_ms - Max time an event waits in the queue
+        spool_file - File the events are kept in while the database is down, relative to the program folder
+        max_queue_size - Events that do not fit in the queue are spooled right away
+        retry_interval_seconds - Time to wait before the next write after the database failed
+        max_spool_mb - Max size of the spool, events that do not fit are lost
+        """
+
+        if not re.fullmatch(r"\w+", table_name):
+            raise ValueError(f"Invalid table name: {table_name}")
+
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.retry_interval = retry_interval_seconds
+        self.spool_file = ROOT_PATH / spool_file
+        # Spooled events that are being written, kept until the write has been committed
+        self.sending_file = self.spool_file.with_suffix(".sending")
+        # Events the database rejected, with the error, for someone to look at
+        self.rejected_file = self.spool_file.with_name(f"{self.spool_file.stem}_rejected.jsonl")
+        self.max_spool_bytes = int(max_spool_mb * 1024 * 1024)
+
+        self._queue: Queue = Queue(maxsize=max_queue_size)
+        self._spool_lock = threading.Lock()
+        self._table_ready = False
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+
+    def start(self) -> None:
+        """Starts the writer thread."""
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="alarm_sink", daemon=True)
+            self._thread.start()
+
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """
+        Writes the queued events and stops the writer thread.
+
+        Parameters
+        ----------
+        timeout - Max seconds to wait for the writer, None waits until it is done
+        """
+
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning(f"The alarm writer did not finish within {timeout} s, {self._queue.qsize()} alarms are lost")
+            self._thread = None
+
+
+    def enqueue(self, address: str, alarm: Dict[str, Any]) -> None:
+        """
+        Queues an alarm event, safe to call from any thread.
+
+        Parameters
+        ----------
+        address - The address of the OPC UA server the event came from
+        alarm - The attributes of the event, as built by SubHandler.event_notification
+        """
+
+        row = self._to_row(address, alarm)
+        try:
+            self._queue.put_nowait(row)
+        except Full:
+            logger.warning("Alarm queue is full, spooling the event")
+            self._spool([row])
+
+
+    def check_table(self) -> None:
+        """
+        Checks that the alarm table exists. It is not created here, run sql/create_tblOpcuaAlarms.sql first.
+
+        Raises
+        ------
+        ValueError - If the table does not exist
+        """
+
+        table = self.table_name
+
+        def exists(cursor):
+            cursor.execute("SELECT OBJECT_ID(?, N'U')", f"[dbo].[{table}]")
+            return cursor.fetchone()[0] is not None
+
+        if not SQLConnection().run_with_cursor(exists):
+            raise ValueError(f"The table {table} does not exist, run sql/create_tblOpcuaAlarms.sql on the database")
+        self._table_ready = True
+
+
+    def query_alarms(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        server_address: Optional[str] = None,
+        min_severity: Optional[int] = None,
+        max_severity: Optional[int] = None,
+        identifier: Optional[str] = None,
+        limit: int = 1000
+    ) -> List[Any]:
+        """
+        Returns the newest alarms that match the filters, every filter is optional.
+
+        Parameters
+        ----------
+        start - Only alarms at or after this time
+        end - Only alarms before this time
+        server_address - Only alarms from this server
+        min_severity - Only alarms with at least this severity
+        max_severity - Only alarms with at most this severity
+        identifier - Only alarms with this identifier
+        limit - Max number of rows
+
+        Returns
+        -------
+        The rows, newest first, with the columns in COLUMNS order.
+        """
+
+        filters = []
+        params: List[Any] = []
+
+        for condition, value in (("[AlarmTime] >= ?", start), ("[AlarmTime] < ?", end),
+                                 ("[ServerAddress] = ?", server_address), ("[Severity] >= ?", min_severity),
+                                 ("[Severity] <= ?", max_severity), ("[Identifier] = ?", identifier)):
+            if value is not None:
+                filters.append(condition)
+                params.append(value)
+
+        where = f"WHERE {' AND '.join(filters)}" if filters else ""
+        query = (f"SELECT TOP ({int(limit)}) {', '.join(f'[{column}]' for column in COLUMNS)} "
+                 f"FROM [dbo].[{self.table_name}] {where} ORDER BY [AlarmTime] DESC")
+
+        def fetch(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+        return SQLConnection().run_with_cursor(fetch)
+
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+
+            if batch:
+                self._write(batch)
+            elif self._stop_event.is_set():
+                return
+            elif self._has_spool():
+                # Try to empty the spool even when no new alarms come in
+                self._write([])
+
+
+    def _next_batch(self) -> List[tuple]:
+        """Waits for the first event, then collects events until the batch is full or the interval has passed."""
+
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+
+        return batch
+
+
+    def _write(self, batch: List[tuple]) -> None:
+        try:
+            if not self._table_ready:
+                self.check_table()
+        except Exception as exeption:
+            logger.warning(f"Could not reach the alarm table, spooling the alarms: {exeption}")
+            self._spool(batch)
+            self._stop_event.wait(self.retry_interval)
+            return
+
+        spooled = self._take_spool()
+        done, error = self._write_rows(spooled + batch)
+
+        if spooled:
+            if done >= len(spooled):
+                self._clear_sending()
+                logger.info(f"Wrote {len(spooled)} spooled alarms to the database")
+            else:
+                self._replace_sending(spooled[done:])
+
+        if error is not None:
+            logger.warning(f"Could not write alarms to the database, spooling them: {error}")
+            self._spool(batch[max(0, done - len(spooled)):])
+            # New events keep being queued while we wait, they are spooled with the next batch
+            self._stop_event.wait(self.retry_interval)
+
+
+    def _write_rows(self, rows: List[tuple]) -> Tuple[int, Optional[Exception]]:
+        """
+        Writes rows in chunks of batch_size, each chunk in its own transaction.
+        A chunk with a rejected row is written row by row and the rows that are rejected again
+        are moved to the rejected file.
+
+        Returns
+        -------
+        The number of rows that are written or rejected, counted from the start, and the error that
+        stopped the write, None if every row is done.
+        """
+
+        done = 0
+        for start in range(0, len(rows), self.batch_size):
+            chunk = rows[start:start + self.batch_size]
+
+            try:
+                SQLConnection().run_with_cursor(self._insert, chunk, commit=True)
+                done += len(chunk)
+                continue
+            except ROW_ERRORS as exeption:
+                logger.warning(f"The database rejected a batch of {len(chunk)} alarms, writing them one by one: {exeption}")
+            except Exception as exeption:
+                return done, exeption
+
+            for row in chunk:
+                try:
+                    SQLConnection().run_with_cursor(self._insert, [row], commit=True)
+                except ROW_ERRORS as exeption:
+                    self._reject(row, exeption)
+                except Exception as exeption:
+                    return done, exeption
+                done += 1
+
+        return done, None
+
+
+    def _insert(self, cursor, rows: List[tuple]) -> None:
+        columns = ", ".join(f"[{column}]" for column in COLUMNS)
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        cursor.fast_executemany = True
+        cursor.executemany(f"INSERT INTO [dbo].[{self.table_name}] ({columns}) VALUES ({placeholders})", rows)
+
+
+    @staticmethod
+    def _to_row(address: str, alarm: Dict[str, Any]) -> tuple:
+        def text(value, max_length):
+            return None if value is None else str(value)[:max_length]
+
+        alarm_time = alarm.get("Time")
+        severity = alarm.get("Severity")
+        retain = alarm.get("Retain")
+
+        return (
+            alarm_time if isinstance(alarm_time, datetime) else None,
+            datetime.now(),
+            text(address, 255),
+            int(severity) if severity is not None else None,
+            text(alarm.get("Message"), 1000),
+            text(alarm.get("Identifier"), 255),
+            text(alarm.get("ActiveState"), 50),
+            text(alarm.get("AckedState"), 50),
+            text(alarm.get("ConditionClassId"), 255),
+            bool(retain) if retain is not None else None
+        )
+
+
+    @staticmethod
+    def _to_line(row: tuple) -> str:
+        return json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in row]) + "\n"
+
+
+    @staticmethod
+    def _from_line(line: str) -> tuple:
+        values = json.loads(line)
+        # AlarmTime and ReceivedTime are the first two columns
+        for index in (0, 1):
+            if values[index] is not None:
+                values[index] = datetime.fromisoformat(values[index])
+        return tuple(values)
+
+
+    def _spool_size(self) -> int:
+        """Size of the spool and the sending file in bytes, called with the spool lock held."""
+
+        size = 0
+        for path in (self.spool_file, self.sending_file):
+            try:
+                size += path.stat().st_size
+            except FileNotFoundError:
+                pass
+        return size
+
+
+    def _spool(self, rows: List[tuple]) -> None:
+        if not rows:
+            return
+
+        with self._spool_lock:
+            try:
+                if self._spool_size() >= self.max_spool_bytes:
+                    logger.error(f"The alarm spool is full, {len(rows)} alarms are lost")
+                    return
+
+                self.spool_file.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.spool_file, "a", encoding="UTF8") as spool:
+                    spool.writelines(self._to_line(row) for row in rows)
+            except OSError as exeption:
+                logger.error(f"Could not spool {len(rows)} alarms, they are lost: {exeption}")
+
+
+    def _reject(self, row: tuple, exeption: Exception) -> None:
+        """Moves a row the database does not accept to the rejected file."""
+
+        logger.error(f"The database rejected an alarm, it is moved to {self.rejected_file.name}: {exeption}")
+
+        with self._spool_lock:
+            try:
+                self.rejected_file.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.rejected_file, "a", encoding="UTF8") as rejected:
+                    rejected.write(json.dumps({"error": str(exeption), "row": json.loads(self._to_line(row))}) + "\n")
+            except OSError as error:
+                logger.error(f"Could not save the rejected alarm, it is lost: {error}")
+
+
+    def _has_spool(self) -> bool:
+        with self._spool_lock:
+            return self._spool_size() > 0
+
+
+    def _take_spool(self) -> List[tuple]:
+        """Moves the spooled events to the sending file and returns everything in it."""
+
+        with self._spool_lock:
+            try:
+                if self.spool_file.exists():
+                    with open(self.spool_file, "r", encoding="UTF8") as spool, \
+                         open(self.sending_file, "a", encoding="UTF8") as sending:
+                        sending.write(spool.read())
+                    os.remove(self.spool_file)
+
+                with open(self.sending_file, "r", encoding="UTF8") as sending:
+                    lines = sending.readlines()
+            except FileNotFoundError:
+                return []
+
+        rows = []
+        for line in lines:
+            try:
+                rows.append(self._from_line(line))
+            except (ValueError, TypeError, IndexError):
+                logger.warning(f"Skipping broken line in the alarm spool: {line!r}")
+        return rows
+
+
+    def _replace_sending(self, rows: List[tuple]) -> None:
+        """Keeps only the rows that are not written yet in the sending file."""
+
+        with self._spool_lock:
+            try:
+                with open(self.sending_file, "w", encoding="UTF8") as sending:
+                    sending.writelines(self._to_line(row) for row in rows)
+            except OSError as exeption:
+                logger.error(f"Could not update {self.sending_file.name}, written alarms may be sent again: {exeption}")
+
+
+    def _clear_sending(self) -> None:
+        with self._spool_lock:
+            try:
+                os.remove(self.sending_file)
+            except FileNotFoundError:
+                pass
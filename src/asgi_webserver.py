@@ -0,0 +1,248 @@
+"""
+This file contains the ASGI version of the production dashboard. It serves the same routes as the Flask
+app in webserver.py, but runs with uvicorn on the event loop that owns the OPC UA connections, so an
+open dashboard costs a coroutine instead of a thread.
+uvicorn is optional, webserver.py falls back to Flask and waitress when it is not installed.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import asyncio
+import json
+import mimetypes
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from jinja2 import Environment, FileSystemLoader
+
+from .create_log import setup_logger
+from .snapshot_broadcaster import SnapshotBroadcaster
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+
+logger = setup_logger("Asgi_webserver")
+
+ROOT_PATH = Path(__file__).parent.parent
+TEMPLATE_PATH = ROOT_PATH / "templates"
+STATIC_PATH = ROOT_PATH / "static"
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+def url_for(endpoint: str, filename: str = "") -> str:
+    """The part of Flask's url_for that the templates use."""
+
+    if endpoint != "static":
+        raise ValueError(f"Unknown endpoint {endpoint}")
+    return "/static/" + quote(filename)
+
+
+def create_asgi_app(
+    snapshot_payload: Callable,
+    broadcaster: SnapshotBroadcaster,
+    stream_keep_alive_seconds: float,
+    allowed_origins: Iterable[str] = (),
+    health_payload: Optional[Callable] = None
+):
+    """
+    Creates the ASGI app of the dashboard.
+
+    Parameters
+    ----------
+    snapshot_payload - Function that turns a snapshot into the values sent to the dashboard, or None
+    broadcaster - The broadcaster the production snapshot is published in
+    stream_keep_alive_seconds - Seconds between keep-alive comments on /stream
+    allowed_origins - Origins that get CORS headers
+    health_payload - Function that returns the health of the units, or None when the monitor is off
+
+    Returns
+    -------
+    The ASGI app.
+    """
+
+    templates = Environment(loader=FileSystemLoader(str(TEMPLATE_PATH)), autoescape=True)
+    templates.globals["url_for"] = url_for
+    allowed_origins = set(allowed_origins)
+    static_cache: Dict[Path, Tuple[float, bytes]] = {}
+
+
+    def cors_headers(scope) -> Headers:
+        origin = dict(scope["headers"]).get(b"origin", b"").decode("latin-1")
+        if origin and origin in allowed_origins:
+            return [(b"access-control-allow-origin", origin.encode("latin-1")), (b"vary", b"Origin")]
+        return []
+
+
+    async def send_response(send, status: int, body: bytes, content_type: bytes, headers: Optional[Headers] = None):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())] + (headers or [])
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+    async def main_page(scope, receive, send):
+        client = scope.get("client")
+        logger.info(f"Request received from {client[0] if client else None}")
+
+        body = templates.get_template("index.html").render().encode("utf-8")
+        await send_response(send, 200, body, b"text/html; charset=utf-8", cors_headers(scope))
+
+
+    async def get_data(scope, receive, send):
+        _, snapshot = broadcaster.latest()
+        payload = snapshot_payload(snapshot)
+
+        if payload is None:
+            logger.warning("No recent data received from the opcua server")
+            await send_response(send, 500, b"Server error", b"text/plain; charset=utf-8")
+            return
+
+        await send_response(send, 200, json.dumps(payload).encode("utf-8"), b"application/json", cors_headers(scope))
+
+
+    async def stream(scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                        (b"x-accel-buffering", b"no")] + cors_headers(scope)
+        })
+
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher = asyncio.create_task(watch_disconnect())
+        loop = asyncio.get_running_loop()
+        version = -1
+        last_data = None
+        last_sent = loop.time()
+
+        try:
+            while not disconnected.is_set():
+                version, snapshot = await broadcaster.wait_for_update_async(version, stream_keep_alive_seconds)
+                payload = snapshot_payload(snapshot)
+                data = json.dumps(payload) if payload is not None else None
+
+                if data is not None and data != last_data:
+                    last_data = data
+                    last_sent = loop.time()
+                    await send({"type": "http.response.body", "body": f"data: {data}\n\n".encode("utf-8"),
+                                "more_body": True})
+
+                elif loop.time() - last_sent >= stream_keep_alive_seconds:
+                    last_sent = loop.time()
+                    await send({"type": "http.response.body", "body": b": keep-alive\n\n", "more_body": True})
+
+        except OSError:
+            # The client went away while we were sending
+            pass
+
+        finally:
+            watcher.cancel()
+
+
+    async def health(scope, receive, send):
+        payload = health_payload() if health_payload is not None else None
+
+        if payload is None:
+            await send_response(send, 404, b"Health monitor is turned off", b"text/plain; charset=utf-8")
+            return
+
+        await send_response(send, 200, json.dumps(payload).encode("utf-8"), b"application/json", cors_headers(scope))
+
+
+    async def static_file(scope, receive, send):
+        relative_path = unquote(scope["path"][len("/static/"):])
+        file_path = (STATIC_PATH / relative_path).resolve()
+
+        if STATIC_PATH.resolve() not in file_path.parents or not file_path.is_file():
+            await send_response(send, 404, b"Not found", b"text/plain; charset=utf-8")
+            return
+
+        mtime = file_path.stat().st_mtime
+        cached = static_cache.get(file_path)
+        if cached is None or cached[0] != mtime:
+            body = await asyncio.get_running_loop().run_in_executor(None, file_path.read_bytes)
+            static_cache[file_path] = (mtime, body)
+        else:
+            body = cached[1]
+
+        content_type = mimetypes.guess_type(str(file_path))[0] or "application/octet-stream"
+        await send_response(send, 200, body, content_type.encode(), [(b"cache-control", b"max-age=3600")])
+
+
+    routes = {
+        "/": main_page,
+        "/get_data": get_data,
+        "/stream": stream,
+        "/health": health,
+    }
+
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        if scope["type"] != "http":
+            return
+
+        if scope["method"] not in ("GET", "HEAD"):
+            await send_response(send, 405, b"Method not allowed", b"text/plain; charset=utf-8")
+            return
+
+        path = scope["path"]
+        handler = routes.get(path)
+        if handler is None and path.startswith("/static/"):
+            handler = static_file
+
+        if handler is None:
+            await send_response(send, 404, b"Not found", b"text/plain; charset=utf-8")
+            return
+
+        try:
+            await handler(scope, receive, send)
+        except Exception as exeption:
+            logger.error(f"Error while serving {path}: {exeption}")
+
+
+    return app
+
+
+async def serve_asgi(app, host: str, port: int) -> bool:
+    """
+    Serves the app with uvicorn on the running event loop.
+
+    Returns
+    -------
+    False if the server could not start, for example when the port is in use.
+    """
+
+    config = uvicorn.Config(app, host=host, port=port, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+
+    try:
+        await server.serve()
+    except (SystemExit, OSError) as exeption:
+        # uvicorn calls sys.exit when it can not bind, which would stop the loop of the OPC UA tasks
+        logger.error(f"Could not serve on {host}:{port}: {exeption!r}")
+        return False
+
+    return server.started
@@ -0,0 +1,83 @@
+"""
+This file contains the AsyncSQLConnection class, which lets coroutines on the asyncio loops await database work.
+The blocking pyodbc calls run on a bounded thread pool, so OPC UA coroutines on the same loop keep running
+while a query is waiting on the server.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Sequence
+
+from .sql_connection import SQLConnection
+
+
+# Shared by every loop in the program, bounds the number of threads blocked on the database
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sql")
+
+
+class AsyncSQLConnection:
+    """
+    Async facade over SQLConnection.
+
+    Every call checks a connection out of the SQLConnection pool on a worker thread, runs the work
+    and gives the connection back. Errors are raised the same way SQLConnection raises them.
+    """
+
+    def __init__(self, config_file_name: str = "sql_config.json", win_env_key_name: str = "SQL_KEY") -> None:
+        self.config_file_name = config_file_name
+        self.win_env_key_name = win_env_key_name
+
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Runs a blocking function on the database thread pool and returns its result."""
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(DB_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+
+    async def run_with_cursor(self, func: Callable, *args, commit: bool = False) -> Any:
+        """
+        Runs func(cursor, *args) on the database thread pool with a pooled connection.
+
+        Parameters
+        ----------
+        func - Blocking function that gets the cursor as first argument
+        args - Extra arguments for func
+        commit - Commit the connection when func returns without raising
+
+        Returns
+        -------
+        The return value of func.
+        """
+
+        return await self.run(self._with_cursor, func, args, commit)
+
+
+    async def fetchall(self, query: str, params: Sequence = ()) -> List[Any]:
+        """Executes a query and returns all rows."""
+
+        def fetch(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+        return await self.run_with_cursor(fetch)
+
+
+    async def execute(self, query: str, params: Sequence = (), commit: bool = True) -> int:
+        """Executes a statement and returns the row count."""
+
+        def execute(cursor):
+            cursor.execute(query, params)
+            return cursor.rowcount
+
+        return await self.run_with_cursor(execute, commit=commit)
+
+
+    def _with_cursor(self, func: Callable, args: tuple, commit: bool) -> Any:
+        return SQLConnection().run_with_cursor(func, *args, commit=commit,
+                                               config_file_name=self.config_file_name,
+                                               win_env_key_name=self.win_env_key_name)
@@ -1,19 +1,58 @@
 """
 This file contains the ConfigHandler class, which is used to handle configs files and return the data in them.
+The parsed configs are cached for the whole process and read again when the files change.
 version: 1.0.0 Inital commit by Roberts balulis
 """
 __version__ = "1.0.0"
 
 
+import copy
+import itertools
 import json
+import os
+import threading
+import time
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List, Optional
+
+from .create_log import setup_logger
+
+
+logger = setup_logger("Config_handler")
+
+# How often a cached config checks if its file has changed
+POLL_INTERVAL_SECONDS = 2.0
+
+ConfigSubscriber = Callable[[str, Dict[str, Any]], None]
+
+
+@dataclass
+class _CachedConfig:
+    mtime_ns: int
+    size: int
+    data: Dict[str, Any]
+    checked_at: float
+    # Changes every time the data changes, used by the watcher to see what subscribers have been told
+    version: int
 
 
 class ConfigHandler:
     """
     This class is used to handle configs files and return the data in them.
+
+    The configs are parsed once and shared by every ConfigHandler. A file is checked with stat at most
+    every POLL_INTERVAL_SECONDS when it is read, and by a watcher thread while someone is subscribed to it.
+    Subscribers are called from the watcher thread with the new data when a file has changed.
     """
+
+    _cache: Dict[str, _CachedConfig] = {}
+    _subscribers: Dict[str, List[ConfigSubscriber]] = {}
+    _notified_versions: Dict[str, int] = {}
+    _versions = itertools.count(1)
+    _lock = threading.RLock()
+    _watcher: Optional[threading.Thread] = None
+
     def __init__(self) -> None:
 
         self.output_path: Path = Path(__file__).parent.parent
@@ -36,18 +75,126 @@ class ConfigHandler:
         The data in the config file as a dictionary.
         """
 
+        with self._lock:
+            cached = self._cache.get(config_name)
+            if cached is None or time.monotonic() - cached.checked_at >= POLL_INTERVAL_SECONDS:
+                cached = self._refresh(config_name)
+            return copy.deepcopy(cached.data)
+
+
+    def subscribe(self, config_name: str, callback: ConfigSubscriber) -> Callable[[], None]:
+        """
+        Calls callback with the config name and the new data every time the config file changes.
+        The callback runs on the watcher thread, GUI code has to hand the data over to the Tk thread.
+
+        Parameters
+        ----------
+        config_name: The name of the config file to watch.
+        callback: Called with the config name and the new data.
+
+        Returns
+        ----------
+        A function that removes the subscription.
+        """
+
+        with self._lock:
+            self._subscribers.setdefault(config_name, []).append(callback)
+            if config_name not in self._notified_versions:
+                try:
+                    self._notified_versions[config_name] = self._refresh(config_name).version
+                except (FileNotFoundError, ValueError):
+                    # Subscribers are told when the file becomes valid
+                    self._notified_versions[config_name] = 0
+            self._start_watcher()
+
+        def unsubscribe() -> None:
+            with self._lock:
+                callbacks = self._subscribers.get(config_name, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+
+        return unsubscribe
+
+
+    def _refresh(self, config_name: str):
+        """
+        Reads the config file again if it changed since it was cached, called with the lock held.
+
+        Returns
+        ----------
+        The cached config.
+        """
+
         config_path = self.config_path / config_name
+        cached = self._cache.get(config_name)
+
         try:
-            with open(config_path, "r") as config_file:
-                config_data = json.load(config_file)
+            stat = os.stat(config_path)
         except FileNotFoundError:
-            raise (f"Config file {config_path} not found.")
-        except json.decoder.JSONDecodeError:
-            raise (f"Config file {config_path} is not valid JSON.")
-        except Exception as exception:
-            raise exception
+            raise FileNotFoundError(f"Config file {config_path} not found.")
 
-        return config_data
+        now = time.monotonic()
+        if cached is not None and (cached.mtime_ns, cached.size) == (stat.st_mtime_ns, stat.st_size):
+            cached.checked_at = now
+            return cached
+
+        try:
+            with open(config_path, "r", encoding="UTF8") as config_file:
+                config_data = json.load(config_file)
+        except json.decoder.JSONDecodeError:
+            raise ValueError(f"Config file {config_path} is not valid JSON.")
+
+        if cached is not None and cached.data == config_data:
+            version = cached.version
+        else:
+            version = next(self._versions)
+        cached = _CachedConfig(stat.st_mtime_ns, stat.st_size, config_data, now, version)
+        self._cache[config_name] = cached
+        return cached
+
+
+    @classmethod
+    def _start_watcher(cls) -> None:
+        if cls._watcher is None:
+            cls._watcher = threading.Thread(target=cls._watch, name="config_watcher", daemon=True)
+            cls._watcher.start()
+
+
+    @classmethod
+    def _watch(cls) -> None:
+        handler = cls()
+        failing = set()
+
+        while True:
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+            with cls._lock:
+                subscribed = [name for name, callbacks in cls._subscribers.items() if callbacks]
+
+            for config_name in subscribed:
+                try:
+                    with cls._lock:
+                        # The change may also have been read by get_config_data since the last round
+                        cached = handler._refresh(config_name)
+                        if cached.version == cls._notified_versions.get(config_name):
+                            continue
+                        cls._notified_versions[config_name] = cached.version
+                        callbacks = list(cls._subscribers.get(config_name, []))
+                except (FileNotFoundError, ValueError) as exception:
+                    # Probably saved half way, the old data is kept until the file is valid again
+                    if config_name not in failing:
+                        logger.warning(f"Could not reload {config_name}: {exception}")
+                        failing.add(config_name)
+                    continue
+
+                failing.discard(config_name)
+
+                logger.info(f"{config_name} changed, notifying {len(callbacks)} subscribers")
+                for callback in callbacks:
+                    try:
+                        callback(config_name, copy.deepcopy(cached.data))
+                    except Exception as exception:
+                        logger.error(f"Subscriber of {config_name} failed: {exception}")
 
 
     @property
@@ -83,3 +230,8 @@ class ConfigHandler:
     @property
     def make_recipe_window(self) -> dict:
         return self.get_config_data('make_recipe_window.json')
+
+
+    @property
+    def recipe_transfer_config(self) -> dict:
+        return self.get_config_data('recipe_transfer_config.json')
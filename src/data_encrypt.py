@@ -7,8 +7,13 @@ __version__ = "1.0.0"
 
 
 from pathlib import Path
+import copy
 import json
 import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Tuple
 from cryptography.fernet import Fernet, InvalidToken
 
 try:
@@ -18,6 +23,17 @@ except ImportError:
 
 logger = setup_logger("Data_encrypt")
 
+# How often a cached config checks if its file has changed
+STAT_INTERVAL_SECONDS = 2.0
+
+
+@dataclass
+class _CachedConfig:
+    mtime_ns: int
+    size: int
+    config: dict
+    checked_at: float
+
 
 class DataEncryptor():
     """
@@ -26,8 +42,15 @@ class DataEncryptor():
     This class provides methods to handle encryption and decryption of
     sensitive data files using Fernet encryption. The encryption key is
     retrieved from the operating system's environment variables.
+
+    The decrypted configs are cached for the whole process, keyed by file and key.
+    The file is checked with stat at most every STAT_INTERVAL_SECONDS and read again
+    only when its modification time or size has changed.
     """
 
+    _cache: Dict[Tuple[Path, str, str], _CachedConfig] = {}
+    _cache_lock = threading.Lock()
+
     def __init__(self):
         self.output_path = Path(__file__).parent.parent
 
@@ -60,31 +83,71 @@ class DataEncryptor():
             logger.error(f"{env_key_name} is not set in the environment")
             raise ValueError(f"{env_key_name} is not set in the environment")
 
-        key = key.encode()
+        cache_key = (config_path, env_key_name, key)
+        now = time.monotonic()
+
+        with self._cache_lock:
+            cached = self._cache.get(cache_key)
+
+            if cached is not None and now - cached.checked_at < STAT_INTERVAL_SECONDS:
+                return copy.deepcopy(cached.config)
+
+            stat = self._stat(config_path)
+            if cached is not None and (cached.mtime_ns, cached.size) == (stat.st_mtime_ns, stat.st_size):
+                cached.checked_at = now
+                return copy.deepcopy(cached.config)
+
+            config = self._load_config(config_path, key.encode())
+
+            # Encrypting the file changed it, so stat again
+            stat = self._stat(config_path)
+            self._cache[cache_key] = _CachedConfig(stat.st_mtime_ns, stat.st_size, config, now)
 
-        if not self.is_encrypted(config_path):
-            self.encrypt_file(config_path, key)
+        return copy.deepcopy(config)
 
-        decrypted_data = self.decrypt_file(config_path, key)
-        config = json.loads(decrypted_data)
 
+    @classmethod
+    def clear_cache(cls) -> None:
+        """Forgets all cached configs, the next call reads the files again."""
+
+        with cls._cache_lock:
+            cls._cache.clear()
+
+
+    def _load_config(self, config_path: Path, key: bytes) -> dict:
+        """Reads the file once, encrypts it if it is plain json and returns the config."""
+
+        data = self._read_file(config_path)
+
+        try:
+            config = json.loads(data)
+        except json.JSONDecodeError:
+            config = None
+
+        if config is None:
+            return json.loads(self._decrypt_data(data, key))
+
+        logger.info(f"Encrypting {config_path.name}")
+        encrypted_data = self._encrypt_data(data, key)
+        with open(config_path, 'wb') as file:
+            file.write(encrypted_data)
         return config
 
 
     @staticmethod
-    def encrypt_file(file_path: str, key: str):
-        """
-        Encrypts a file using the given key.
+    def _stat(file_path: Path) -> os.stat_result:
+        try:
+            return os.stat(file_path)
+        except FileNotFoundError:
+            logger.error(f"File {file_path} not found")
+            raise FileNotFoundError(f"File {file_path} not found")
 
-        Parameters
-        ----------
-        file_path: - The path to the file to be encrypted.
-        key: - The encryption key.
-        """
 
+    @staticmethod
+    def _read_file(file_path) -> bytes:
         try:
             with open(file_path, 'rb') as file:
-                data = file.read()
+                return file.read()
         except FileNotFoundError:
             logger.error(f"File {file_path} not found")
             raise FileNotFoundError(f"File {file_path} not found")
@@ -93,14 +156,43 @@ class DataEncryptor():
             logger.error(f"Permission denied for file {file_path}")
             raise PermissionError(f"Permission denied for file {file_path}")
 
+
+    @staticmethod
+    def _encrypt_data(data: bytes, key: bytes) -> bytes:
         fernet_key = Fernet(key)
 
         try:
-            encrypted_data = fernet_key.encrypt(data)
+            return fernet_key.encrypt(data)
         except InvalidToken:
             logger.error("Invalid encryption token or corrupted data.")
             raise ValueError("Invalid encryption token or corrupted data.")
 
+
+    @staticmethod
+    def _decrypt_data(data: bytes, key: bytes) -> bytes:
+        fernet_key = Fernet(key)
+
+        try:
+            return fernet_key.decrypt(data)
+        except InvalidToken:
+            logger.error("Invalid encryption token or corrupted data.")
+            raise ValueError("Invalid encryption token or corrupted data.")
+
+
+    @staticmethod
+    def encrypt_file(file_path: str, key: str):
+        """
+        Encrypts a file using the given key.
+
+        Parameters
+        ----------
+        file_path: - The path to the file to be encrypted.
+        key: - The encryption key.
+        """
+
+        data = DataEncryptor._read_file(file_path)
+        encrypted_data = DataEncryptor._encrypt_data(data, key)
+
         with open(file_path, 'wb') as file:
             file.write(encrypted_data)
 
@@ -116,26 +208,8 @@ class DataEncryptor():
         key: str - The encryption key.
         """
 
-        try:
-            with open(file_path, 'rb') as file:
-                encrypted_data = file.read()
-        except FileNotFoundError:
-            logger.error(f"File {file_path} not found")
-            raise FileNotFoundError(f"File {file_path} not found")
-
-        except PermissionError:
-            logger.error(f"Permission denied for file {file_path}")
-            raise PermissionError(f"Permission denied for file {file_path}")
-
-        fernet_key = Fernet(key)
-
-        try:
-            decrypted_data = fernet_key.decrypt(encrypted_data)
-        except InvalidToken:
-            logger.error("Invalid encryption token or corrupted data.")
-            raise ValueError("Invalid encryption token or corrupted data.")
-
-        return decrypted_data
+        encrypted_data = DataEncryptor._read_file(file_path)
+        return DataEncryptor._decrypt_data(encrypted_data, key)
 
 
     def is_encrypted(self, file_path:str) -> bool:
@@ -147,17 +221,7 @@ class DataEncryptor():
         file_path: str - The path to the file to be encrypted.
         """
 
-        try:
-            with open(file_path, 'rb') as file:
-                data = file.read()
-
-        except FileNotFoundError:
-            logger.error(f"File {file_path} not found")
-            raise FileNotFoundError(f"File {file_path} not found")
-
-        except PermissionError:
-            logger.error(f"Permission denied for file {file_path}")
-            raise PermissionError(f"Permission denied for file {file_path}")
+        data = self._read_file(file_path)
 
         try:
             json.loads(data)
@@ -192,6 +256,7 @@ class DataEncryptor():
             decrypted_data = self.decrypt_file(config_path, key)
             with open(config_path, 'wb') as file:
                 file.write(decrypted_data)
+            self.clear_cache()
         else:
             logger.info(f"File {config_filename} is already decrypted.")
 
@@ -14,6 +14,8 @@ from .sql_connection import SQLConnection
 from .create_log import setup_logger
 from .gui import App
 from .config_handler import ConfigHandler
+from .virtual_treeview import VirtualTreeview
+from .search_index import SearchIndex, DebouncedSearch
 
 
 class EditStepsWindow(customtkinter.CTkToplevel):
@@ -46,7 +48,7 @@ class EditStepsWindow(customtkinter.CTkToplevel):
         self.edit_recipe_grid()
 
     def edit_recipe_grid(self):
-        self.edit_recipe_treeview = ttk.Treeview(self, columns=("Unit name", "Tag name", "Tag value", "Unit id"),
+        self.edit_recipe_treeview = VirtualTreeview(self, columns=("Unit name", "Tag name", "Tag value", "Unit id"),
                               show="headings", height=10, style="Treeview", selectmode='browse')
 
         self.edit_recipe_treeview.heading("#0", text="", anchor="w")
@@ -67,25 +69,27 @@ class EditStepsWindow(customtkinter.CTkToplevel):
         vsb.place(x=30+700+2, y=50, height=825+20)
         self.edit_recipe_treeview.configure(yscrollcommand=vsb.set)
 
+        self.search_index = SearchIndex()
+        self.search = DebouncedSearch(self.edit_recipe_treeview, self.search_index, self.show_search_result)
+
         for row in self.rows:
             unit_id, tag_name, tag_value, tag_datatype ,unit_name = row
-            self.edit_recipe_treeview.insert("", "end", values=(unit_name, tag_name, tag_value, unit_id))
+            item = self.edit_recipe_treeview.insert("", "end", values=(unit_name, tag_name, tag_value, unit_id))
+            self.search_index.add(item, tag_name)
 
         self.edit_recipe_treeview.bind("<Double-1>", self.on_double_click)
 
 
     def update_treeview(self, *args):
 
-        search_term = self.search_var.get()
-
-        for i in self.edit_recipe_treeview.get_children():
-            self.edit_recipe_treeview.delete(i)
+        self.search.schedule(self.search_var.get())
 
-        for row in self.rows:
-            unit_id, tag_name, tag_value, tag_datatype, unit_name = row
 
-            if search_term.lower() in tag_name.lower():
-                self.edit_recipe_treeview.insert("", "end", values=(unit_name, tag_name, tag_value, unit_id))
+    def show_search_result(self, matches):
+        if matches is None:
+            self.edit_recipe_treeview.set_filter(None)
+        else:
+            self.edit_recipe_treeview.set_filter(lambda row: row.iid in matches)
 
 
     def on_double_click(self, event):
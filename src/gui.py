@@ -20,19 +20,53 @@ from pyodbc import Error as PyodbcError
 from asyncua import ua, Client
 
 # Own package
-from .ms_sql import from_units_to_sql_stepdata, from_sql_to_units_stepdata, check_recipe_data
+from .ms_sql import from_units_to_sql_stepdata, from_sql_to_units_stepdata
 from .data_encrypt import DataEncryptor
 from .create_log import setup_logger
-from .ip_checker import check_ip
+from .ip_checker import check_units, load_unit_addresses
 from .opcua_alarm import monitor_alarms
-from .webserver import main_webserver
+from .webserver import main_webserver, unit_health_monitor
 from .config_handler import ConfigHandler
 from .sql_connection import SQLConnection
+from .opcua_session_pool import close_session_pool
+from .task_dispatcher import TaskDispatcher
+from .log_tail import LogTailReader
+from .virtual_treeview import VirtualTreeview
+from .search_index import SearchIndex, DebouncedSearch
 
 # Setup logger for gui.py
 logger = setup_logger('Gui')
 
 
+def parse_error_log_line(file_name, line):
+    """Splits an ERROR line of a log file into date, severity, file and message."""
+
+    if "ERROR" not in line:
+        return None
+    parts = line.strip().split("|", 3)
+    return tuple(parts) if len(parts) == 4 else None
+
+
+def parse_alarm_log_line(file_name, line):
+    """Splits a line of opcua_alarms.log into date, message, identifier and url."""
+
+    parts = line.strip().split("|", 3)  # Split into 4 parts
+    if len(parts) != 4:
+        return None
+
+    date_time = parts[0]
+    full_message = parts[3]
+    url = full_message.split(",")[0].strip()
+    message_parts = full_message.rsplit(",", 1)  # Split the message from the end, once
+    if len(message_parts) == 2:
+        message = message_parts[0].strip()
+        identifier = message_parts[1].strip()
+    else:
+        message = full_message
+        identifier = ""
+    return (date_time, message, identifier, url)
+
+
 def run_monitor_alarms_loop():
     """Runs the monitor_alarms function in a loop."""
 
@@ -60,14 +94,17 @@ def run_asyncio_loop(queue:Queue, app_instance:"App"):
             if coro is None:
                 break
             task = loop.create_task(coro)
-            app_instance.config(cursor="watch")
-            loop.run_until_complete(task)
-            app_instance.config(cursor="arrow")
+            app_instance.dispatcher.begin_busy()
+            try:
+                loop.run_until_complete(task)
+            finally:
+                app_instance.dispatcher.end_busy()
             # Update the recipe page to refrtesh the data
             if "from_units_to_sql_stepdata" in str(task.get_coro()):
-                app_instance.recipe_page_command()
+                app_instance.dispatcher.call_soon(app_instance.recipe_page_command)
 
     finally:
+        loop.run_until_complete(close_session_pool())
         loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(loop)))
         loop.run_until_complete(loop.shutdown_asyncgens())
         loop.close()
@@ -141,6 +178,15 @@ class App(customtkinter.CTk):
 
         #self.focus_force()
 
+        # Runs the blocking database and ping work, Escape cancels it
+        self.dispatcher = TaskDispatcher(self)
+        self.bind("<Escape>", self.dispatcher.cancel_all)
+
+        # Follow the log files, a refresh only reads the lines written since the last one
+        self.error_log_reader = LogTailReader("logs", lambda name: name.endswith(".log"), parse_error_log_line)
+        self.alarm_log_reader = LogTailReader("logs", lambda name: name == "opcua_alarms.log", parse_alarm_log_line)
+        self.log_view_generations = {}
+
         self.recipe_page_command()
 
 
@@ -177,6 +223,19 @@ class App(customtkinter.CTk):
         return bg_frame
 
 
+    def show_database_error(self, exception):
+        """Logs a failed database task and tells the user, called on the main thread."""
+
+        if isinstance(exception, PyodbcError):
+            logger.error(f"Error in database connection: {exception}")
+        elif isinstance(exception, IndexError):
+            logger.error("Database credentials seem to be incomplete.")
+        else:
+            logger.error(f"An unexpected error occurred: {exception}")
+
+        showinfo(title="Info", message=self.texts["error_with_database"])
+
+
     def load_language_file(self, language):
         with open(f'language/{language}.json', 'r', encoding='utf-8') as file:
             return json.load(file)
@@ -206,34 +265,93 @@ class App(customtkinter.CTk):
 
         self.check_if_units_alive.place(x=10, y=180)
 
-        self.ip_adresses_treeview = ttk.Treeview(main_page, columns=("Name", "Ip adress", "Alive"),
+        self.ip_adresses_treeview = ttk.Treeview(main_page, columns=("Name", "Ip adress", "Alive", "Port"),
                                       show="headings", height=10,style="Treeview", selectmode="none")
 
         self.ip_adresses_treeview.heading("Name", text=self.texts['ip_datagrid_name'])
         self.ip_adresses_treeview.heading("Ip adress", text=self.texts['ip_datagrid_ip'])
         self.ip_adresses_treeview.heading("Alive", text=self.texts['ip_datagrid_alive'])
+        self.ip_adresses_treeview.heading("Port", text=self.texts['ip_datagrid_port'])
 
         self.ip_adresses_treeview.column("Name", width=100)
         self.ip_adresses_treeview.column("Ip adress", width=200)
         self.ip_adresses_treeview.column("Alive", width=120)
+        self.ip_adresses_treeview.column("Port", width=150)
 
         self.ip_adresses_treeview.place(x=220, y=100)
 
+        self.health_treeview = ttk.Treeview(main_page,
+                                            columns=("Name", "Ping", "Tcp", "Opcua", "State", "Availability"),
+                                            show="headings", height=5, style="Treeview", selectmode="none")
+
+        self.health_treeview.heading("Name", text=self.texts['health_datagrid_name'])
+        self.health_treeview.heading("Ping", text=self.texts['health_datagrid_ping'])
+        self.health_treeview.heading("Tcp", text=self.texts['health_datagrid_tcp'])
+        self.health_treeview.heading("Opcua", text=self.texts['health_datagrid_opcua'])
+        self.health_treeview.heading("State", text=self.texts['health_datagrid_state'])
+        self.health_treeview.heading("Availability", text=self.texts['health_datagrid_availability'])
+
+        for column, width in (("Name", 100), ("Ping", 120), ("Tcp", 120), ("Opcua", 140), ("State", 120),
+                              ("Availability", 150)):
+            self.health_treeview.column(column, width=width)
+
+        self.health_treeview.place(x=220, y=480)
+        self.refresh_unit_health(self.health_treeview)
+
         self.create_header(main_page, self.texts['header_main_menu'])
         self.create_meny_buttons(main_page)
 
 
+    def refresh_unit_health(self, treeview):
+        """
+        Shows the latest health check of every unit from the health monitor of the webserver,
+        and runs again every 5 seconds until the main page has been rebuilt.
+        """
+
+        if unit_health_monitor is None or treeview is not self.health_treeview or not treeview.winfo_exists():
+            return
+
+        def milliseconds(value):
+            return "-" if value is None else f"{value:.0f} ms"
+
+        summary = unit_health_monitor.summary()
+        for name, unit in summary.items():
+            latest = unit["latest"] or {}
+            availability = "-" if unit["availability"] is None else f"{unit['availability']:.0%}"
+            values = (name, milliseconds(latest.get("ping_ms")), milliseconds(latest.get("tcp_connect_ms")),
+                      milliseconds(latest.get("opcua_read_ms")), latest.get("server_state") or "-", availability)
+
+            if treeview.exists(name):
+                treeview.item(name, values=values)
+            else:
+                treeview.insert('', 'end', iid=name, values=values)
+
+        treeview.after(5000, self.refresh_unit_health, treeview)
+
+
     def check_alive_units(self):
         """
-        Pings the nearby units and updates the Treeview widget with the status.
+        Pings the nearby units and checks their OPC UA port, and updates the Treeview widget
+        with the status of every unit as soon as it is known.
         """
         if self.ip_adresses_treeview:
             for item in self.ip_adresses_treeview.get_children():
                 self.ip_adresses_treeview.delete(item)
 
-            ip_status_list = check_ip()
-            for name, ip_address, status in ip_status_list:
-                self.ip_adresses_treeview.insert('', 'end', values=(name, ip_address, status))
+            treeview = self.ip_adresses_treeview
+
+            # One row per unit right away, filled in when its result comes
+            for name, ip_address, port in load_unit_addresses():
+                treeview.insert('', 'end', iid=f"{ip_address}:{port}", values=(name, ip_address, "...", "..."))
+
+            def show_unit_status(status):
+                if treeview is not self.ip_adresses_treeview or not treeview.exists(f"{status.ip_address}:{status.port}"):
+                    return
+                treeview.item(f"{status.ip_address}:{status.port}",
+                              values=(status.name, status.ip_address, status.alive, status.port_open))
+
+            self.dispatcher.submit(lambda handle: check_units(on_result=handle.report_progress),
+                                   with_handle=True, on_progress=show_unit_status)
         else:
             logger.error("Error: No ip_adresses_treeview object")
 
@@ -243,7 +361,6 @@ class App(customtkinter.CTk):
         Creates and displays the recipes page.
         This page allows the user to create, update, and use recipes.
         """
-        self.detached_items = []
         self.sorting_order = {}
 
         self.original_headings = {}
@@ -255,8 +372,10 @@ class App(customtkinter.CTk):
         self.create_header(recipes_page, self.texts['header_recipe'])
         self.create_meny_buttons(recipes_page)
 
-        self.treeview = ttk.Treeview(recipes_page,selectmode="browse", style="Treeview")
+        self.treeview = VirtualTreeview(recipes_page,selectmode="browse", style="Treeview")
         self.treeview.pack(expand=True, fill='both', side="left")
+        self.recipe_search_index = SearchIndex()
+        self.recipe_search = DebouncedSearch(self.treeview, self.recipe_search_index, self.show_recipe_search_result)
         self.treeview["columns"] = ("id", "RecipeName", "RecipeComment",
                                     "RecipeCreated", "RecipeUpdated","RecipeLastSaved", "RecipeStatus")
 
@@ -320,39 +439,6 @@ class App(customtkinter.CTk):
         self.search_bar.pack(pady=1)
         self.search_var.trace('w', self.update_treeview)
 
-        cursor = None
-        cnxn = None
-        rows = None
-
-        try:
-            sql_connection = SQLConnection()
-            sql_credentials = sql_connection.get_database_credentials("sql_config.json", "SQL_KEY")
-            cursor, cnxn = sql_connection.connect_to_database(sql_credentials)
-
-            if cursor and cnxn:
-
-                cursor.execute('SELECT [id], [RecipeName], [RecipeComment], [RecipeCreated], \
-                                    [RecipeUpdated], [RecipeLastDataSaved],[ParentID] FROM [RecipeDB].[dbo].[viewRecipesActive]')
-
-                rows = cursor.fetchall()
-
-        except PyodbcError as e:
-            logger.error(f"Error in database connection: {e}")
-            showinfo(title="Info", message=self.texts["error_with_database"])
-
-        except IndexError:
-            logger.error("Database credentials seem to be incomplete.")
-            showinfo(title="Info", message=self.texts["error_with_database"])
-
-        except Exception as e:
-            logger.error(f"An unexpected error occurred: {e}")
-            showinfo(title="Info", message=self.texts["error_with_database"])
-
-        finally:
-            if cursor and cnxn:
-                sql_connection.disconnect_from_database(cursor, cnxn)
-
-
         #  Gets the max depth of the recipe structure from the config file
         try:
             recipes_page_config = ConfigHandler()
@@ -365,40 +451,71 @@ class App(customtkinter.CTk):
         except Exception as e:
             logger.error(f"An unexpected error occurred: {e}")
 
-        parent_items = {}
+        treeview = self.treeview
+        self.dispatcher.submit(SQLConnection().run_with_cursor, self.fetch_recipe_rows,
+                               on_done=lambda rows: self.show_recipe_rows(treeview, rows),
+                               on_error=self.show_database_error)
+
+
+    @staticmethod
+    def fetch_recipe_rows(cursor):
+        """Fetches the recipes, whether they have children and whether their data is complete, runs on a worker."""
+
+        cursor.execute("""
+            SELECT r.[id], r.[RecipeName], r.[RecipeComment], r.[RecipeCreated],
+                   r.[RecipeUpdated], r.[RecipeLastDataSaved], r.[ParentID],
+                   CASE WHEN c.[ChildCount] > 0 THEN 1 ELSE 0 END AS [HasChildren],
+                   CASE WHEN v.[ValueCount] > 0 AND v.[IncompleteCount] = 0 THEN 1 ELSE 0 END AS [HasRecipeData]
+            FROM [RecipeDB].[dbo].[viewRecipesActive] r
+            LEFT JOIN (
+                SELECT [ParentID], COUNT(*) AS [ChildCount]
+                FROM [RecipeDB].[dbo].[tblRecipe]
+                WHERE [ParentID] IS NOT NULL
+                GROUP BY [ParentID]
+            ) c ON c.[ParentID] = r.[id]
+            LEFT JOIN (
+                SELECT [RecipeID], COUNT(*) AS [ValueCount],
+                       SUM(CASE WHEN [UnitID] IS NULL OR [TagName] IS NULL OR [TagValue] IS NULL
+                                     OR [TagDataType] IS NULL OR [UnitName] IS NULL
+                                THEN 1 ELSE 0 END) AS [IncompleteCount]
+                FROM [RecipeDB].[dbo].[viewValues]
+                GROUP BY [RecipeID]
+            ) v ON v.[RecipeID] = r.[id]
+            """)
 
-        # Start inserting into Treeview from root (None)
-        self.insert_into_treeview(None, rows, parent_items)
+        return cursor.fetchall()
 
 
-    def update_treeview(self, *args):
-        search_term = self.search_var.get().lower()
+    def show_recipe_rows(self, treeview, rows):
+        """Inserts the fetched recipe rows, ignored if the recipe page has been rebuilt meanwhile."""
 
-        # Combine all items: attached and detached
-        all_items = self.treeview.get_children("") + tuple(self.detached_items)
-
-        if not search_term:
-            # If the search bar is cleared, reattach all items
-            for item in self.detached_items:
-                self.treeview.move(item, '', 'end')
-            self.detached_items.clear()
+        if treeview is not self.treeview:
             return
 
-        # Iterate through all items
-        for item in all_items:
-            RecipeName = self.treeview.item(item, "values")[1]
+        # Group the recipes by parent once, then insert into Treeview from root (None)
+        children_by_parent = {}
+        for row in rows:
+            children_by_parent.setdefault(row[6], []).append(row)
+
+        self.insert_into_treeview(None, children_by_parent)
+
+        for row in rows:
+            self.recipe_search_index.add(row[0], row[1], row[2])
+        # Apply a search typed while the recipes were loading
+        self.recipe_search.run()
+
+
+    def update_treeview(self, *args):
+        self.recipe_search.schedule(self.search_var.get())
 
-            # Check if the search term is in the RecipeName
-            if search_term in RecipeName.lower():
-                # If the item is detached, reattach it
-                if item in self.detached_items:
-                    self.treeview.move(item, '', 'end')
-                    self.detached_items.remove(item)
-            else:
-                # If the item is attached, detach it
-                if item not in self.detached_items:
-                    self.treeview.detach(item)
-                    self.detached_items.append(item)
+
+    def show_recipe_search_result(self, matches):
+        """Shows the matching recipes with their parents, or all recipes when matches is None."""
+
+        if matches is None:
+            self.treeview.set_filter(None)
+        else:
+            self.treeview.set_filter(lambda row: row.iid in matches)
 
 
     def sort_column(self, col):
@@ -428,83 +545,45 @@ class App(customtkinter.CTk):
         self.treeview.heading(col, text=f"{self.original_headings[col]} {arrow}")
 
 
-    def insert_into_treeview(self,parent_item, rows, parent_items, depth=0):
-        cursor = None
-        cnxn = None
-
-        try:
-            sql_connection = SQLConnection()
-            sql_credentials = sql_connection.get_database_credentials("sql_config.json", "SQL_KEY")
-            cursor, cnxn = sql_connection.connect_to_database(sql_credentials)
-
-        except PyodbcError as e:
-            logger.error(f"Error in database connection: {e}")
-            showinfo(title="Info", message=self.texts["error_with_database"])
-
-        except IndexError:
-            logger.error("Database credentials seem to be incomplete.")
-            showinfo(title="Info", message=self.texts["error_with_database"])
+    def insert_into_treeview(self, parent_item, children_by_parent, depth=0):
+        """
+        Inserts the children of parent_item and their children into the Treeview.
 
-        except Exception as e:
-            logger.error(f"An unexpected error occurred: {e}")
-            showinfo(title="Info", message=self.texts["error_with_database"])
+        Parameters:
+        parent_item: The recipe id of the parent, None for the root recipes.
+        children_by_parent (dict): The recipe rows grouped by ParentID.
+        depth (int): The nesting depth of parent_item's children.
+        """
 
         if depth >= self.max_child_depth:
             return
 
-        if rows:
-            for row in rows:
-                recipe_id, RecipeName, RecipeComment, RecipeCreated, RecipeUpdated, recipe_last_saved, parent_id = row
-                if parent_id == parent_item:
-                    RecipeName = "          " * depth + RecipeName  # Indentation to reflect nesting
-                    has_children = self.check_has_children(recipe_id, cursor, cnxn)
-                    has_recipe_data = check_recipe_data(recipe_id)
-                    status_text = '✓' if has_recipe_data else 'Tomt'
-
-                    if recipe_last_saved is None:
-                        recipe_last_saved = ""
-                    else:
-                        recipe_last_saved = recipe_last_saved.strftime("%Y-%m-%d %H:%M")
-
-                    item = self.treeview.insert(parent_items.get(parent_id, ""), "end", iid=recipe_id, values=(recipe_id, RecipeName, RecipeComment,
-                                                          RecipeCreated.strftime("%Y-%m-%d %H:%M"),
-                                                          RecipeUpdated.strftime("%Y-%m-%d %H:%M"),
-                                                          recipe_last_saved,
-                                                          status_text))
-
-                    # If the recipe has children, change its background color
-                    if has_children:
-                        self.treeview.item(item, tags=('hasChildren',))
+        for row in children_by_parent.get(parent_item, []):
+            (recipe_id, RecipeName, RecipeComment, RecipeCreated, RecipeUpdated, recipe_last_saved,
+             parent_id, has_children, has_recipe_data) = row
 
-                    # If the recipe is a child, change its background color
-                    if parent_item is not None:
-                        self.treeview.item(item, tags=('isChild',))
+            RecipeName = "          " * depth + RecipeName  # Indentation to reflect nesting
+            status_text = '✓' if has_recipe_data else 'Tomt'
 
-                    parent_items[recipe_id] = item
-
-                    self.insert_into_treeview(recipe_id, rows, parent_items, depth + 1)
+            if recipe_last_saved is None:
+                recipe_last_saved = ""
+            else:
+                recipe_last_saved = recipe_last_saved.strftime("%Y-%m-%d %H:%M")
 
-        if cursor and cnxn:
-            sql_connection.disconnect_from_database(cursor, cnxn)
+            item = self.treeview.insert(parent_item if parent_item is not None else "", "end", iid=recipe_id,
+                                        values=(recipe_id, RecipeName, RecipeComment,
+                                                RecipeCreated.strftime("%Y-%m-%d %H:%M"),
+                                                RecipeUpdated.strftime("%Y-%m-%d %H:%M"),
+                                                recipe_last_saved,
+                                                status_text))
 
+            # If the recipe is a child or has children, change its background color
+            if parent_item is not None:
+                self.treeview.item(item, tags=('isChild',))
+            elif has_children:
+                self.treeview.item(item, tags=('hasChildren',))
 
-    def check_has_children(self, recipe_id, cursor, cnxn):
-        """
-        Checks if a recipe has any children.
-        """
-        if not cursor or not cnxn:
-            showinfo(title="Info", message=self.texts["error_with_database"])
-            return False
-
-        try:
-            cursor.execute('SELECT COUNT(*) FROM tblRecipe WHERE ParentID = ?', (recipe_id,))
-            result = cursor.fetchone()
-            return result and result[0] > 0
-
-        except Exception as e:
-            logger.error(f"An error occurred: {e}")
-            showinfo(title="Info", message=self.texts["error_with_database"])
-            return False
+            self.insert_into_treeview(recipe_id, children_by_parent, depth + 1)
 
 
     def item_selected(self,event):
@@ -540,7 +619,7 @@ class App(customtkinter.CTk):
     def create_opcua_error_treeview(self,parent):
         """Makes a datagid to see the errors from the units"""
 
-        self.opcua_treeview = ttk.Treeview(parent, columns=("date", "message", "identifier", "url"),
+        self.opcua_treeview = VirtualTreeview(parent, columns=("date", "message", "identifier", "url"),
                                       show="headings", height=10, style="Treeview")
 
         self.opcua_treeview.heading("#0", text="", anchor="w")
@@ -571,39 +650,7 @@ class App(customtkinter.CTk):
             logger.error("Error: No logs_treeview object")
             return
 
-        log_folder = "logs"
-
-        # Clear existing items in the treeview
-        for item in self.opcua_treeview.get_children():
-            self.opcua_treeview.delete(item)
-
-        log_entries = []
-        # Look for a log named opcua_alarms.log
-        log_files = [file for file in os.listdir(log_folder) if os.path.basename(file) == "opcua_alarms.log"]
-
-        for log_file in log_files:
-            with open(os.path.join(log_folder, log_file), "r") as file:
-                lines = file.readlines()
-                for line in lines:
-                    line = line.strip()
-                    parts = line.split("|", 3)  # Split into 4 parts
-                    if len(parts) == 4:
-                        date_time = parts[0]
-                        full_message = parts[3]
-                        url = full_message.split(",")[0].strip()
-                        message_parts = full_message.rsplit(",", 1)  # Split the message from the end, once
-                        if len(message_parts) == 2:
-                            message = message_parts[0].strip()
-                            identifier = message_parts[1].strip()
-                        else:
-                            message = full_message
-                            identifier = ""
-                        log_entries.append((date_time, message, identifier,url))
-
-        log_entries.sort(key=lambda x: datetime.strptime(x[0], "%Y:%m:%d %H:%M:%S"))
-
-        for entry in log_entries:
-            self.opcua_treeview.insert("", "end", values=entry)
+        self.refresh_log_view(self.opcua_treeview, self.alarm_log_reader)
 
 
 
@@ -671,7 +718,7 @@ class App(customtkinter.CTk):
         """Makes a datagrid to see the errors from example
         OPCUA, SQL or programming errors"""
 
-        self.logs_treeview = ttk.Treeview(parent, columns=("Date", "Severity", "File", "Message"),
+        self.logs_treeview = VirtualTreeview(parent, columns=("Date", "Severity", "File", "Message"),
                                     show="headings", height=10, style="Treeview")
 
         self.logs_treeview.heading("#0", text="", anchor="w")
@@ -704,29 +751,36 @@ class App(customtkinter.CTk):
             logger.error("Error: No logs_treeview object")
             return
 
-        log_folder="logs"
-        todays_date = datetime.now().date()
-        todays_date_str = todays_date.strftime("%Y:%m:%d")
+        self.refresh_log_view(self.logs_treeview, self.error_log_reader)
 
-        for item in self.logs_treeview.get_children():
-            self.logs_treeview.delete(item)
 
-        log_entries = []
-
-        log_files = [file for file in os.listdir(log_folder) if file.endswith(".log")]
+    def refresh_log_view(self, treeview, reader):
+        """
+        Reads the new log lines on a worker and adds them to the Treeview.
+        Only the change is applied when the Treeview shows the previous poll of the reader,
+        otherwise it is filled with all entries of the reader.
+        """
 
-        for log_file in log_files:
-            with open(os.path.join(log_folder, log_file), "r") as file:
-                for line in file:
-                    line = line.strip()
-                    if todays_date_str and "ERROR" in line:
-                        error = line.split("|", 3)
-                        log_entries.append(error)
+        def apply(delta):
+            if not treeview.winfo_exists():
+                return
+
+            view_key = str(treeview)
+            if self.log_view_generations.get(view_key) == delta.generation - 1:
+                if delta.removed:
+                    treeview.delete(*treeview.get_children()[:delta.removed])
+                for index, entry in delta.added:
+                    treeview.insert("", index, values=entry.values)
+                generation = delta.generation
+            else:
+                generation, entries = reader.entries()
+                treeview.delete(*treeview.get_children())
+                for entry in entries:
+                    treeview.insert("", "end", values=entry.values)
 
-        log_entries.sort(key=lambda x: datetime.strptime(x[0], "%Y:%m:%d %H:%M:%S"))
+            self.log_view_generations[view_key] = generation
 
-        for entry in log_entries:
-            self.logs_treeview.insert("", "end", values=entry)
+        self.dispatcher.submit(reader.poll, on_done=apply)
 
 
     def load_data_in_selected_recipe(self):
@@ -749,44 +803,24 @@ class App(customtkinter.CTk):
 
         except IndexError:
             showinfo(title="Information", message=self.texts["no_recipe_to_load_data_into"])
+            return
 
-        recipe_structure_id = None
-
-        try:
-            sql_connection = SQLConnection()
-            sql_credentials = sql_connection.get_database_credentials("sql_config.json", "SQL_KEY")
-            cursor, cnxn = sql_connection.connect_to_database(sql_credentials)
-
-            if cursor and cnxn:
-                query = "SELECT RecipeStructID FROM tblRecipe WHERE id = ?"
-                cursor.execute(query, (selected_id,))
-                rows = cursor.fetchall()
-                for row in rows:
-                    recipe_structure_id = row[0]
-
-        except PyodbcError as e:
-            logger.error(f"Error in database connection: {e}")
-            showinfo(title="Info", message=self.texts["error_with_database"])
-
-        except IndexError:
-            logger.error("Database credentials seem to be incomplete.")
-            showinfo(title="Info", message=self.texts["error_with_database"])
-
-        except Exception as e:
-            logger.error(f"An unexpected error occurred: {e}")
-            showinfo(title="Info", message=self.texts["error_with_database"])
-
-        finally:
-            if cursor and cnxn:
-                sql_connection.disconnect_from_database(cursor, cnxn)
-
-        if selected_id:
-            loading_ok = self.async_queue.put((from_units_to_sql_stepdata(selected_id, self.texts, recipe_structure_id)))
-        else:
+        if not selected_id:
             showinfo(title="Information", message=self.texts["no_recipe_to_load_data_into"])
             logger.error(f"Error while loading data for selected recipe ID: {selected_id}")
             return
 
+        def fetch_structure_id(cursor):
+            cursor.execute("SELECT RecipeStructID FROM tblRecipe WHERE id = ?", (selected_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+        def start_loading(recipe_structure_id):
+            self.async_queue.put(from_units_to_sql_stepdata(selected_id, self.texts, recipe_structure_id))
+
+        self.dispatcher.submit(SQLConnection().run_with_cursor, fetch_structure_id,
+                               on_done=start_loading, on_error=self.show_database_error)
+
 
     def archive_selected_recipe(self):
         """Archive the selected recipe"""
@@ -802,33 +836,12 @@ class App(customtkinter.CTk):
             showinfo(title='Information', message=self.texts["show_info_archive_selected_recipe_error"])
             return
 
-        sql_connection = SQLConnection()
-        sql_credentials = sql_connection.get_database_credentials("sql_config.json", "SQL_KEY")
-        cursor, cnxn = sql_connection.connect_to_database(sql_credentials)
-
-        if cursor and cnxn:
+        def archive(cursor):
+            cursor.execute("EXEC [RecipeDB].[dbo].[archive_recipe] @RecipeID=?", selected_id)
 
-            try:
-                cursor.execute("EXEC [RecipeDB].[dbo].[archive_recipe] @RecipeID=?", selected_id)
-                cnxn.commit()
-
-            except PyodbcError as e:
-                logger.error(f"Error in database connection: {e}")
-                showinfo(title="Info", message=self.texts["error_with_database"])
-
-            except IndexError:
-                logger.error("Database credentials seem to be incomplete.")
-                showinfo(title="Info", message=self.texts["error_with_database"])
-
-            except Exception as e:
-                logger.error(f"An unexpected error occurred: {e}")
-                showinfo(title="Info", message=self.texts["error_with_database"])
-
-            finally:
-                cursor.close()
-                cnxn.close()
-
-        self.recipe_page_command()
+        self.dispatcher.submit(SQLConnection().run_with_cursor, archive, commit=True,
+                               on_done=lambda _: self.recipe_page_command(),
+                               on_error=self.show_database_error)
 
 
     def use_selected_recipe(self):
@@ -852,43 +865,27 @@ class App(customtkinter.CTk):
         except IndexError as e:
             showinfo(title="Information", message=self.texts["show_info_error_loading_recipe"])
             logger.error(e)
+            return
 
-        cursor = None
-        cnxn = None
-        try:
-            sql_connection = SQLConnection()
-            sql_credentials = sql_connection.get_database_credentials("sql_config.json", "SQL_KEY")
-            cursor, cnxn = sql_connection.connect_to_database(sql_credentials)
-
-            if cursor and cnxn:
-                step_query = "SELECT * FROM ViewValues WHERE RecipeID = ?"
-                cursor.execute(step_query, (selected_id,))
-                step_data = cursor.fetchall()
+        def fetch_step_data(cursor):
+            step_query = "SELECT * FROM ViewValues WHERE RecipeID = ?"
+            cursor.execute(step_query, (selected_id,))
+            step_data = cursor.fetchall()
 
+            if step_data:
                 query = "UPDATE tblActiveRecipeList SET ActiveRecipeName = ?"
                 cursor.execute(query, (selected_name,))
-                cnxn.commit()
-
-        except PyodbcError as e:
-            logger.error(f"Error in database connection: {e}")
-
-        except IndexError:
-            logger.error("Database credentials seem to be incomplete.")
+            return step_data
 
-        except Exception as e:
-            logger.error(f"An unexpected error occurred: {e}")
-
-        finally:
-            if cursor and cnxn:
-                sql_connection.disconnect_from_database(cursor, cnxn)
-
-        if step_data:
-            self.units = self.async_queue.put(from_sql_to_units_stepdata(step_data,self.texts, selected_name))
-            logger.info(f"Successfully updated the active recipe to: {selected_name}")
+        def send_step_data(step_data):
+            if step_data:
+                self.units = self.async_queue.put(from_sql_to_units_stepdata(step_data,self.texts, selected_name))
+                logger.info(f"Successfully updated the active recipe to: {selected_name}")
+            else:
+                showinfo(title='Information', message=self.texts["show_info_use_selected_recipe_error"])
 
-        else:
-            showinfo(title='Information', message=self.texts["show_info_use_selected_recipe_error"])
-            return
+        self.dispatcher.submit(SQLConnection().run_with_cursor, fetch_step_data, commit=True,
+                               on_done=send_step_data, on_error=self.show_database_error)
 
 
     def delete_recipe(self, recipe_name):
@@ -1055,55 +1052,33 @@ class App(customtkinter.CTk):
             selected_id = self.treeview.item(selected_item, 'values')[0]
         except IndexError:
             showinfo(title='Information', message=self.texts["show_info_edit_recipe_no_selected"])
+            return
 
-        cursor = None
-        cnxn = None
-
-        try:
-            sql_connection = SQLConnection()
-            sql_credentials = sql_connection.get_database_credentials("sql_config.json", "SQL_KEY")
-            cursor, cnxn = sql_connection.connect_to_database(sql_credentials)
-
-            if cursor and cnxn:
-
-                query = """
-                SELECT [UnitID], [TagName], [TagValue], [TagDataType], [UnitName]
-                FROM [RecipeDB].[dbo].[viewValues]
-                WHERE RecipeID = ?
-                ORDER BY RecipeID, UnitID,
-                    CASE WHEN CHARINDEX('[', TagName) > 0 AND CHARINDEX(']', TagName) > CHARINDEX('[', TagName)
-                         THEN CAST(SUBSTRING(TagName, CHARINDEX('[', TagName) + 1, CHARINDEX(']', TagName) - CHARINDEX('[', TagName) - 1) AS INT)
-                    END,
-                    TagName
-                """
-
-                params = (selected_id,)
-                cursor.execute(query, params)
-
-                rows = cursor.fetchall()
-                if rows:
-                    logger.info(f"Fetched {len(rows)} rows for editing recipe ID: {selected_id}")
-                    self.open_edit_steps_window(rows,selected_id)
-                else:
-                    logger.error(f"No data found for editing recipe ID: {selected_id}")
-                    showinfo(title='Information', message=self.texts["show_info_edit_recipe_no_data"])
-                    return
-
-        except PyodbcError as e:
-            logger.error(f"Error in database connection: {e}")
-            showinfo(title="Info", message=self.texts["error_with_database"])
-
-        except IndexError:
-            logger.error("Database credentials seem to be incomplete.")
-            showinfo(title="Info", message=self.texts["error_with_database"])
-
-        except Exception as e:
-            logger.error(f"An unexpected error occurred: {e}")
-            showinfo(title="Info", message=self.texts["error_with_database"])
+        def fetch_values(cursor):
+            query = """
+            SELECT [UnitID], [TagName], [TagValue], [TagDataType], [UnitName]
+            FROM [RecipeDB].[dbo].[viewValues]
+            WHERE RecipeID = ?
+            ORDER BY RecipeID, UnitID,
+                CASE WHEN CHARINDEX('[', TagName) > 0 AND CHARINDEX(']', TagName) > CHARINDEX('[', TagName)
+                     THEN CAST(SUBSTRING(TagName, CHARINDEX('[', TagName) + 1, CHARINDEX(']', TagName) - CHARINDEX('[', TagName) - 1) AS INT)
+                END,
+                TagName
+            """
+
+            cursor.execute(query, (selected_id,))
+            return cursor.fetchall()
+
+        def open_editor(rows):
+            if rows:
+                logger.info(f"Fetched {len(rows)} rows for editing recipe ID: {selected_id}")
+                self.open_edit_steps_window(rows,selected_id)
+            else:
+                logger.error(f"No data found for editing recipe ID: {selected_id}")
+                showinfo(title='Information', message=self.texts["show_info_edit_recipe_no_data"])
 
-        finally:
-            if cursor and cnxn:
-                sql_connection.disconnect_from_database(cursor, cnxn)
+        self.dispatcher.submit(SQLConnection().run_with_cursor, fetch_values,
+                               on_done=open_editor, on_error=self.show_database_error)
 
 
     def create_meny_buttons(self, parent):
@@ -1306,6 +1281,7 @@ def main():
 
     app.mainloop()
 
+    app.dispatcher.shutdown()
     async_queue.put(None)
     async_thread.join()
 
@@ -1,8 +1,144 @@
-import json
-from pathlib import Path
+"""
+This file contains the functions that check if the nearby units are alive.
+Every unit is pinged and its OPC UA port is connected to, all units at the same time. The results are
+cached for a short time, so pressing the check button again does not wait for the timeouts again.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
 
 from ping3 import ping
 
+from .config_handler import ConfigHandler
+
+
+# Seconds a result is reused before the unit is checked again
+CACHE_TTL_SECONDS = 10.0
+
+_cache: Dict[Tuple[str, int], Tuple[float, "UnitStatus"]] = {}
+_cache_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class UnitStatus:
+    name: str
+    ip_address: str
+    port: int
+    ping_alive: bool
+    port_open: bool
+    # Best ping time, None if no ping was answered
+    response_time_ms: Optional[float] = None
+
+
+    @property
+    def alive(self) -> bool:
+        return self.ping_alive
+
+
+def load_unit_addresses() -> List[Tuple[str, str, int]]:
+    """
+    Reads the units from configs/ip_addresses.json.
+
+    Returns
+    -------
+    (name, ip address, port) of every unit, in the order of the file.
+    """
+
+    units = []
+    for name, address in ConfigHandler().get_config_data("ip_addresses.json").items():
+        ip_address, port = address.split(":")
+        units.append((name, ip_address, int(port)))
+    return units
+
+
+def probe_unit(name: str, ip_address: str, port: int, retries: int = 2, timeout: float = 1.0) -> UnitStatus:
+    """
+    Pings a unit retries times and connects to its OPC UA port.
+    The ping is alive only when every ping was answered, like before.
+    """
+
+    response_times = []
+    for _ in range(retries):
+        response_time = ping(ip_address, timeout=timeout)
+        if response_time:
+            response_times.append(response_time)
+
+    try:
+        with socket.create_connection((ip_address, port), timeout=timeout):
+            port_open = True
+    except OSError:
+        port_open = False
+
+    return UnitStatus(
+        name=name,
+        ip_address=ip_address,
+        port=port,
+        ping_alive=len(response_times) == retries,
+        port_open=port_open,
+        response_time_ms=min(response_times) * 1000 if response_times else None
+    )
+
+
+def check_units(
+    on_result: Optional[Callable[[UnitStatus], None]] = None,
+    retries: int = 2,
+    timeout: float = 1.0,
+    use_cache: bool = True
+) -> List[UnitStatus]:
+    """
+    Checks all units at the same time.
+
+    Parameters
+    ----------
+    on_result - Called with the status of a unit as soon as it is known, from the calling thread
+    retries - Number of pings per unit
+    timeout - Seconds to wait for a ping answer or the port connection
+    use_cache - Reuse results younger than CACHE_TTL_SECONDS
+
+    Returns
+    -------
+    The status of every unit, in the order of ip_addresses.json.
+    """
+
+    units = load_unit_addresses()
+    statuses: Dict[Tuple[str, int], UnitStatus] = {}
+    to_probe = []
+
+    now = time.monotonic()
+    with _cache_lock:
+        for name, ip_address, port in units:
+            cached = _cache.get((ip_address, port))
+            if use_cache and cached is not None and now - cached[0] < CACHE_TTL_SECONDS:
+                statuses[(ip_address, port)] = cached[1]
+            else:
+                to_probe.append((name, ip_address, port))
+
+    if on_result is not None:
+        for status in statuses.values():
+            on_result(status)
+
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=len(to_probe), thread_name_prefix="ip_check") as executor:
+            futures = [executor.submit(probe_unit, name, ip_address, port, retries, timeout)
+                       for name, ip_address, port in to_probe]
+
+            for future in as_completed(futures):
+                status = future.result()
+                with _cache_lock:
+                    _cache[(status.ip_address, status.port)] = (time.monotonic(), status)
+                statuses[(status.ip_address, status.port)] = status
+                if on_result is not None:
+                    on_result(status)
+
+    return [statuses[(ip_address, port)] for _, ip_address, port in units]
+
 
 def check_ip(retries=2):
     """
@@ -10,22 +146,9 @@ def check_ip(retries=2):
     Place the IP addresses in the configs/ip_addresses.json file.
     """
 
-    results = []
-
-    output_path = Path(__file__).parent.parent
+    return [(status.name, status.ip_address, status.alive) for status in check_units(retries=retries)]
 
-    with open (output_path / "configs" / "ip_addresses.json",encoding="UTF8") as addresses:
-        data:dict = json.load(addresses)
-        for name, ips in data.items():
-            ip_address, _ = ips.split(":")
-            success_count = 0
-            for _ in range(retries):
-                response_time = ping(ip_address)
-                if response_time is not None:
-                    success_count += 1
-            status = success_count == 2
-            results.append((name, ip_address, status))
-        return results
 
 if __name__ == "__main__":
-    check_ip()
+    for unit_status in check_units():
+        print(unit_status)
@@ -0,0 +1,163 @@
+"""
+This file contains the LiveValueStore class and the subscription that fills it.
+The production counters and the configured KPI nodes are monitored with an OPC UA data change
+subscription, so the PLC only sends a value when it changes and the webserver reads it from memory.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import asyncio
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from asyncua import Client, Node, ua
+
+from .create_log import setup_logger
+
+
+logger = setup_logger("Live_values")
+
+
+class LiveValueStore:
+    """
+    Thread-safe store of the latest value of every monitored node, keyed by name.
+
+    connected is True while the subscription is running, when it is False the values may be
+    outdated and the reader should fall back to polling. Listeners are called with the name and
+    the new value on the thread that received the change.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._values: Dict[str, Any] = {}
+        self._listeners: List[Callable[[str, Any], None]] = []
+        self.connected = False
+
+
+    def update(self, name: str, value: Any) -> None:
+        with self._lock:
+            self._values[name] = value
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            try:
+                listener(name, value)
+            except Exception as exeption:
+                logger.warning(f"Error in live value listener: {exeption}")
+
+
+    def get(self, name: str, default: Any = None) -> Any:
+        with self._lock:
+            return self._values.get(name, default)
+
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns a copy of all values."""
+
+        with self._lock:
+            return dict(self._values)
+
+
+    def add_listener(self, listener: Callable[[str, Any], None]) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+
+
+    def set_connected(self, connected: bool) -> None:
+        with self._lock:
+            self.connected = connected
+
+
+class LiveValueHandler:
+    """
+    Handles the data change notifications of the live value subscription.
+    """
+
+    def __init__(self, store: LiveValueStore, names_by_node_id: Dict[ua.NodeId, str]):
+        self.store = store
+        self.names_by_node_id = names_by_node_id
+
+
+    def datachange_notification(self, node: Node, val, data):
+        name = self.names_by_node_id.get(node.nodeid)
+        if name is not None:
+            self.store.update(name, val)
+
+
+    def status_change_notification(self, status: ua.StatusChangeNotification):
+        logger.warning(f"Live value subscription status changed: {status}")
+        self.store.set_connected(False)
+
+
+async def run_live_subscription(
+    store: LiveValueStore,
+    get_url: Callable,
+    nodes: Dict[str, str],
+    publishing_interval_ms: int = 500,
+    reconnect_delay: float = 30.0
+) -> None:
+    """
+    Keeps a data change subscription on the nodes and writes their values into the store.
+    Reconnects with reconnect_delay seconds between the attempts when the connection is lost.
+
+    Parameters
+    ----------
+    store - The store the values are written to
+    get_url - Coroutine function that returns the url of the OPC UA server
+    nodes - Name and node id string of every node to monitor
+    publishing_interval_ms - The publishing interval of the subscription
+    reconnect_delay - Seconds to wait before reconnecting
+    """
+
+    from .opcua_client import connect_opcua, get_opcua_credentials
+
+    names_by_node_id = {ua.NodeId.from_string(node_id): name for name, node_id in nodes.items()}
+
+    while True:
+        client: Optional[Client] = None
+
+        try:
+            url = await get_url()
+            encrypted_username, encrypted_password = get_opcua_credentials()
+            client = await connect_opcua(url, encrypted_username, encrypted_password)
+
+            if client is None:
+                raise ConnectionError(f"Could not connect to {url}")
+
+            handler = LiveValueHandler(store, names_by_node_id)
+            subscription = await client.create_subscription(publishing_interval_ms, handler)
+            handles = await subscription.subscribe_data_change(
+                [client.get_node(node_id) for node_id in names_by_node_id])
+
+            failed = [name for name, handle in zip(names_by_node_id.values(), handles)
+                      if isinstance(handle, ua.StatusCode)]
+            if failed:
+                logger.warning(f"Could not monitor {failed}")
+
+            store.set_connected(True)
+            logger.info(f"Subscribed to {len(names_by_node_id) - len(failed)} live values on {url}")
+
+            while True:
+                await asyncio.sleep(1)
+                await client.check_connection()
+
+                if not store.connected:
+                    raise ConnectionError("Live value subscription is not running")
+
+        except asyncio.CancelledError:
+            store.set_connected(False)
+            raise
+
+        except Exception as exeption:
+            store.set_connected(False)
+            logger.warning(f"Live value subscription stopped: {exeption}. Reconnecting in {reconnect_delay} seconds")
+
+        finally:
+            if client is not None:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
+
+        await asyncio.sleep(reconnect_delay)
@@ -0,0 +1,232 @@
+"""
+This file contains the LogTailReader class, which follows the log files like tail -f.
+It remembers how far every file has been read and handles the rotation done by RotatingFileHandler,
+so a refresh only reads and parses the lines written since the last one.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+from .create_log import setup_logger
+
+
+logger = setup_logger("Log_tail")
+
+# Parses one line of a log file into the values shown in a view, or None to skip the line.
+# It gets the file name and the line without the newline.
+LineParser = Callable[[str, str], Optional[tuple]]
+
+
+@dataclass(frozen=True)
+class LogEntry:
+    timestamp: datetime
+    seq: int
+    values: tuple
+
+
+@dataclass
+class LogDelta:
+    """
+    The change of the entries since the last poll.
+
+    removed - Number of entries removed from the start, the oldest ones
+    added - The new entries with their index after the change, in ascending index order
+    generation - Increased by one for every poll
+    """
+    removed: int
+    added: List[Tuple[int, LogEntry]]
+    generation: int
+
+
+@dataclass
+class _FileState:
+    device: int
+    inode: int
+    offset: int
+    # None until the first whole line has been found, when reading starts in the middle of the file
+    partial: Optional[bytes] = field(default=b"")
+
+
+def parse_log_time(text: str) -> Optional[datetime]:
+    """Parses the '%Y:%m:%d %H:%M:%S' time of create_log without strptime."""
+
+    try:
+        return datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                        int(text[11:13]), int(text[14:16]), int(text[17:19]))
+    except (ValueError, IndexError):
+        return None
+
+
+class LogTailReader:
+    """
+    Reads new lines from the log files in a folder and keeps the newest max_entries of them sorted by time.
+
+    The first time a file is seen only its last initial_tail_bytes are read. When a file is rotated
+    the rest of the old file is read from its new name before the new file is started.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        file_filter: Callable[[str], bool],
+        line_parser: LineParser,
+        max_entries: int = 5000,
+        initial_tail_bytes: int = 4 * 1024 * 1024
+    ) -> None:
+        """
+        Parameters
+        ----------
+        folder - The folder of the log files
+        file_filter - Returns True for the file names to read
+        line_parser - Turns a line into the values of an entry, see LineParser
+        max_entries - Max number of entries kept, the oldest are dropped first
+        initial_tail_bytes - How much of the end of a file is read the first time
+        """
+
+        self.folder = folder
+        self.file_filter = file_filter
+        self.line_parser = line_parser
+        self.max_entries = max_entries
+        self.initial_tail_bytes = initial_tail_bytes
+
+        self._lock = threading.Lock()
+        self._files: Dict[str, _FileState] = {}
+        self._entries = SortedList(key=lambda entry: (entry.timestamp, entry.seq))
+        self._seq = 0
+        self.generation = 0
+
+
+    def entries(self) -> Tuple[int, List[LogEntry]]:
+        """Returns the generation and a copy of the entries, oldest first."""
+
+        with self._lock:
+            return self.generation, list(self._entries)
+
+
+    def poll(self) -> LogDelta:
+        """Reads the new lines of every file and returns the change of the entries."""
+
+        with self._lock:
+            first_new_seq = self._seq
+
+            try:
+                file_names = [name for name in os.listdir(self.folder) if self.file_filter(name)]
+            except FileNotFoundError:
+                file_names = []
+
+            for file_name in file_names:
+                self._entries.update(self._read_new_lines(file_name))
+
+            for file_name in set(self._files) - set(file_names):
+                del self._files[file_name]
+
+            removed = 0
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                removed = sum(1 for entry in self._entries[:overflow] if entry.seq < first_new_seq)
+                del self._entries[:overflow]
+
+            added = []
+            if self._seq != first_new_seq:
+                added = [(index, entry) for index, entry in enumerate(self._entries) if entry.seq >= first_new_seq]
+
+            self.generation += 1
+            return LogDelta(removed, added, self.generation)
+
+
+    def _read_new_lines(self, file_name: str) -> List[LogEntry]:
+        path = os.path.join(self.folder, file_name)
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return []
+
+        state = self._files.get(file_name)
+        entries: List[LogEntry] = []
+
+        if state is not None and (state.device, state.inode) != (stat.st_dev, stat.st_ino):
+            # Rotated, finish the old file under its new name first
+            rotated_path = self._find_by_inode(state)
+            if rotated_path is not None:
+                entries.extend(self._read_from(file_name, rotated_path, state))
+            state = None
+
+        elif state is not None and stat.st_size < state.offset:
+            logger.info(f"{file_name} was truncated, reading it from the start")
+            state = None
+
+        if state is None:
+            offset = max(0, stat.st_size - self.initial_tail_bytes) if file_name not in self._files else 0
+            state = _FileState(stat.st_dev, stat.st_ino, offset)
+            if offset > 0:
+                # Starting in the middle of a line, skip up to the next one
+                state.partial = None
+
+        self._files[file_name] = state
+
+        if stat.st_size > state.offset:
+            entries.extend(self._read_from(file_name, path, state))
+
+        return entries
+
+
+    def _read_from(self, file_name: str, path: str, state: _FileState) -> List[LogEntry]:
+        try:
+            with open(path, "rb") as file:
+                file.seek(state.offset)
+                data = file.read()
+        except OSError as exeption:
+            logger.warning(f"Could not read {path}: {exeption}")
+            return []
+
+        state.offset += len(data)
+
+        if state.partial is None:
+            newline = data.find(b"\n")
+            if newline == -1:
+                return []
+            data = data[newline + 1:]
+            state.partial = b""
+
+        lines = (state.partial + data).split(b"\n")
+        state.partial = lines.pop()
+
+        entries = []
+        for raw_line in lines:
+            line = raw_line.decode("utf-8", errors="replace").rstrip("\r")
+            values = self.line_parser(file_name, line)
+            if values is None:
+                continue
+            timestamp = parse_log_time(values[0])
+            if timestamp is None:
+                continue
+            entries.append(LogEntry(timestamp, self._seq, values))
+            self._seq += 1
+
+        return entries
+
+
+    def _find_by_inode(self, state: _FileState) -> Optional[str]:
+        try:
+            names = os.listdir(self.folder)
+        except FileNotFoundError:
+            return None
+
+        for name in names:
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) == (state.device, state.inode):
+                return path
+        return None
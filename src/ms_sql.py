@@ -9,8 +9,13 @@ from typing import List, Tuple, Union
 from asyncua import ua, Node, Client
 
 from .create_log import setup_logger
-from .opcua_client import get_servo_steps, connect_opcua, write_tag
+from .opcua_client import get_servo_steps, write_tag, write_tags
+from .opcua_session_pool import get_session_pool
 from .sql_connection import SQLConnection
+from .async_sql import AsyncSQLConnection
+from .config_handler import ConfigHandler
+from .plant_topology import plant_topology
+from .recipe_verifier import plc_values_from_steps, tag_name_from_node_id, verify_recipe
 
 
 logger = setup_logger("MS_SQL")
@@ -18,44 +23,73 @@ logger = setup_logger("MS_SQL")
 
 STEPDATA_ORIGIN = 'ns=3;s="StepData"."RunningSteps"."Steps"'
 
+# Async access to the database for the coroutines in this module
+async_db = AsyncSQLConnection()
 
-async def fetch_unit_info(struct_data_rows: List[Tuple], recipe_structure_id: int) -> Tuple[List[str], List[int], List[str]]:
-    unit_ids_list = [row[0] for row in struct_data_rows if row[2] == recipe_structure_id]
-    ip_address_list = [row[4] for row in struct_data_rows if row[2] == recipe_structure_id]
-    data_origin_list = [row[3] for row in struct_data_rows if row[2] == recipe_structure_id]
-    return ip_address_list, unit_ids_list, data_origin_list
 
+def get_recipe_transfer_config() -> dict:
+    """Gets the concurrency settings for loading and sending recipes, with defaults for missing keys."""
+
+    defaults = {
+        "max_concurrent_units": 4,
+        "unit_timeout_seconds": 60,
+        "clear_running_steps_wait_seconds": 2,
+        "verify_float_tolerance": 1e-6
+    }
 
-def establish_sql_connection():
     try:
-        sql_connection = SQLConnection()
-        sql_credentials = sql_connection.get_database_credentials("sql_config.json", "SQL_KEY")
-        cursor, cnxn = sql_connection.connect_to_database(sql_credentials)
-        return sql_connection, cursor, cnxn
-    
-    except PyodbcError as e:
-        logger.error(f"Error in database connection: {e}")
-        return None, None, None
+        config = ConfigHandler().recipe_transfer_config
+    except Exception as e:
+        logger.error(f"Could not read recipe_transfer_config.json, using defaults: {e}")
+        config = {}
 
-    except IndexError:
-        logger.error("Database credentials seem to be incomplete.")
-        return None, None, None
+    return {key: config.get(key, default) for key, default in defaults.items()}
 
-    except Exception as e:
-        logger.error(f"Error establishing SQL connection: {e}")
-        return None, None, None
+
+async def run_for_units(unit_jobs, max_concurrent_units, unit_timeout):
+    """
+    Runs one coroutine per unit concurrently, at most max_concurrent_units at a time.
+
+    Args:
+        unit_jobs (list): List of (unit_id, coroutine) tuples
+        max_concurrent_units (int): Max number of units handled at the same time
+        unit_timeout (float): Seconds before the work for a unit is cancelled
+
+    Returns:
+        list: The result of every coroutine in the same order, None for units that failed or timed out
+    """
+
+    semaphore = asyncio.Semaphore(max(1, int(max_concurrent_units)))
+
+    async def run(unit_id, coro):
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(coro, timeout=unit_timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Unit id: {unit_id} did not finish within {unit_timeout} seconds")
+            except Exception as exception:
+                logger.error(f"Error while handling unit id: {unit_id}: {exception}")
+            return None
+
+    return await asyncio.gather(*(run(unit_id, coro) for unit_id, coro in unit_jobs))
 
 
 def get_unit_name(unit_id):
-    unit_mapping = {
-        1: "SMC1",
-        2: "SMC2",
-        3: "Master"
-    }
-    return unit_mapping.get(unit_id, f"Unknown unit {unit_id}")
+    """The name of a unit from the plant topology, which has been loaded by the operation calling this."""
+    return plant_topology.unit_name(unit_id)
 
 
 def insert_step_data_into_sql(cursor, steps, selected_id, unit_id_to_get):
+    """
+    Inserts all step data of a unit with one parameter-array call to add_value.
+
+    The values are sent with fast_executemany, so the whole unit goes to the server in a single
+    round trip. If the batch fails it is rolled back to a savepoint and the rows are executed one
+    by one, so the failing tags are logged and the rest is still stored.
+
+    Returns:
+        tuple: Success flag and a dict with the number of steps per unit name
+    """
 
     stored_procedure_name = 'add_value'
     tag_name_param_name = 'TagName'
@@ -70,26 +104,66 @@ def insert_step_data_into_sql(cursor, steps, selected_id, unit_id_to_get):
     recipe_length = len(steps)
     unitname = get_unit_name(unit_id_to_get)
     recipe_lengths_per_unit[unitname] = recipe_length
+
+    # Values are sent as text, the same way the stored procedure received them before
+    params = []
     for step_dict in steps:
-        logger.info(f"Processing step: {step_dict}")
         for prop, prop_data in step_dict.items():
-            tag_name = prop_data["Node"].nodeid.Identifier
-            tag_value = prop_data["Value"]
-            tag_datatype = prop_data["Datatype"].name
-            recipe_id = selected_id
+            params.append((prop_data["Node"].nodeid.Identifier,
+                           str(prop_data["Value"]),
+                           prop_data["Datatype"].name,
+                           selected_id,
+                           unit_id_to_get))
 
-            try:
-                cursor.execute(f"EXEC {stored_procedure_name} \
-                        @{tag_name_param_name}='{tag_name}', \
-                        @{tag_value_param_name}={tag_value}, \
-                        @{tag_datatype_param_name}={tag_datatype}, \
-                        @{recipe_id_param_name}={recipe_id},\
-                        @{unit_id_param_name}={unit_id_to_get};")
-            except Exception as exception:
-                logger.error(exception)
-                all_units_processed_successfully = False
-    return all_units_processed_successfully, recipe_lengths_per_unit
+    logger.info(f"Inserting {len(params)} tags from {recipe_length} steps for unit: {unitname}")
+
+    query = (f"EXEC {stored_procedure_name} "
+             f"@{tag_name_param_name}=?, "
+             f"@{tag_value_param_name}=?, "
+             f"@{tag_datatype_param_name}=?, "
+             f"@{recipe_id_param_name}=?, "
+             f"@{unit_id_param_name}=?;")
 
+    if not params:
+        return all_units_processed_successfully, recipe_lengths_per_unit
+
+    # pyodbc runs with autocommit off, so SQL Server is in implicit transaction mode, where SAVE TRANSACTION
+    # fails when no transaction is open. A savepoint is only needed when an earlier unit has opened one.
+    cursor.execute("SELECT @@TRANCOUNT;")
+    in_transaction = cursor.fetchone()[0] > 0
+
+    try:
+        if in_transaction:
+            cursor.execute("SAVE TRANSACTION step_data_bulk;")
+        cursor.fast_executemany = True
+        cursor.executemany(query, params)
+        return all_units_processed_successfully, recipe_lengths_per_unit
+
+    except Exception as exception:
+        logger.error(f"Bulk insert failed for unit: {unitname}, inserting row by row. Error: {exception}")
+
+    finally:
+        cursor.fast_executemany = False
+
+    try:
+        if in_transaction:
+            cursor.execute("ROLLBACK TRANSACTION step_data_bulk;")
+        else:
+            # Nothing else has been written in this transaction, so all of it is this unit's batch
+            cursor.connection.rollback()
+    except Exception as exception:
+        logger.error(f"Could not roll back to the savepoint, rolling back the whole transaction: {exception}")
+        cursor.connection.rollback()
+        # The units stored before this one were rolled back too
+        all_units_processed_successfully = False
+
+    for row_params in params:
+        try:
+            cursor.execute(query, row_params)
+        except Exception as exception:
+            logger.error(f"Failed to insert {row_params[0]}: {exception}")
+            all_units_processed_successfully = False
+    return all_units_processed_successfully, recipe_lengths_per_unit
 
 
 def insert_opcua_value_into_sql(cursor, data_place, opcua_value, datatype, selected_id, unit_id_to_get):
@@ -127,70 +201,92 @@ async def from_units_to_sql_stepdata(selected_id, texts, recipe_structure_id):
     """
     from .opcua_client import get_opcua_value
  
-    struct_data_rows = await get_recipe_structures_map()
-    if struct_data_rows:
-        ip_address_list, unit_ids_list, data_origin_list = await fetch_unit_info(struct_data_rows, recipe_structure_id)
-    else:
+    if not await plant_topology.load():
         logger.error("No recipe structure mappings were fetched from the database")
         display_info(title="Info", message=texts["Show_info_general_sql_error"])
         return None
 
-    sql_connection, cursor, cnxn = establish_sql_connection()
-    if not cursor or not cnxn:
-        logger.error("Database connection failed.")
-        display_info(title="Info", message=texts["Show_info_general_sql_error"])
-        return None
-
     all_units_processed_successfully = True
     recipe_lengths_per_unit = {}
 
-    # Iterating through units and executing SQL stored procedure based on their step data
-    for address, unit_id, data_origin in zip(ip_address_list, unit_ids_list, data_origin_list):
+    # Reading the data from all units concurrently
+    transfer_config = get_recipe_transfer_config()
+    units = [(unit.url, unit.unit_id, unit.data_origin) for unit in plant_topology.structure_units(recipe_structure_id)]
+    unit_jobs = []
+    for address, unit_id, data_origin in units:
         logger.info(f"Connecting to unit id: {unit_id}")
-
         if data_origin == STEPDATA_ORIGIN:
-            steps = await get_servo_steps(address, data_origin)
+            unit_jobs.append((unit_id, get_servo_steps(address, data_origin)))
+        else:
+            unit_jobs.append((unit_id, get_opcua_value(address, data_origin)))
 
-            if steps:
-                success, lengths = insert_step_data_into_sql(cursor, steps, selected_id, unit_id)
-                all_units_processed_successfully &= success
-                recipe_lengths_per_unit.update(lengths)
+    unit_results = await run_for_units(unit_jobs,
+                                       transfer_config["max_concurrent_units"],
+                                       transfer_config["unit_timeout_seconds"])
+
+    # Checking what every unit returned before anything is written to SQL
+    units_to_store = []
+    for (address, unit_id, data_origin), unit_result in zip(units, unit_results):
+
+        if data_origin == STEPDATA_ORIGIN:
+            if unit_result:
+                units_to_store.append((unit_id, data_origin, unit_result))
             else:
                 unit_name = get_unit_name(unit_id)
                 display_info(title="Info", message=texts["show_info_Could_not_load_data_from"] + unit_name)
                 all_units_processed_successfully = False
 
         else:
-            success, value, datatype = await get_opcua_value(address, data_origin)
+            success, value, datatype = unit_result or (False, None, None)
             if success == False:
                 logger.error(f"Failed to get OPCUA value for unit_id: {unit_id}")
                 display_info(title="Info", message=texts["show_info_Could_not_load_data_from"] + get_unit_name(unit_id))
                 return None
 
-            all_units_processed_successfully &= success
+            units_to_store.append((unit_id, data_origin, (value, datatype)))
 
-            success = insert_opcua_value_into_sql(cursor, data_origin, value, datatype, selected_id, unit_id)
-            all_units_processed_successfully &= success
+    # Executing SQL stored procedure based on the step data of every unit
+    def store_units(cursor):
+        all_stored = True
+        lengths_per_unit = {}
+        for unit_id, data_origin, unit_data in units_to_store:
+            if data_origin == STEPDATA_ORIGIN:
+                success, lengths = insert_step_data_into_sql(cursor, unit_data, selected_id, unit_id)
+                lengths_per_unit.update(lengths)
+            else:
+                value, datatype = unit_data
+                success = insert_opcua_value_into_sql(cursor, data_origin, value, datatype, selected_id, unit_id)
+            all_stored &= success
+        return all_stored, lengths_per_unit
 
-    cursor.commit()
-    if cursor and cnxn:
-        sql_connection.disconnect_from_database(cursor, cnxn)
+    try:
+        success, recipe_lengths_per_unit = await async_db.run_with_cursor(store_units, commit=True)
+        all_units_processed_successfully &= success
+
+    except (PyodbcError, IndexError, FileNotFoundError, ValueError) as e:
+        logger.error(f"Database connection failed: {e}")
+        display_info(title="Info", message=texts["Show_info_general_sql_error"])
+        return None
+
+    except Exception as e:
+        logger.error(f"Error establishing SQL connection: {e}")
+        display_info(title="Info", message=texts["Show_info_general_sql_error"])
+        return None
 
     if all_units_processed_successfully:
-        message_detail = (
-            f"SMC1 Steg: {recipe_lengths_per_unit.get('SMC1', 'N/A')}\n"
-            f"SMC2 Steg: {recipe_lengths_per_unit.get('SMC2', 'N/A')}\n"
-            f"Tryck ok för att börja kontrollera alla steg i receptet."
-        )
+        message_detail = "".join(f"{unit_name} Steg: {length}\n" for unit_name, length in recipe_lengths_per_unit.items())
+        message_detail += "Tryck ok för att börja kontrollera alla steg i receptet."
         display_info(title='Information',
                      message=texts["show_info_from_all_units_processed_successfully"],
                      detail=message_detail)
 
         logger.info(f"Data loaded successfully for selected recipe ID: {selected_id}")
 
-        recipe_checked = check_recipe_data(selected_id)
+        recipe_checked = await async_db.run(check_recipe_data, selected_id)
 
-        db_opcua_not_same, error = await db_opcua_data_checker(selected_id, recipe_structure_id, texts)
+        # The values that were just read are compared with what was stored, no need to read the units again
+        db_opcua_not_same, error = await db_opcua_data_checker(selected_id, recipe_structure_id, texts,
+                                                               plc_values_by_unit(units_to_store))
 
         if error:
             display_info(title="Info", message=texts["general_error"])
@@ -219,18 +315,32 @@ def display_info(title, message, detail=None):
 
 
 async def write_data_to_unit(client, namespace_index, filtered_data):
+    """
+    Writes all tags of a unit in batches, using the TagDataType stored with the recipe
+    so the data types do not have to be read from the PLC first.
+
+    Returns:
+        bool: True if every tag was written
+    """
+
+    tags = []
     for row in filtered_data:
         _, _, _, tag_name, tag_value, tag_datatype, _  = row
-        tag_name = f"ns={namespace_index};s={tag_name}"
-        result, fault = await write_tag(client, tag_name, tag_value)
-        if fault:
-            logger.error(f"Failed to write {tag_name} with value {tag_value}")
-            return False
-    return True
+        tags.append((f"ns={namespace_index};s={tag_name}", tag_value, tag_datatype))
+
+    statuses = await write_tags(client, tags)
+
+    all_tags_written = True
+    for tag_name, tag_value, _ in tags:
+        status = statuses[tag_name]
+        if not status.is_good():
+            logger.error(f"Failed to write {tag_name} with value {tag_value}: {status.name}")
+            all_tags_written = False
+    return all_tags_written
 
 
 async def connect_to_opcua_server(address, encrypted_username, encrypted_password):
-    client: Client = await connect_opcua(address, encrypted_username, encrypted_password)
+    client: Client = await get_session_pool().get_client(address, encrypted_username, encrypted_password)
     if not client:
         logger.error(f"Failed to connect to OPCUA server at {address}")
         return None
@@ -251,34 +361,44 @@ async def from_sql_to_units_stepdata(step_data, texts, selected_name):
 
     all_units_processed_successfully = True
     units = await get_units()
+    transfer_config = get_recipe_transfer_config()
 
-    for unit in units:
-        unit_id, address = unit
+    output_path = Path(__file__).parent.parent
+    with open(output_path / "configs" / "name_space.json", encoding="UTF8") as namespace:
+        data = json.load(namespace)
+        siemens_namespace_uri = data['siemens_namespace_uri']
 
+    async def send_to_unit(unit_id, address):
         if unit_id != 3:
-            fault = await wipe_running_steps(address, encrypted_username, encrypted_password)
+            fault = await wipe_running_steps(address, encrypted_username, encrypted_password,
+                                             transfer_config["clear_running_steps_wait_seconds"])
             if fault:
                 logger.info("There was a problem while wiping the data")
-                continue
+                return "wipe_failed"
 
         client = await connect_to_opcua_server(address, encrypted_username, encrypted_password)
         if not client:
-            showinfo(title="Info", message=texts["show_info_Could_not_load_data_to"] + get_unit_name(unit_id))
-            all_units_processed_successfully = False
-            continue
-
-        output_path = Path(__file__).parent.parent
-        with open(output_path / "configs" / "name_space.json", encoding="UTF8") as namespace:
-            data = json.load(namespace)
-            siemens_namespace_uri = data['siemens_namespace_uri']
+            return "connect_failed"
 
         namespace_index = await client.get_namespace_index(siemens_namespace_uri)
         filtered_data = [row for row in step_data if row[2] == unit_id]
-        success = await write_data_to_unit(client, namespace_index, filtered_data)
+        return await write_data_to_unit(client, namespace_index, filtered_data)
 
-        all_units_processed_successfully &= success
+    unit_jobs = [(unit_id, send_to_unit(unit_id, address)) for unit_id, address in units]
+    unit_results = await run_for_units(unit_jobs,
+                                       transfer_config["max_concurrent_units"],
+                                       transfer_config["unit_timeout_seconds"])
 
-        await client.disconnect()
+    for (unit_id, _), result in zip(units, unit_results):
+        if result == "wipe_failed":
+            continue
+
+        if result == "connect_failed":
+            showinfo(title="Info", message=texts["show_info_Could_not_load_data_to"] + get_unit_name(unit_id))
+            all_units_processed_successfully = False
+            continue
+
+        all_units_processed_successfully &= bool(result)
 
     if all_units_processed_successfully:
         showinfo(title='Information', message=texts["show_info_to_all_units_processed_successfully"])
@@ -290,88 +410,36 @@ async def from_sql_to_units_stepdata(step_data, texts, selected_name):
 
 
 async def get_units():
-    """Fetches the ids and ip addresses from units hosting OPCUA servers from a SQL database.
+    """Fetches the ids and ip addresses from units hosting OPCUA servers, from the cached plant topology.
 
     Returns:
         list: List of tuples containing unit ids and ip addresses
     """
 
-    cursor = None
-    cnxn = None
-
-    try:
-        sql_connection = SQLConnection()
-        sql_credentials = sql_connection.get_database_credentials("sql_config.json", "SQL_KEY")
-        cursor, cnxn = sql_connection.connect_to_database(sql_credentials)
-
-        cursor.execute('SELECT * FROM viewUnits')
-
-        units = cursor.fetchall()
+    if await plant_topology.load():
+        return plant_topology.units()
 
-    except PyodbcError as e:
-        logger.error(f"Error in database connection: {e}")
-
-    except IndexError:
-        logger.error("Database credentials seem to be incomplete.")
-
-    except Exception as e:
-        logger.error(f"An unexpected error occurred: {e}")
-
-    finally:
-        if cursor and cnxn:
-            sql_connection.disconnect_from_database(cursor, cnxn)
-
-    if units:
-        return units
-
-    else:
-        logger.error("No units were fetched from the database")
-        return None
+    logger.error("No units were fetched from the database")
+    return None
 
 
 async def get_recipe_structures_map():
 
     """
-    Fetches the mapping between unit ids, recipe structure ids, tags and URLs from a SQL database.
+    Fetches the mapping between unit ids, recipe structure ids, tags and URLs, from the cached plant topology.
 
     Returns:
         list: List of tuples containing unit ids, recipe structure ids, tags and URLs
     """
 
-    cursor = None
-    cnxn = None
-
-    try:
-        sql_connection = SQLConnection()
-        sql_credentials = sql_connection.get_database_credentials("sql_config.json", "SQL_KEY")
-        cursor, cnxn = sql_connection.connect_to_database(sql_credentials)
-
-        cursor.execute('SELECT Unit_Id, UnitName, RecipeStructure_Id, UnitTagName, URL  FROM viewRecipeStructuresMap')
-
-        struct_data = cursor.fetchall()
-
-    except PyodbcError as e:
-            logger.error(f"Error in database connection: {e}")
+    if await plant_topology.load():
+        return plant_topology.structure_rows()
 
-    except IndexError:
-        logger.error("Database credentials seem to be incomplete.")
-
-    except Exception as e:
-        logger.error(f"An unexpected error occurred: {e}")
-
-    finally:
-        if cursor and cnxn:
-            sql_connection.disconnect_from_database(cursor, cnxn)
-
-    if struct_data:
-        logger.info(f"Fetched {struct_data} recipe structure mappings from the database")
-        return struct_data
-    else:
-        logger.error("No recipe structure mappings were fetched from the database")
-        return None
+    logger.error("No recipe structure mappings were fetched from the database")
+    return None
 
 
-async def wipe_running_steps(address,encrypted_username,encrypted_password):
+async def wipe_running_steps(address,encrypted_username,encrypted_password, wait_seconds=2):
     """
     Connects to the specified OPC UA servers and clears running steps.
 
@@ -379,13 +447,14 @@ async def wipe_running_steps(address,encrypted_username,encrypted_password):
         address (str): The address of the OPC UA server
         encrypted_username (str): The encrypted username for the OPC UA server
         encrypted_password (str): The encrypted password for the OPC UA server
+        wait_seconds (float): Time the PLC gets to clear the steps before new data is written
 
     Returns:
         bool: Fault status of the operation
 
     """
 
-    client:Client = await connect_opcua(address, encrypted_username, encrypted_password)
+    client:Client = await get_session_pool().get_client(address, encrypted_username, encrypted_password)
 
     if client:
         try:
@@ -393,17 +462,12 @@ async def wipe_running_steps(address,encrypted_username,encrypted_password):
             opcua_adress = 'ns=3;s="Recipe_Handler"."External"."ClearRunningSteps"'
             succes_writing_name, fault = await write_tag(client, opcua_adress, True)
 
-            await asyncio.sleep(2)
-
-            await client.disconnect()
+            await asyncio.sleep(wait_seconds)
 
             return fault
         except Exception as exception:
             logger.error(exception)
-            
-        finally:
-            if client:
-                await client.disconnect()
+
     else:
         logger.error("Error while trying to connect to opcua servers to clean data")
 
@@ -459,111 +523,118 @@ def check_recipe_data(selected_id):
             sql_connection.disconnect_from_database(cursor, cnxn)
 
 
-async def db_opcua_data_checker(recipe_id, recipe_structure_id, texts):
+def plc_values_by_unit(units):
     """
-    Checks the step data in the database and compares it with the OPCUA data.
+    Groups the values read from the units by unit id, as tag name -> value.
 
-    Parameters:
-        recipe_id: The Recipe ID used for querying the SQL database.
+    Args:
+        units (list): (unit_id, data_origin, unit_data) tuples, unit_data is the steps from get_servo_steps
+            for STEPDATA_ORIGIN and (value, datatype) for a single value
 
     Returns:
-        The difference between the OPCUA data and the database data if there are none returns empty list.
+        dict: Unit id -> tag name -> value
     """
 
-    from .opcua_client import get_opcua_value
+    values_by_unit = {}
+    for unit_id, data_origin, unit_data in units:
+        unit_values = values_by_unit.setdefault(unit_id, {})
+        if data_origin == STEPDATA_ORIGIN:
+            unit_values.update(plc_values_from_steps(unit_data))
+        else:
+            unit_values[tag_name_from_node_id(data_origin)] = unit_data[0]
+    return values_by_unit
 
-    cursor = None
-    cnxn = None
 
-    sql_connection, cursor, cnxn = establish_sql_connection()
-    if not cursor or not cnxn:
-        logger.error("Database connection failed.")
-        display_info(title="Info", message=texts["Show_info_general_sql_error"])
-        return [], True
+async def read_plc_values_by_unit(recipe_structure_id):
+    """
+    Reads the values of every unit in the recipe structure concurrently.
 
-    try:
+    Returns:
+        dict: Unit id -> tag name -> value, None if a unit could not be read
+    """
 
-        struct_data_rows = await get_recipe_structures_map()
+    from .opcua_client import get_opcua_value
 
-        data_difference = []
+    if not await plant_topology.load():
+        return None
+
+    transfer_config = get_recipe_transfer_config()
+    units = [(unit.url, unit.unit_id, unit.data_origin) for unit in plant_topology.structure_units(recipe_structure_id)]
 
-        opcua_results = {}
+    unit_jobs = []
+    for address, unit_id, data_origin in units:
+        if data_origin == STEPDATA_ORIGIN:
+            unit_jobs.append((unit_id, get_servo_steps(address, data_origin)))
+        else:
+            unit_jobs.append((unit_id, get_opcua_value(address, data_origin)))
 
+    unit_results = await run_for_units(unit_jobs,
+                                       transfer_config["max_concurrent_units"],
+                                       transfer_config["unit_timeout_seconds"])
 
-        pattern = re.compile(r'ns=\d+;s="(.+)"')
+    read_units = []
+    for (address, unit_id, data_origin), unit_result in zip(units, unit_results):
+        if data_origin == STEPDATA_ORIGIN:
+            if not unit_result:
+                logger.error(f"Failed to fetch servo steps from {address} with data origin {data_origin}")
+                return None
+            read_units.append((unit_id, data_origin, unit_result))
+        else:
+            success, value, datatype = unit_result or (False, None, None)
+            if not success:
+                logger.error(f"Failed to get OPCUA value from {address} with data origin {data_origin}")
+                return None
+            read_units.append((unit_id, data_origin, (value, datatype)))
 
-        # Fetching unit information based on the structure id
-        for row in struct_data_rows:
-            unit_id, unit_name, structure_id ,data_origin, url = row
-            if structure_id == recipe_structure_id and unit_name != "Master":
+    return plc_values_by_unit(read_units)
 
-                servo_steps = await get_servo_steps(url, data_origin)
 
-                if not servo_steps:
-                    logger.error(f"Failed to fetch servo steps from {url} with data origin {data_origin}")
-                    display_info(title="Info", message=texts["Show_info_general_plc_error"])
-                    return [], True
-                for item in servo_steps:
-                    for key, info_dict in item.items():
+async def db_opcua_data_checker(recipe_id, recipe_structure_id, texts, unit_values=None):
+    """
+    Checks the step data in the database and compares it with the OPCUA data.
 
-                        node_obj = info_dict['Node']
-                        node_id = node_obj.nodeid
-                        identifier = node_id.Identifier
-                        value = str(info_dict['Value'])
-                        opcua_results[identifier] = value
+    All units of the recipe are compared with one query, typed and with a tolerance for floats,
+    see recipe_verifier.verify_recipe.
 
+    Parameters:
+        recipe_id: The Recipe ID used for querying the SQL database.
+        recipe_structure_id: The recipe structure, used to find the units when they have to be read.
+        texts: Language for the GUI
+        unit_values: The values just read from the units, from plc_values_by_unit.
+            The units are read again if None.
 
-                query = """
-                SELECT [UnitID], [TagName], [TagValue], [TagDataType]
-                FROM [RecipeDB].[dbo].[viewValues]
-                WHERE RecipeID = ? AND UnitID = ?
-                """
-                params = (recipe_id,unit_id)
-                cursor.execute(query, params,)
-                rows = cursor.fetchall()
+    Returns:
+        The difference between the OPCUA data and the database data if there are none returns empty list,
+        and True if the check could not be done.
+    """
 
-            elif structure_id == recipe_structure_id and unit_name == "Master":
-                master_data = await get_opcua_value(url, data_origin)
+    try:
+        if unit_values is None:
+            unit_values = await read_plc_values_by_unit(recipe_structure_id)
+            if unit_values is None:
+                display_info(title="Info", message=texts["Show_info_general_plc_error"])
+                return [], True
 
-                match = pattern.match(data_origin)
-                if match:
-                    clean_data_origin = match.group(1)
-                    clean_data_origin = f'"{clean_data_origin}"'
-                    opcua_results[clean_data_origin] = str(master_data[1])
-                else:
-                    opcua_results[data_origin] = str(master_data[1])  # Fallback if regex doesn't match
+        query = """
+        SELECT [UnitID], [TagName], [TagValue]
+        FROM [RecipeDB].[dbo].[viewValues]
+        WHERE RecipeID = ?
+        """
+        rows = await async_db.fetchall(query, (recipe_id,))
 
-        db_results = {}
         if not rows:
             return [], True
 
         for row in rows:
-
             if None in row:
                 logger.error(f"One or more fields are None in row: {row}")
                 return [], True
 
-            unit_id, tag_name, tag_value, tag_datatype = row
-            db_results[tag_name] = tag_value
-
-        for tag_name, tag_value in db_results.items():
-            logger.info(f"Checking tag_name: {tag_name}")
-            opcua_tag_value = opcua_results.get(tag_name, None)
-            logger.info(f"DB value for {tag_name}: {tag_value}")
-            logger.info(f"OPCUA value for {tag_name}: {opcua_tag_value}")
-
-            if opcua_tag_value is None:
-                logger.error(f"{tag_name} exists in database but not in OPCUA")
-                data_difference.append(f"{tag_name} exists in database but not in OPCUA")
+        result = verify_recipe(rows, unit_values, get_recipe_transfer_config()["verify_float_tolerance"])
 
-            elif tag_value != opcua_tag_value:
-                logger.error(f"Tag value in database: {tag_value} is not the same as in OPCUA: {opcua_tag_value}")
-                db_opcua_missmatch = (f"Tag value in database: {tag_value} is not the same as in OPCUA: {opcua_tag_value}")
-                data_difference.append(db_opcua_missmatch)
-
-            else:
-                logger.info(f"Tag value in database: {tag_value} is the same as in OPCUA: {opcua_tag_value}")
-                pass
+        data_difference = result.messages()
+        for message in data_difference:
+            logger.error(message)
 
         return data_difference, False
 
@@ -582,39 +653,22 @@ async def db_opcua_data_checker(recipe_id, recipe_structure_id, texts):
         showinfo(title="Info", message=e)
         return [], True
 
-    finally:
-        if cursor and cnxn:
-            sql_connection.disconnect_from_database(cursor, cnxn)
-
 
 async def update_recipe_last_saved(recipe_id):
     """
     Updates the last saved date for a recipe to database.
     """
 
-    cursor = None
-    cnxn = None
-
     try:
-        sql_connection = SQLConnection()
-        sql_credentials = sql_connection.get_database_credentials("sql_config.json", "SQL_KEY")
-        cursor, cnxn = sql_connection.connect_to_database(sql_credentials)
+        query = """
+        UPDATE [RecipeDB].[dbo].[tblRecipe]
+        SET [RecipeLastDataSaved] = GETDATE()
+        WHERE [id] = ?
+        """
 
-        if cursor and cnxn:
-
-            query = """
-            UPDATE [RecipeDB].[dbo].[tblRecipe]
-            SET [RecipeLastDataSaved] = GETDATE()
-            WHERE [id] = ?
-            """
-
-            params = (recipe_id,)
-            cursor.execute(query, params)
-            cnxn.commit()
-            return True
-
-        else:
-            return False
+        params = (recipe_id,)
+        await async_db.execute(query, params, commit=True)
+        return True
 
     except PyodbcError as e:
         logger.error(f"Error in database connection: {e}")
@@ -624,7 +678,3 @@ async def update_recipe_last_saved(recipe_id):
 
     except Exception as e:
         logger.error(f"An unexpected error occurred: {e}")
-
-    finally:
-        if cursor and cnxn:
-            sql_connection.disconnect_from_database(cursor, cnxn)
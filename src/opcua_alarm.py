@@ -10,6 +10,7 @@ version: 1.0.0 Inital commit by Roberts balulis
 __version__ = "1.0.0"
 
 import asyncio
+import atexit
 from datetime import datetime
 
 from asyncua import ua, Client
@@ -19,6 +20,7 @@ try:
     from .opcua_client import connect_opcua
     from .data_encrypt import DataEncryptor
     from .config_handler import ConfigHandler
+    from .alarm_sink import AlarmSqlSink
 except ImportError:
     print(f"Some modules was not found in. Please make sure it is in the same directory as this script.")
 
@@ -46,9 +48,49 @@ SERVER_NODE_NAMESPACE_INDEX:int = opcua_alarm_config["config"]["server_node_name
 DAY_TRANSLATION:dict = opcua_alarm_config["day_translation"]
 OPCUA_SERVER_CRED_PATH:str = opcua_alarm_config["opcua_server_cred_path"]
 OPCUA_SERVER_WINDOWS_ENV_KEY_NAME:str = opcua_alarm_config["environment_variables"]["opcua"]
+SQL_SINK_CONFIG:dict = opcua_alarm_config.get("sql_sink", {})
 ####################################
 
 
+def on_alarm_config_changed(config_name: str, config: dict):
+    """Applies the alarm routing settings when opcua_server_alarm_config.json is changed."""
+
+    global SEND_SMS, DAY_TRANSLATION
+    SEND_SMS = config["config"]["send_sms"]
+    DAY_TRANSLATION = config["day_translation"]
+    logger_programming.info(f"Reloaded {config_name}, send_sms: {SEND_SMS}")
+
+
+def on_phone_book_changed(config_name: str, phone_book: list):
+    global PHONE_BOOK
+    PHONE_BOOK = phone_book
+    logger_programming.info(f"Reloaded {config_name} with {len(phone_book)} users")
+
+
+try:
+    PHONE_BOOK:list = config_manager.phone_book
+except (FileNotFoundError, ValueError) as e:
+    logger_programming.warning(f"No phone book, no SMS will be sent until it is added: {e}")
+    PHONE_BOOK = []
+
+config_manager.subscribe('opcua_server_alarm_config.json', on_alarm_config_changed)
+config_manager.subscribe('phone_book.json', on_phone_book_changed)
+
+# Stores every alarm event in the database
+alarm_sink = None
+if SQL_SINK_CONFIG.get("enabled", False):
+    alarm_sink = AlarmSqlSink(
+        table_name=SQL_SINK_CONFIG.get("table_name", "tblOpcuaAlarms"),
+        batch_size=SQL_SINK_CONFIG.get("batch_size", 50),
+        flush_interval_ms=SQL_SINK_CONFIG.get("flush_interval_ms", 1000),
+        spool_file=SQL_SINK_CONFIG.get("spool_file", "cache/alarm_spool.jsonl"),
+        retry_interval_seconds=SQL_SINK_CONFIG.get("retry_interval_seconds", 30),
+        max_spool_mb=SQL_SINK_CONFIG.get("max_spool_mb", 20)
+    )
+    # The writer is a daemon thread, the events queued when the program exits are written here
+    atexit.register(alarm_sink.stop)
+
+
 async def subscribe_to_server(adresses: str, username: str, password: str):
     """
     Parameters
@@ -139,6 +181,12 @@ class SubHandler:
     def __init__(self, address: str):
         self.address = address
 
+
+    @property
+    def phone_book(self) -> list:
+        """The users to notify, kept up to date with phone_book.json."""
+        return PHONE_BOOK
+
     def status_change_notification(self, status: ua.StatusChangeNotification):
         """
         Called when a status change notification is received from the server.
@@ -176,6 +224,9 @@ class SubHandler:
         if hasattr(event, "NodeId") and hasattr(event.NodeId, "Identifier"):
             opcua_alarm_message["Identifier"] = str(event.NodeId.Identifier)
 
+        if alarm_sink is not None:
+            alarm_sink.enqueue(self.address, opcua_alarm_message)
+
         if SEND_SMS:
             if opcua_alarm_message["ActiveState"] == "Active":
                 await self.user_notification(opcua_alarm_message["Message"], opcua_alarm_message['Severity'])
@@ -230,6 +281,9 @@ async def monitor_alarms():
         logger_programming.error("Could not read OPC UA config file")
         raise FileNotFoundError("Could not read OPC UA config file")
 
+    if alarm_sink is not None:
+        alarm_sink.start()
+
     tasks = []
 
     for server in opcua_config["servers"]:
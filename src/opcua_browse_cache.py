@@ -0,0 +1,224 @@
+"""
+This file contains the StepDataBrowseCache class, which keeps the browsed layout of the StepData nodes
+per server and data origin so that later loads only have to read the values.
+The cache is stored on disk and invalidated when the server's namespace array, namespace version
+or start time changes.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import json
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from asyncua import ua
+
+from .create_log import setup_logger
+
+
+logger = setup_logger("Opcua_browse_cache")
+
+CACHE_FILE = Path(__file__).parent.parent / "cache" / "stepdata_browse_cache.json"
+
+
+@dataclass
+class StepProperty:
+    """One variable of a step in the StepData array."""
+    name: str
+    node_id: ua.NodeId
+    node_class: ua.NodeClass
+    variant_type: ua.VariantType
+
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "node_id": self.node_id.to_string(),
+            "node_class": int(self.node_class),
+            "variant_type": self.variant_type.name
+        }
+
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StepProperty":
+        return cls(
+            name=data["name"],
+            node_id=ua.NodeId.from_string(data["node_id"]),
+            node_class=ua.NodeClass(data["node_class"]),
+            variant_type=ua.VariantType[data["variant_type"]]
+        )
+
+
+class StepDataBrowseCache:
+    """
+    Persistent cache of the browsed StepData structure.
+
+    Every entry is stored together with a version token read from the server. The token is built
+    from the NamespaceArray, the ServerStatus StartTime and, when the server exposes it, the
+    NamespaceVersion and NamespacePublicationDate of the namespace the steps live in.
+    Checking the token costs a single Read call.
+    """
+
+    def __init__(self, cache_file: Path = CACHE_FILE) -> None:
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[str, dict]] = None
+
+
+    async def get(self, session, cache_key: str) -> Optional[List[List[StepProperty]]]:
+        """
+        Returns the cached structure for the key, or None if there is none or it is outdated.
+
+        Parameters
+        ----------
+        session - The session of the client (node.session)
+        cache_key - Key built from the server url and the data origin
+        """
+
+        with self._lock:
+            entry = self._load_entries().get(cache_key)
+
+        if entry is None:
+            return None
+
+        try:
+            version = await self._read_version(session, entry["namespace_index"], entry["namespace_metadata"])
+        except Exception as exeption:
+            logger.warning(f"Could not read the version of {cache_key}: {exeption}")
+            return None
+
+        if version != entry["version"]:
+            logger.info(f"Server model changed for {cache_key}, browsing again")
+            self.invalidate(cache_key)
+            return None
+
+        return [[StepProperty.from_dict(prop) for prop in item] for item in entry["items"]]
+
+
+    async def store(self, session, cache_key: str, namespace_index: int, structure: List[List[StepProperty]]) -> None:
+        """
+        Stores the browsed structure for the key together with the current version of the server.
+
+        Parameters
+        ----------
+        session - The session of the client (node.session)
+        cache_key - Key built from the server url and the data origin
+        namespace_index - The namespace index of the step nodes
+        structure - The browsed structure, one list of properties per step
+        """
+
+        try:
+            namespace_metadata = await self._find_namespace_metadata(session, namespace_index)
+            version = await self._read_version(session, namespace_index, namespace_metadata)
+        except Exception as exeption:
+            logger.warning(f"Could not read the version of {cache_key}, not caching it: {exeption}")
+            return
+
+        with self._lock:
+            entries = self._load_entries()
+            entries[cache_key] = {
+                "version": version,
+                "namespace_index": namespace_index,
+                "namespace_metadata": namespace_metadata,
+                "items": [[prop.to_dict() for prop in item] for item in structure]
+            }
+            self._save_entries(entries)
+
+        logger.info(f"Cached browse structure of {cache_key}")
+
+
+    def invalidate(self, cache_key: str) -> None:
+        """Removes the entry for the key."""
+
+        with self._lock:
+            entries = self._load_entries()
+            if entries.pop(cache_key, None) is not None:
+                self._save_entries(entries)
+
+
+    @staticmethod
+    async def _read_version(session, namespace_index: int, namespace_metadata: List[str]) -> str:
+        node_ids = [ua.NodeId(ua.ObjectIds.Server_NamespaceArray), ua.NodeId(ua.ObjectIds.Server_ServerStatus_StartTime)]
+        node_ids.extend(ua.NodeId.from_string(node_id) for node_id in namespace_metadata)
+
+        params = ua.ReadParameters()
+        params.TimestampsToReturn = ua.TimestampsToReturn.Neither
+        for node_id in node_ids:
+            read_value_id = ua.ReadValueId()
+            read_value_id.NodeId = node_id
+            read_value_id.AttributeId = ua.AttributeIds.Value
+            params.NodesToRead.append(read_value_id)
+
+        data_values = await session.read(params)
+        for data_value in data_values:
+            data_value.StatusCode.check()
+
+        values = [data_value.Value.Value for data_value in data_values]
+        namespace_array = values[0] or []
+        namespace_uri = namespace_array[namespace_index] if namespace_index < len(namespace_array) else None
+
+        return json.dumps([namespace_array, namespace_uri] + values[1:], default=str)
+
+
+    @staticmethod
+    async def _find_namespace_metadata(session, namespace_index: int) -> List[str]:
+        """Finds the NamespaceVersion and NamespacePublicationDate nodes of the namespace, if the server has them."""
+
+        from .opcua_client import browse_children_batched
+
+        params = ua.ReadParameters()
+        read_value_id = ua.ReadValueId()
+        read_value_id.NodeId = ua.NodeId(ua.ObjectIds.Server_NamespaceArray)
+        read_value_id.AttributeId = ua.AttributeIds.Value
+        params.NodesToRead.append(read_value_id)
+        namespace_array = (await session.read(params))[0].Value.Value or []
+
+        if namespace_index >= len(namespace_array):
+            return []
+
+        namespace_uri = namespace_array[namespace_index]
+
+        try:
+            namespaces = (await browse_children_batched(session, [ua.NodeId(ua.ObjectIds.Server_Namespaces)]))[0]
+        except ua.UaStatusCodeError:
+            return []
+
+        metadata_objects = [ref.NodeId for ref in namespaces
+                            if namespace_uri in (ref.BrowseName.Name, ref.DisplayName.Text)]
+        if not metadata_objects:
+            return []
+
+        properties = (await browse_children_batched(session, metadata_objects[:1]))[0]
+        return [ref.NodeId.to_string() for ref in properties
+                if ref.BrowseName.Name in ("NamespaceVersion", "NamespacePublicationDate")]
+
+
+    def _load_entries(self) -> Dict[str, dict]:
+        if self._entries is None:
+            try:
+                with open(self.cache_file, "r", encoding="UTF8") as cache_file:
+                    self._entries = json.load(cache_file)
+            except FileNotFoundError:
+                self._entries = {}
+            except (json.JSONDecodeError, OSError) as exeption:
+                logger.warning(f"Could not read browse cache {self.cache_file}: {exeption}")
+                self._entries = {}
+        return self._entries
+
+
+    def _save_entries(self, entries: Dict[str, dict]) -> None:
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = self.cache_file.with_suffix(".tmp")
+            with open(temp_file, "w", encoding="UTF8") as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(temp_file, self.cache_file)
+        except OSError as exeption:
+            logger.warning(f"Could not write browse cache {self.cache_file}: {exeption}")
+
+
+stepdata_browse_cache = StepDataBrowseCache()
@@ -1,14 +1,25 @@
 import json
+from typing import Dict, List
 from asyncua import Client, ua, Node
 import asyncua.ua.uaerrors._auto as uaerrors
 import asyncua.common
+from asyncua.common.ua_utils import data_type_to_variant_type
 
 from .create_log import setup_logger
 from .data_encrypt import DataEncryptor
+from .opcua_session_pool import get_session_pool
+from .opcua_browse_cache import StepProperty, stepdata_browse_cache
 
 
 logger = setup_logger('Opcua_client')
 
+# Max number of nodes sent in one Browse or Read request, kept below what S7-1500 servers accept
+MAX_NODES_PER_REQUEST = 500
+
+# Production counters shown on the webserver
+PRODUCED_NODE_ID = 'ns=3;s="E_Flex"."Info"."QuantityPartsMade"'
+TO_DO_NODE_ID = 'ns=3;s="E_Flex"."Info"."QuantityOfPartsToMake"'
+
 
 async def get_node_children(node: Node, nodes=None):
     """
@@ -91,6 +102,206 @@ async def get_stepdata(node_steps: Node) -> json:
     return None
 
 
+async def browse_children_batched(session, node_ids: List[ua.NodeId]) -> List[List[ua.ReferenceDescription]]:
+    """
+    Browse the hierarchical children of many nodes with as few Browse calls as possible.
+
+    :param session: The session of the client (node.session)
+    :param node_ids: Node ids to browse
+    :return: A list with the child references for every node id, in the same order
+    """
+
+    references = []
+
+    for start in range(0, len(node_ids), MAX_NODES_PER_REQUEST):
+        params = ua.BrowseParameters()
+        params.View = ua.ViewDescription()
+        params.RequestedMaxReferencesPerNode = 0
+
+        for node_id in node_ids[start:start + MAX_NODES_PER_REQUEST]:
+            description = ua.BrowseDescription()
+            description.NodeId = node_id
+            description.BrowseDirection = ua.BrowseDirection.Forward
+            description.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HierarchicalReferences)
+            description.IncludeSubtypes = True
+            description.NodeClassMask = ua.NodeClass.Unspecified
+            description.ResultMask = ua.BrowseResultMask.All
+            params.NodesToBrowse.append(description)
+
+        for result in await session.browse(params):
+            result.StatusCode.check()
+            node_references = list(result.References)
+
+            while result.ContinuationPoint:
+                next_params = ua.BrowseNextParameters()
+                next_params.ContinuationPoints = [result.ContinuationPoint]
+                next_params.ReleaseContinuationPoints = False
+                result = (await session.browse_next(next_params))[0]
+                node_references.extend(result.References)
+
+            references.append(node_references)
+
+    return references
+
+
+async def read_attributes_batched(session, node_ids: List[ua.NodeId], attribute_ids: List[ua.AttributeIds]) -> List[List[ua.DataValue]]:
+    """
+    Read several attributes of many nodes with as few Read calls as possible.
+
+    :param session: The session of the client (node.session)
+    :param node_ids: Node ids to read
+    :param attribute_ids: Attributes to read from every node
+    :return: A list with one DataValue per attribute for every node id, in the same order
+    """
+
+    nodes_to_read = []
+    for node_id in node_ids:
+        for attribute_id in attribute_ids:
+            read_value_id = ua.ReadValueId()
+            read_value_id.NodeId = node_id
+            read_value_id.AttributeId = attribute_id
+            nodes_to_read.append(read_value_id)
+
+    data_values = []
+    chunk_size = max(len(attribute_ids), MAX_NODES_PER_REQUEST - MAX_NODES_PER_REQUEST % len(attribute_ids))
+
+    for start in range(0, len(nodes_to_read), chunk_size):
+        params = ua.ReadParameters()
+        params.NodesToRead = nodes_to_read[start:start + chunk_size]
+        params.TimestampsToReturn = ua.TimestampsToReturn.Neither
+        data_values.extend(await session.read(params))
+
+    count = len(attribute_ids)
+    return [data_values[index:index + count] for index in range(0, len(data_values), count)]
+
+
+async def data_type_ids_to_variant_types(session, data_type_ids: List[ua.NodeId]) -> Dict[ua.NodeId, ua.VariantType]:
+    """
+    Map DataType attribute values to variant types. Built-in types are mapped directly,
+    any other type is resolved once through the server.
+
+    :param session: The session of the client (node.session)
+    :param data_type_ids: Node ids of the data types
+    :return: Dict with the variant type for every data type id
+    """
+
+    variant_types = {}
+
+    for data_type_id in set(data_type_ids):
+        if data_type_id.NamespaceIndex == 0 and isinstance(data_type_id.Identifier, int):
+            try:
+                variant_types[data_type_id] = ua.VariantType(data_type_id.Identifier)
+                continue
+            except ValueError:
+                pass
+
+        variant_types[data_type_id] = await data_type_to_variant_type(Node(session, data_type_id))
+
+    return variant_types
+
+
+async def browse_stepdata_structure(node_steps: Node) -> List[List[StepProperty]]:
+    """
+    Browse the layout of the step array: node ids, display names, node classes and variant types.
+
+    :param node_steps: Node containing the step data
+    :return: One list of properties per step, empty if no steps were found
+    """
+
+    session = node_steps.session
+
+    if '[0]' in str(node_steps.nodeid):
+        return []
+
+    array_items = (await browse_children_batched(session, [node_steps.nodeid]))[0]
+    array_items = [item for item in array_items if '[0]' not in str(item.NodeId)]
+    if not array_items:
+        return []
+
+    props_per_item = await browse_children_batched(session, [item.NodeId for item in array_items])
+
+    variables = [prop for props in props_per_item for prop in props if prop.NodeClass == ua.NodeClass.Variable]
+    data_types = await read_attributes_batched(session, [prop.NodeId for prop in variables], [ua.AttributeIds.DataType])
+
+    for (data_type,) in data_types:
+        data_type.StatusCode.check()
+
+    data_type_ids = {prop.NodeId: data_type.Value.Value for prop, (data_type,) in zip(variables, data_types)}
+    variant_types = await data_type_ids_to_variant_types(session, list(data_type_ids.values()))
+
+    structure = []
+    for props in props_per_item:
+        item_props = {}
+        for prop in props:
+            if prop.NodeClass == ua.NodeClass.Variable and prop.DisplayName.Text not in item_props:
+                item_props[prop.DisplayName.Text] = StepProperty(name=prop.DisplayName.Text,
+                                                                 node_id=prop.NodeId,
+                                                                 node_class=prop.NodeClass,
+                                                                 variant_type=variant_types[data_type_ids[prop.NodeId]])
+        if item_props:
+            structure.append(list(item_props.values()))
+
+    return structure
+
+
+async def get_stepdata_batched(node_steps: Node, server_url: str = None) -> json:
+    """
+    Get data from specific steps within the given node, using bulk Browse and Read calls
+    instead of one round trip per attribute. Returns the same structure as get_stepdata.
+
+    When server_url is given the browsed layout is cached per server and data origin, so later
+    calls only read the values as long as the server model has not changed.
+
+    :param node_steps: Node containing the step data
+    :param server_url: The url of the server, used as cache key
+    :return: JSON object containing the result, or None if no result found
+    """
+
+    logger.info("Getting step data with batched reads...")
+    session = node_steps.session
+    cache_key = f"{server_url}|{node_steps.nodeid.to_string()}" if server_url else None
+
+    structure = None
+    if cache_key:
+        structure = await stepdata_browse_cache.get(session, cache_key)
+
+    from_cache = structure is not None
+    if not from_cache:
+        structure = await browse_stepdata_structure(node_steps)
+        if structure and cache_key:
+            await stepdata_browse_cache.store(session, cache_key, node_steps.nodeid.NamespaceIndex, structure)
+
+    props = [prop for item in structure for prop in item]
+    values = await read_attributes_batched(session, [prop.node_id for prop in props], [ua.AttributeIds.Value])
+
+    unknown_nodes = [value for (value,) in values if value.StatusCode.value == ua.StatusCodes.BadNodeIdUnknown]
+    if from_cache and unknown_nodes:
+        logger.warning(f"Cached structure of {cache_key} is outdated, browsing again")
+        stepdata_browse_cache.invalidate(cache_key)
+        return await get_stepdata_batched(node_steps, server_url)
+
+    result = []
+    value_index = 0
+    for item in structure:
+        item_data = {}
+        for prop in item:
+            value = values[value_index][0]
+            value_index += 1
+            value.StatusCode.check()
+            item_data[prop.name] = {
+                "Node": Node(session, prop.node_id),
+                "Value": value.Value.Value,
+                "Datatype": prop.variant_type
+            }
+        result.append(item_data)
+
+    if result:
+        logger.info(f"Successfully retrieved step data for {len(result)} steps in batched mode.")
+        return result
+
+    logger.error("No step data found.")
+    return None
+
 
 async def connect_opcua(url, encrypted_username, encrypted_password):
 
@@ -142,6 +353,46 @@ async def connect_opcua(url, encrypted_username, encrypted_password):
 
     return client
 
+
+def get_opcua_credentials():
+    """
+    Get the username and password for the OPC UA servers from the encrypted config.
+
+    :return: Tuple containing the encrypted username and password
+    """
+
+    data_encrypt = DataEncryptor()
+    opcua_config = data_encrypt.encrypt_credentials("opcua_server_config.json", "OPCUA_KEY")
+    for server in opcua_config["servers"]:
+        encrypted_username = server["username"]
+        encrypted_password = server["password"]
+    return encrypted_username, encrypted_password
+
+
+async def get_opcua_session(url):
+    """
+    Get a pooled session to an OPC UA server. The session is shared between calls and
+    must not be disconnected by the caller.
+
+    :param url: Server URL
+    :return: Client object if connected, None otherwise
+    """
+
+    encrypted_username, encrypted_password = get_opcua_credentials()
+    return await get_session_pool().get_client(url, encrypted_username, encrypted_password)
+
+
+async def invalidate_opcua_session(url):
+    """
+    Drop the pooled session to an OPC UA server so the next call reconnects.
+
+    :param url: Server URL
+    """
+
+    encrypted_username, encrypted_password = get_opcua_credentials()
+    await get_session_pool().invalidate(url, encrypted_username, encrypted_password)
+
+
 async def find_node_by_tag_name(node: Node, tag_name):
     if node is None:
         return None
@@ -161,6 +412,62 @@ async def find_node_by_tag_name(node: Node, tag_name):
     return None
 
 
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    elif isinstance(value, str):
+        return value.lower() == "true"
+    else:
+        raise ValueError("Invalid type for conversion to bool")
+
+
+def to_float(value):
+    return float(value)
+
+
+def to_int(value):
+    return int(value)
+
+
+# Data type to conversion function mapping
+CONVERSION_MAP = {
+    ua.VariantType.Boolean: to_bool,
+    ua.VariantType.Float: to_float,
+    ua.VariantType.Double: to_float,
+    ua.VariantType.SByte: to_int,
+    ua.VariantType.Byte: to_int,
+    ua.VariantType.Int16: to_int,
+    ua.VariantType.Int32: to_int,
+    ua.VariantType.Int64: to_int,
+    ua.VariantType.UInt16: to_int,
+    ua.VariantType.UInt32: to_int,
+    ua.VariantType.UInt64: to_int,
+}
+
+
+def tag_value_to_data_value(tag_value, data_type: ua.VariantType):
+    """
+    Convert a tag value, as stored in the database or given by the user, to a DataValue of the data type.
+
+    :param tag_value: The value to convert
+    :param data_type: The variant type of the node
+    :return: The DataValue, or None if the value can not be written to that data type
+    """
+
+    if data_type in CONVERSION_MAP:
+        conversion_func = CONVERSION_MAP[data_type]
+        if isinstance(tag_value, str) or isinstance(tag_value, int):
+            tag_value = conversion_func(tag_value)
+        if isinstance(tag_value, bool) or isinstance(tag_value, float) or isinstance(tag_value, int):
+            return ua.DataValue(ua.Variant(tag_value, data_type))
+
+    elif data_type == ua.VariantType.String:
+        if isinstance(tag_value, str):
+            return ua.DataValue(ua.Variant(tag_value, data_type))
+
+    return None
+
+
 async def write_tag(client: Client, tag_name, tag_value):
     """
     Write a value to a specific tag within the client.
@@ -180,7 +487,6 @@ async def write_tag(client: Client, tag_name, tag_value):
 
     except Exception as exeption:
         logger.error(exeption)
-        await client.disconnect()
         fault = True
         return result, fault
 
@@ -188,50 +494,11 @@ async def write_tag(client: Client, tag_name, tag_value):
     if node_id is not None:
         data_value = None
         try:
-
-            # Define conversion functions
-            def to_bool(value):
-                if isinstance(value, bool):
-                    return value
-                elif isinstance(value, str):
-                    return value.lower() == "true"
-                else:
-                    raise ValueError("Invalid type for conversion to bool")
-
-
-            def to_float(value):
-                return float(value)
-
-            def to_int(value):
-                return int(value)
-
-            # Define data type to conversion function mapping
-            conversion_map = {
-                ua.VariantType.Boolean: to_bool,
-                ua.VariantType.Float: to_float,
-                ua.VariantType.Int16: to_int,
-                ua.VariantType.Int32: to_int,
-                ua.VariantType.Int64: to_int,
-                ua.VariantType.UInt16: to_int,
-                ua.VariantType.UInt32: to_int,
-                ua.VariantType.UInt64: to_int,
-            }
-
-            # Convert tag value to data value
             data_type = await node.read_data_type_as_variant_type()
-            if data_type in conversion_map:
-                conversion_func = conversion_map[data_type]
-                if isinstance(tag_value, str) or isinstance(tag_value, int):
-                    tag_value = conversion_func(tag_value)
-                if isinstance(tag_value, bool) or isinstance(tag_value, float) or isinstance(tag_value, int):
-                    data_value = ua.DataValue(ua.Variant(tag_value, data_type))
-            elif data_type == ua.VariantType.String:
-                if isinstance(tag_value, str):
-                    data_value = ua.DataValue(ua.Variant(tag_value, data_type))
+            data_value = tag_value_to_data_value(tag_value, data_type)
 
             result = "Tag found but no correct tag value"
         except Exception as exeption:
-            await client.disconnect()
             fault = True
             logger.error(f"Error converting data type to ua.Variant: {exeption}")
             return result, fault
@@ -244,53 +511,137 @@ async def write_tag(client: Client, tag_name, tag_value):
                 logger.info(f"Successfully wrote value to tag: {tag_name},{tag_value}.")
             except Exception as exeption:
                 fault = True
-                await client.disconnect()
                 logger.error(f"Error writing value to tag: {tag_name},{tag_value}, from {node_id}. {exeption}")
                 return result, fault
 
     return result, fault
 
 
-async def get_servo_steps(ip_address, data_origin):
+async def write_tags(client: Client, tags) -> Dict[str, ua.StatusCode]:
+    """
+    Write many tags with as few Write calls as possible.
+
+    Every tag is given as (tag_name, tag_value, data_type). When data_type is a known variant type,
+    for example the TagDataType stored with the recipe, no read is needed before writing.
+    Data types that are None or unknown are read in one batch. Tags that the server rejects with
+    BadTypeMismatch are retried once with the data type read from the server.
+
+    :param client: The client object
+    :param tags: List of (tag_name, tag_value, data_type) tuples, data_type is a VariantType, its name or None
+    :return: Dict with the status of every tag name
+    """
+
+    statuses = {}
+    node_ids = {}
+    data_types = {}
+
+    for tag_name, tag_value, data_type in tags:
+        try:
+            node_ids[tag_name] = ua.NodeId.from_string(tag_name)
+        except Exception as exeption:
+            logger.error(f"Invalid tag name {tag_name}: {exeption}")
+            statuses[tag_name] = ua.StatusCode(ua.StatusCodes.BadNodeIdInvalid)
+            continue
+
+        if isinstance(data_type, str):
+            data_type = ua.VariantType.__members__.get(data_type)
+        data_types[tag_name] = data_type if isinstance(data_type, ua.VariantType) else None
+
+    async def resolve_data_types(tag_names):
+        session = client.uaclient
+        data_type_values = await read_attributes_batched(session, [node_ids[tag_name] for tag_name in tag_names],
+                                                         [ua.AttributeIds.DataType])
+        readable = {}
+        for tag_name, (data_type_value,) in zip(tag_names, data_type_values):
+            if data_type_value.StatusCode.is_good():
+                readable[tag_name] = data_type_value.Value.Value
+            else:
+                statuses[tag_name] = data_type_value.StatusCode
+
+        variant_types = await data_type_ids_to_variant_types(session, list(readable.values()))
+        for tag_name, data_type_id in readable.items():
+            data_types[tag_name] = variant_types[data_type_id]
+        return list(readable)
+
+    async def write_batch(tag_names):
+        nodes_to_write = []
+        for tag_name in tag_names:
+            try:
+                data_value = tag_value_to_data_value(values[tag_name], data_types[tag_name])
+            except (ValueError, TypeError) as exeption:
+                logger.error(f"Error converting {values[tag_name]} to {data_types[tag_name]} for {tag_name}: {exeption}")
+                data_value = None
+
+            if data_value is None:
+                statuses[tag_name] = ua.StatusCode(ua.StatusCodes.BadTypeMismatch)
+                continue
+
+            write_value = ua.WriteValue()
+            write_value.NodeId = node_ids[tag_name]
+            write_value.AttributeId = ua.AttributeIds.Value
+            write_value.Value = data_value
+            nodes_to_write.append((tag_name, write_value))
+
+        for start in range(0, len(nodes_to_write), MAX_NODES_PER_REQUEST):
+            chunk = nodes_to_write[start:start + MAX_NODES_PER_REQUEST]
+            params = ua.WriteParameters()
+            params.NodesToWrite = [write_value for _, write_value in chunk]
+            results = await client.uaclient.write(params)
+            for (tag_name, _), status in zip(chunk, results):
+                statuses[tag_name] = status
+
+    values = {tag_name: tag_value for tag_name, tag_value, _ in tags if tag_name in node_ids}
+
+    unknown_types = [tag_name for tag_name in node_ids if data_types[tag_name] is None]
+    typed = [tag_name for tag_name in node_ids if data_types[tag_name] is not None]
+    if unknown_types:
+        typed.extend(await resolve_data_types(unknown_types))
+
+    await write_batch(typed)
+
+    mismatched = [tag_name for tag_name in typed
+                  if statuses[tag_name].value == ua.StatusCodes.BadTypeMismatch and tag_name not in unknown_types]
+    if mismatched:
+        logger.warning(f"Stored data type did not match for {len(mismatched)} tags, reading the data types from the server")
+        await write_batch(await resolve_data_types(mismatched))
+
+    written = sum(1 for status in statuses.values() if status.is_good())
+    logger.info(f"Wrote {written} of {len(tags)} tags")
+    return statuses
+
+
+async def get_servo_steps(ip_address, data_origin, batched=True):
 
     """
     Retrieve servo steps from a specified address.
 
     :param ip_address: The IP address
     :param data_origin: The origin of the data
+    :param batched: Read the steps with bulk Browse/Read calls instead of one call per attribute
     :return: The children values if found
     """
 
     logger.info(f"Getting servo steps from {ip_address}...")
 
-    data_encrypt = DataEncryptor()
-    opcua_config = data_encrypt.encrypt_credentials("opcua_server_config.json", "OPCUA_KEY")
-    for server in opcua_config["servers"]:
-        encrypted_username = server["username"]
-        encrypted_password = server["password"]
-    url = ip_address
-
-    client:Client = await connect_opcua(url, encrypted_username, encrypted_password)
+    client:Client = await get_opcua_session(ip_address)
     if client is not None:
-        logger.info("Connected and session activated")
+        logger.info("Got session from the pool")
 
         try:
 
             node_id = ua.NodeId.from_string(data_origin)
             node_steps = client.get_node(node_id)
 
-            children_values = await get_stepdata(node_steps)
+            if batched:
+                children_values = await get_stepdata_batched(node_steps, ip_address)
+            else:
+                children_values = await get_stepdata(node_steps)
 
             if children_values:
                 logger.info("Successfully retrieved servo steps.")
-                await client.disconnect()
-                logger.info("Client disconnected")
-               
                 return children_values
 
             logger.error("Failed to retrieve servo steps.")
-            await client.disconnect()
-            logger.info("Client disconnected")
             return None
 
         except AttributeError as exeption:
@@ -301,6 +652,7 @@ async def get_servo_steps(ip_address, data_origin):
 
         except TimeoutError as exeption:
             logger.error(f"Connection timeout: {str(exeption.args)}" if exeption else "Connection timeout: (empty message)")
+            await invalidate_opcua_session(ip_address)
 
         except Exception as exeption:
             logger.error(f"Error getting values: {str(exeption)},{type(exeption)}")
@@ -316,13 +668,7 @@ async def get_opcua_value(adress, data_place):
     :return: Tuple containing success flag, value, and data type if found
     """
 
-    data_encrypt = DataEncryptor()
-    opcua_config = data_encrypt.encrypt_credentials("opcua_server_config.json", "OPCUA_KEY")
-    for server in opcua_config["servers"]:
-        encrypted_username = server["username"]
-        encrypted_password = server["password"]
-
-    client:Client = await connect_opcua(adress, encrypted_username, encrypted_password)
+    client:Client = await get_opcua_session(adress)
     if client is not None:
 
         try:
@@ -354,18 +700,27 @@ async def get_opcua_value(adress, data_place):
             if data_type == ua.VariantType.String:
                 data_type = "String"
 
-            await client.disconnect()
-
             return True, value, data_type
 
         except Exception as exeption:
             logger.error(exeption)
-            await client.disconnect()
             return False, None, None
 
     return False, None, None
 
 
+async def get_production_unit_url():
+    """
+    Get the url of the unit that has the production counters.
+
+    :return: Url of the OPC UA server
+    """
+
+    from .ms_sql import get_units
+    units = await get_units()
+    return units[2][1]
+
+
 async def data_to_webserver():
 
     """
@@ -374,23 +729,15 @@ async def data_to_webserver():
     :return: Produced value and to-do value if found
     """
 
-    from .ms_sql import get_units
-    units = await get_units()
-    ip_address = units[2][1]
-
-    data_encrypt = DataEncryptor()
-    opcua_config = data_encrypt.encrypt_credentials("opcua_server_config.json", "OPCUA_KEY")
-    for server in opcua_config["servers"]:
-        encrypted_username = server["username"]
-        encrypted_password = server["password"]
+    ip_address = await get_production_unit_url()
 
-    client:Client = await connect_opcua(ip_address, encrypted_username, encrypted_password)
+    client:Client = await get_opcua_session(ip_address)
 
     if client is not None:
 
         try:
-            produced_node_id = ua.NodeId.from_string('ns=3;s="E_Flex"."Info"."QuantityPartsMade"')
-            to_do_node_id = ua.NodeId.from_string('ns=3;s="E_Flex"."Info"."QuantityOfPartsToMake"')
+            produced_node_id = ua.NodeId.from_string(PRODUCED_NODE_ID)
+            to_do_node_id = ua.NodeId.from_string(TO_DO_NODE_ID)
 
             produced_node = client.get_node(produced_node_id)
             to_do_node =  client.get_node(to_do_node_id)
@@ -398,9 +745,6 @@ async def data_to_webserver():
             produced_value = await produced_node.get_value()
             to_do_value = await to_do_node.get_value()
 
-            await client.disconnect()
-            logger.info("Client disconnected")
-
             return produced_value, to_do_value
 
         except AttributeError as exeption:
@@ -411,6 +755,7 @@ async def data_to_webserver():
 
         except TimeoutError as exeption:
             logger.warning(f"Connection timeout: {str(exeption.args)}" if exeption else "Connection timeout: (empty message)")
+            await invalidate_opcua_session(ip_address)
 
         except Exception as exeption:
             logger.warning(f"Error getting values: {str(exeption)},{type(exeption)}")
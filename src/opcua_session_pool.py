@@ -0,0 +1,163 @@
+"""
+This file contains the OpcuaSessionPool class, which keeps long-lived OPC UA sessions per endpoint so that
+recipe operations can reuse an already activated session instead of doing a new handshake for every call.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import asyncio
+import threading
+import time
+import weakref
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from asyncua import Client, ua
+
+from .create_log import setup_logger
+
+
+logger = setup_logger("Opcua_session_pool")
+
+SessionKey = Tuple[str, str, str]
+
+
+@dataclass
+class PooledSession:
+    """A connected client together with the bookkeeping the pool needs for health checks."""
+    client: Client
+    created: float = field(default_factory=time.monotonic)
+    last_checked: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class OpcuaSessionPool:
+    """
+    Keeps one connected session per OPC UA endpoint, keyed by url and credentials.
+
+    A session is health checked before it is handed out. The cheap check (the client watchdog)
+    runs on every call, and a real read of the server state runs when the session has not been
+    checked for health_check_interval seconds. Dead sessions are closed and reconnected automatically.
+
+    asyncua clients are bound to the event loop they were created on, so use get_session_pool()
+    to get the pool that belongs to the running loop.
+    """
+
+    def __init__(self, health_check_interval: float = 10.0) -> None:
+        self.health_check_interval = health_check_interval
+        self._sessions: Dict[SessionKey, PooledSession] = {}
+        self._locks: Dict[SessionKey, asyncio.Lock] = {}
+
+
+    async def get_client(self, url: str, username: str, password: str) -> Optional[Client]:
+        """
+        Returns a connected client for the endpoint, reusing a pooled session when it is healthy.
+
+        Parameters
+        ----------
+        url - The url of the OPC UA server
+        username - The username to use when connecting to the OPC UA server
+        password - The password to use when connecting to the OPC UA server
+
+        Returns
+        -------
+        The connected client, or None if no session could be established.
+        """
+
+        key = (url, username, password)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+
+        async with lock:
+            session = self._sessions.get(key)
+
+            if session is not None:
+                if await self._is_healthy(session):
+                    session.last_used = time.monotonic()
+                    return session.client
+
+                logger.warning(f"Pooled session to {url} is not healthy, reconnecting")
+                await self._close_session(self._sessions.pop(key))
+
+            from .opcua_client import connect_opcua
+
+            client = await connect_opcua(url, username, password)
+            if client is None:
+                return None
+
+            self._sessions[key] = PooledSession(client)
+            logger.info(f"Added session to {url} to the pool")
+            return client
+
+
+    async def invalidate(self, url: str, username: str, password: str) -> None:
+        """Closes and forgets the pooled session for the endpoint, the next call will reconnect."""
+
+        key = (url, username, password)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+
+        async with lock:
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                logger.info(f"Invalidated pooled session to {url}")
+                await self._close_session(session)
+
+
+    async def close_all(self) -> None:
+        """Disconnects every pooled session."""
+
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            await self._close_session(session)
+
+
+    async def _is_healthy(self, session: PooledSession) -> bool:
+        try:
+            await session.client.check_connection()
+
+            now = time.monotonic()
+            if now - session.last_checked >= self.health_check_interval:
+                state_node = session.client.get_node(ua.ObjectIds.Server_ServerStatus_State)
+                await state_node.read_value()
+                session.last_checked = now
+
+            return True
+
+        except Exception as exeption:
+            logger.warning(f"Health check failed: {exeption} Type: {type(exeption)}")
+            return False
+
+
+    @staticmethod
+    async def _close_session(session: PooledSession) -> None:
+        try:
+            await session.client.disconnect()
+        except Exception as exeption:
+            logger.warning(f"Error while disconnecting pooled session: {exeption}")
+
+
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, OpcuaSessionPool]" = weakref.WeakKeyDictionary()
+_pools_lock = threading.Lock()
+
+
+def get_session_pool() -> OpcuaSessionPool:
+    """Returns the session pool that belongs to the running event loop."""
+
+    loop = asyncio.get_running_loop()
+    with _pools_lock:
+        pool = _pools.get(loop)
+        if pool is None:
+            pool = OpcuaSessionPool()
+            _pools[loop] = pool
+        return pool
+
+
+async def close_session_pool() -> None:
+    """Disconnects all pooled sessions that belong to the running event loop."""
+
+    loop = asyncio.get_running_loop()
+    with _pools_lock:
+        pool = _pools.pop(loop, None)
+    if pool is not None:
+        await pool.close_all()
@@ -0,0 +1,158 @@
+"""
+This file contains the PlantTopology class, a cache of the units and recipe structures of the plant.
+The units, their urls and the data origin of every unit in a recipe structure seldom change, so they
+are read from the database once and kept for a while instead of being queried in every operation.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from .create_log import setup_logger
+from .sql_connection import SQLConnection
+from .async_sql import AsyncSQLConnection
+
+
+logger = setup_logger("Plant_topology")
+
+
+@dataclass(frozen=True)
+class StructureUnit:
+    """One row of viewRecipeStructuresMap, a unit that is part of a recipe structure."""
+    unit_id: int
+    unit_name: str
+    structure_id: int
+    data_origin: str
+    url: str
+
+
+class PlantTopology:
+    """
+    The units and recipe structures, loaded from viewUnits and viewRecipeStructuresMap.
+
+    load reads the views again when the data is older than ttl_seconds or when forced.
+    The lookups only use the loaded data and never query the database.
+    If a reload fails the old data is kept.
+    """
+
+    def __init__(self, ttl_seconds: float = 300.0) -> None:
+        """
+        Parameters
+        ----------
+        ttl_seconds - Max age of the data before load reads it again
+        """
+
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+        self._units: List[Tuple[int, str]] = []
+        self._unit_urls: Dict[int, str] = {}
+        self._unit_names: Dict[int, str] = {}
+        self._structure_rows: List[tuple] = []
+        self._units_by_structure: Dict[int, List[StructureUnit]] = {}
+
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+
+    async def load(self, force: bool = False) -> bool:
+        """
+        Reads the views if the data is stale or force is True.
+
+        Returns
+        -------
+        True if there is topology data to use, old or new.
+        """
+
+        if not force and self._is_fresh():
+            return True
+
+        try:
+            await AsyncSQLConnection().run(self._load_blocking, force)
+        except Exception as exeption:
+            logger.error(f"Could not load the plant topology: {exeption}")
+
+        return self.loaded
+
+
+    def invalidate(self) -> None:
+        """Makes the next load read the views again."""
+
+        with self._lock:
+            if self._loaded_at is not None:
+                self._loaded_at = 0.0
+
+
+    def units(self) -> List[Tuple[int, str]]:
+        """The (unit id, url) rows of viewUnits."""
+
+        return list(self._units)
+
+
+    def unit_url(self, unit_id: int) -> Optional[str]:
+        return self._unit_urls.get(unit_id)
+
+
+    def unit_name(self, unit_id: int) -> str:
+        return self._unit_names.get(unit_id, f"Unknown unit {unit_id}")
+
+
+    def structure_rows(self) -> List[tuple]:
+        """The (unit id, unit name, structure id, data origin, url) rows of viewRecipeStructuresMap."""
+
+        return list(self._structure_rows)
+
+
+    def structure_units(self, structure_id: int) -> List[StructureUnit]:
+        """The units of a recipe structure, in the order of the view."""
+
+        return list(self._units_by_structure.get(structure_id, []))
+
+
+    def _is_fresh(self) -> bool:
+        loaded_at = self._loaded_at
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl_seconds
+
+
+    def _load_blocking(self, force: bool) -> None:
+        with self._lock:
+            # Another caller may have loaded while this one was waiting for the lock
+            if not force and self._is_fresh():
+                return
+
+            def fetch(cursor):
+                cursor.execute("SELECT * FROM viewUnits")
+                units = cursor.fetchall()
+                cursor.execute("SELECT Unit_Id, UnitName, RecipeStructure_Id, UnitTagName, URL FROM viewRecipeStructuresMap")
+                return units, cursor.fetchall()
+
+            units, structure_rows = SQLConnection().run_with_cursor(fetch)
+            if not units or not structure_rows:
+                raise ValueError("viewUnits or viewRecipeStructuresMap returned no rows")
+
+            units_by_structure: Dict[int, List[StructureUnit]] = {}
+            unit_names: Dict[int, str] = {}
+            for row in structure_rows:
+                structure_unit = StructureUnit(*row)
+                units_by_structure.setdefault(structure_unit.structure_id, []).append(structure_unit)
+                unit_names.setdefault(structure_unit.unit_id, structure_unit.unit_name)
+
+            self._units = [tuple(row) for row in units]
+            self._unit_urls = {row[0]: row[1] for row in units}
+            self._unit_names = unit_names
+            self._structure_rows = [tuple(row) for row in structure_rows]
+            self._units_by_structure = units_by_structure
+            self._loaded_at = time.monotonic()
+
+            logger.info(f"Loaded {len(units)} units and {len(units_by_structure)} recipe structures")
+
+
+# Shared by every loop in the program
+plant_topology = PlantTopology()
@@ -0,0 +1,168 @@
+"""
+This file contains the ThroughputEstimator class, which estimates the production rate and the time left
+of the running order from the produced counter of the PLC.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Optional, Tuple
+
+from .create_log import setup_logger
+
+
+logger = setup_logger("Production_estimator")
+
+
+@dataclass
+class ThroughputEstimate:
+    """The estimate at one point in time, rates are in parts per hour."""
+    parts_per_hour: Optional[float]
+    windowed_parts_per_hour: Optional[float]
+    eta_seconds: Optional[float]
+    confidence: float
+    stopped: bool
+
+
+    @property
+    def eta_text(self) -> str:
+        """The time left as HH:MM, or --:-- when it is not known."""
+
+        if self.eta_seconds is None:
+            return "--:--"
+        hours, remainder = divmod(int(self.eta_seconds), 3600)
+        return f"{str(hours).zfill(2)}:{str(remainder // 60).zfill(2)}"
+
+
+class ThroughputEstimator:
+    """
+    Estimates parts per hour and the time left from counter updates.
+
+    Every change of the produced counter is stored in a fixed-size ring buffer. The rate is
+    estimated in two ways, an exponentially weighted average of the seconds per part, which
+    follows changes in speed, and the average over the whole buffer, which is steadier.
+    The confidence grows with the number of samples and with how well the two estimates agree.
+
+    Production is seen as stopped when no part has been made for stoppage_factor times the
+    expected cycle time, but at least min_stoppage_seconds. The history is cleared when the
+    recipe changes or the counter goes down, which happens when a new order is started.
+    """
+
+    def __init__(
+        self,
+        window_size: int = 60,
+        ewma_alpha: float = 0.2,
+        min_samples: int = 3,
+        full_confidence_samples: int = 20,
+        stoppage_factor: float = 5.0,
+        min_stoppage_seconds: float = 60.0
+    ) -> None:
+        """
+        Parameters
+        ----------
+        window_size - Number of counter changes kept in the ring buffer
+        ewma_alpha - Weight of the newest cycle time in the weighted average
+        min_samples - Counter changes needed before an estimate is given
+        full_confidence_samples - Counter changes needed before the confidence can reach 1
+        stoppage_factor - Cycle times without a new part before production is seen as stopped
+        min_stoppage_seconds - Shortest time without a new part that is seen as a stop
+        """
+
+        self.ewma_alpha = ewma_alpha
+        self.min_samples = min_samples
+        self.full_confidence_samples = full_confidence_samples
+        self.stoppage_factor = stoppage_factor
+        self.min_stoppage_seconds = min_stoppage_seconds
+
+        self._lock = threading.Lock()
+        self._samples: Deque[Tuple[float, int]] = deque(maxlen=window_size)
+        self._seconds_per_part: Optional[float] = None
+        self._recipe_name = None
+        self._to_do = 0
+
+
+    def update(self, produced: int, to_do: int, recipe_name=None, timestamp: Optional[float] = None) -> None:
+        """
+        Records a counter value, call it when the counters or the recipe change.
+
+        Parameters
+        ----------
+        produced - The number of parts made
+        to_do - The number of parts the order should make
+        recipe_name - The name of the active recipe
+        timestamp - The time of the value, defaults to now
+        """
+
+        timestamp = time.time() if timestamp is None else timestamp
+
+        with self._lock:
+            self._to_do = to_do
+
+            if recipe_name != self._recipe_name:
+                if self._recipe_name is not None:
+                    logger.info(f"Recipe changed to {recipe_name}, resetting the estimate")
+                self._reset(recipe_name)
+
+            if self._samples:
+                last_time, last_produced = self._samples[-1]
+
+                if produced == last_produced:
+                    return
+
+                if produced < last_produced:
+                    logger.info("Produced counter went down, resetting the estimate")
+                    self._reset(recipe_name)
+
+                elif timestamp > last_time:
+                    seconds_per_part = (timestamp - last_time) / (produced - last_produced)
+                    if self._seconds_per_part is None:
+                        self._seconds_per_part = seconds_per_part
+                    else:
+                        self._seconds_per_part += self.ewma_alpha * (seconds_per_part - self._seconds_per_part)
+
+            self._samples.append((timestamp, produced))
+
+
+    def estimate(self, now: Optional[float] = None) -> ThroughputEstimate:
+        """Returns the current estimate."""
+
+        now = time.time() if now is None else now
+
+        with self._lock:
+            if len(self._samples) < self.min_samples or self._seconds_per_part is None:
+                return ThroughputEstimate(None, None, None, 0.0, False)
+
+            first_time, first_produced = self._samples[0]
+            last_time, last_produced = self._samples[-1]
+
+            parts_per_hour = 3600.0 / self._seconds_per_part if self._seconds_per_part > 0 else None
+            windowed_parts_per_hour = None
+            if last_time > first_time:
+                windowed_parts_per_hour = 3600.0 * (last_produced - first_produced) / (last_time - first_time)
+
+            stoppage_after = max(self.min_stoppage_seconds, self.stoppage_factor * self._seconds_per_part)
+            stopped = now - last_time > stoppage_after
+
+            remaining = max(0, self._to_do - last_produced)
+            eta_seconds = None
+            if not stopped and parts_per_hour:
+                # The next part has been in the making since the last counter change
+                eta_seconds = max(0.0, remaining * self._seconds_per_part - (now - last_time))
+
+            confidence = 0.0
+            if not stopped and parts_per_hour and windowed_parts_per_hour:
+                sample_weight = min(1.0, len(self._samples) / self.full_confidence_samples)
+                agreement = 1.0 - abs(parts_per_hour - windowed_parts_per_hour) / max(parts_per_hour, windowed_parts_per_hour)
+                confidence = round(sample_weight * max(0.0, agreement), 2)
+
+            return ThroughputEstimate(parts_per_hour, windowed_parts_per_hour, eta_seconds, confidence, stopped)
+
+
+    def _reset(self, recipe_name) -> None:
+        self._samples.clear()
+        self._seconds_per_part = None
+        self._recipe_name = recipe_name
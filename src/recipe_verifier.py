@@ -0,0 +1,204 @@
+"""
+This file contains the recipe verifier, which compares the step data stored for a recipe with the values
+read from the units. The values are compared typed, floats with a tolerance, and the result tells
+which tags are missing, extra or changed per unit.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .create_log import setup_logger
+
+
+logger = setup_logger("Recipe_verifier")
+
+# Tag name -> value read from the unit
+PlcValues = Dict[str, Any]
+
+TRUE_TEXTS = {"true", "1"}
+FALSE_TEXTS = {"false", "0"}
+
+
+@dataclass(frozen=True)
+class ChangedTag:
+    unit_id: int
+    tag_name: str
+    db_value: str
+    plc_value: Any
+
+
+@dataclass
+class VerificationResult:
+    """
+    The difference between the database and the units.
+
+    missing - (unit id, tag name) stored in the database but not read from the unit
+    extra - (unit id, tag name) read from the unit but not stored in the database
+    changed - Tags where the stored value is not the value of the unit
+    checked - Number of tags that were compared
+    """
+    missing: List[Tuple[int, str]] = field(default_factory=list)
+    extra: List[Tuple[int, str]] = field(default_factory=list)
+    changed: List[ChangedTag] = field(default_factory=list)
+    checked: int = 0
+
+
+    def messages(self, max_messages: int = 50) -> List[str]:
+        """The differences as text for the user, at most max_messages lines plus a line with the rest."""
+
+        messages = [f"{tag_name} exists in database but not in OPCUA" for _, tag_name in self.missing]
+        messages += [f"{tag_name} exists in OPCUA but not in database" for _, tag_name in self.extra]
+        messages += [f"Tag value in database: {tag.db_value} is not the same as in OPCUA: {tag.plc_value} ({tag.tag_name})"
+                     for tag in self.changed]
+
+        if len(messages) > max_messages:
+            rest = len(messages) - max_messages
+            messages = messages[:max_messages] + [f"... and {rest} more differences"]
+        return messages
+
+
+def plc_values_from_steps(steps: Iterable[Dict[str, Dict[str, Any]]]) -> PlcValues:
+    """
+    Turns the steps returned by get_servo_steps into tag name -> value.
+    The tag name is the identifier of the node, the same name add_value stores.
+    """
+
+    values = {}
+    for step in steps:
+        for prop_data in step.values():
+            values[prop_data["Node"].nodeid.Identifier] = prop_data["Value"]
+    return values
+
+
+def tag_name_from_node_id(node_id: str) -> str:
+    """'ns=3;s="Master"."Value"' -> '"Master"."Value"', the name add_value stores for a single value."""
+
+    return re.sub(r'^.*?"', '"', node_id)
+
+
+def parse_db_value(text: str, like: Any) -> Any:
+    """
+    Converts a stored value to the type of the value read from the unit.
+
+    Raises
+    ------
+    ValueError - If the text can not be converted
+    """
+
+    if isinstance(like, bool):
+        lowered = text.strip().lower()
+        if lowered in TRUE_TEXTS:
+            return True
+        if lowered in FALSE_TEXTS:
+            return False
+        raise ValueError(f"Not a boolean: {text}")
+    if isinstance(like, int):
+        # Parsed as int first, a float would round Int64 and UInt64 values above 2**53
+        try:
+            return int(text)
+        except ValueError:
+            number = float(text)
+        if not number.is_integer():
+            raise ValueError(f"Not an integer: {text}")
+        return int(number)
+    if isinstance(like, float):
+        return float(text)
+    return text
+
+
+def values_equal(db_value: str, plc_value: Any, float_tolerance: float) -> bool:
+    """Compares a stored value with the value of the unit, floats are equal within float_tolerance."""
+
+    if plc_value is None:
+        return db_value is None
+
+    try:
+        typed_db_value = parse_db_value(db_value, plc_value)
+    except (ValueError, TypeError, AttributeError):
+        return False
+
+    if isinstance(plc_value, float):
+        if math.isnan(plc_value) and math.isnan(typed_db_value):
+            return True
+        return math.isclose(typed_db_value, plc_value, rel_tol=float_tolerance, abs_tol=float_tolerance)
+
+    if isinstance(plc_value, (bool, int)):
+        return typed_db_value == plc_value
+
+    return db_value == str(plc_value)
+
+
+def compare_unit(
+    unit_id: int,
+    db_values: Dict[str, str],
+    plc_values: PlcValues,
+    float_tolerance: float,
+    result: Optional[VerificationResult] = None
+) -> VerificationResult:
+    """
+    Compares the stored values of one unit with the values read from it.
+
+    Parameters
+    ----------
+    unit_id - The unit
+    db_values - Tag name -> stored value
+    plc_values - Tag name -> value read from the unit
+    float_tolerance - Relative and absolute tolerance for floats
+    result - The result to add the differences to, a new one if None
+
+    Returns
+    -------
+    The result with the differences of this unit added.
+    """
+
+    if result is None:
+        result = VerificationResult()
+
+    for tag_name, db_value in db_values.items():
+        if tag_name not in plc_values:
+            result.missing.append((unit_id, tag_name))
+        elif not values_equal(db_value, plc_values[tag_name], float_tolerance):
+            result.changed.append(ChangedTag(unit_id, tag_name, db_value, plc_values[tag_name]))
+        result.checked += 1
+
+    for tag_name in plc_values.keys() - db_values.keys():
+        result.extra.append((unit_id, tag_name))
+
+    return result
+
+
+def verify_recipe(
+    db_rows: Iterable[Tuple[int, str, str]],
+    plc_values_by_unit: Dict[int, PlcValues],
+    float_tolerance: float = 1e-6
+) -> VerificationResult:
+    """
+    Compares every unit that was read with the stored rows of the recipe.
+
+    Parameters
+    ----------
+    db_rows - (unit id, tag name, tag value) of every stored tag of the recipe
+    plc_values_by_unit - Unit id -> the values read from that unit
+    float_tolerance - Relative and absolute tolerance for floats
+
+    Returns
+    -------
+    The differences of all units.
+    """
+
+    db_values_by_unit: Dict[int, Dict[str, str]] = {}
+    for unit_id, tag_name, tag_value in db_rows:
+        db_values_by_unit.setdefault(unit_id, {})[tag_name] = tag_value
+
+    result = VerificationResult()
+    for unit_id, plc_values in plc_values_by_unit.items():
+        compare_unit(unit_id, db_values_by_unit.get(unit_id, {}), plc_values, float_tolerance, result)
+
+    logger.info(f"Verified {result.checked} tags: {len(result.missing)} missing, "
+                f"{len(result.extra)} extra, {len(result.changed)} changed")
+    return result
@@ -0,0 +1,172 @@
+"""
+This file contains the SearchIndex class, an in memory n-gram index used by the search bars of the grids,
+and DebouncedSearch, which runs a search when the user has stopped typing.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+from typing import Callable, Dict, Iterable, Optional, Set
+
+
+class SearchIndex:
+    """
+    Finds the keys whose texts contain a search term, case insensitive.
+
+    Every text is split into n-grams when it is added. A search looks up the n-grams of the term
+    and only checks the keys that have all of them, instead of every key. Terms shorter than
+    gram_size are checked against every key. When a term extends the previous one, only the
+    keys of the previous result are checked.
+    """
+
+    def __init__(self, gram_size: int = 3) -> None:
+        """
+        Parameters
+        ----------
+        gram_size - Length of the n-grams
+        """
+
+        self.gram_size = gram_size
+        self._texts: Dict[str, str] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        self._last_term: Optional[str] = None
+        self._last_result: Set[str] = set()
+
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+
+    def add(self, key, *texts: Optional[str]) -> None:
+        """
+        Adds a key or replaces its texts.
+
+        Parameters
+        ----------
+        key - The key returned by search, a Treeview iid for example
+        texts - The texts to search in, None is skipped
+        """
+
+        key = str(key)
+        if key in self._texts:
+            self.remove(key)
+
+        # The separator keeps a term from matching across two texts
+        text = "\0".join(str(text).strip().lower() for text in texts if text is not None)
+        self._texts[key] = text
+        for gram in self._ngrams(text):
+            self._grams.setdefault(gram, set()).add(key)
+        self._last_term = None
+
+
+    def remove(self, key) -> None:
+        """Removes a key, does nothing if it is not in the index."""
+
+        key = str(key)
+        text = self._texts.pop(key, None)
+        if text is None:
+            return
+        for gram in self._ngrams(text):
+            keys = self._grams.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._grams[gram]
+        self._last_term = None
+
+
+    def clear(self) -> None:
+        """Removes all keys."""
+
+        self._texts.clear()
+        self._grams.clear()
+        self._last_term = None
+
+
+    def search(self, term: str) -> Optional[Set[str]]:
+        """
+        Returns the keys whose texts contain term, or None when term is empty and everything matches.
+        The returned set must not be changed.
+        """
+
+        term = term.strip().lower()
+        if not term:
+            return None
+
+        if self._last_term is not None and term.startswith(self._last_term):
+            candidates: Iterable[str] = self._last_result
+        elif len(term) < self.gram_size:
+            candidates = self._texts
+        else:
+            posting_lists = sorted((self._grams.get(gram, set()) for gram in self._ngrams(term)), key=len)
+            candidates = set.intersection(*posting_lists)
+
+        result = {key for key in candidates if term in self._texts[key]}
+        self._last_term = term
+        self._last_result = result
+        return result
+
+
+    def _ngrams(self, text: str) -> Set[str]:
+        size = self.gram_size
+        return {text[index:index + size] for index in range(len(text) - size + 1)}
+
+
+class DebouncedSearch:
+    """
+    Runs a search on a SearchIndex delay_ms after the last call to schedule.
+
+    on_result is called with the result of search, but only when it differs from the last one,
+    so typing that does not change the matches does not touch the view.
+    """
+
+    def __init__(
+        self,
+        widget,
+        index: SearchIndex,
+        on_result: Callable[[Optional[Set[str]]], None],
+        delay_ms: int = 150
+    ) -> None:
+        """
+        Parameters
+        ----------
+        widget - A Tk widget, used for after
+        index - The index to search
+        on_result - Called with the matching keys, or None when everything matches
+        delay_ms - Time without a new term before searching
+        """
+
+        self.widget = widget
+        self.index = index
+        self.on_result = on_result
+        self.delay_ms = delay_ms
+        self._after_id = None
+        self._term = ""
+        self._last_result: Optional[Set[str]] = None
+
+
+    def schedule(self, term: str) -> None:
+        """Searches for term when no new term comes within delay_ms."""
+
+        self._term = term
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+        self._after_id = self.widget.after(self.delay_ms, self.run)
+
+
+    def run(self) -> None:
+        """Searches for the last term right away."""
+
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+            self._after_id = None
+
+        if not self.widget.winfo_exists():
+            return
+
+        result = self.index.search(self._term)
+        if result == self._last_result:
+            return
+
+        self._last_result = set(result) if result is not None else None
+        self.on_result(result)
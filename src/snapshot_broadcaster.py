@@ -0,0 +1,102 @@
+"""
+This file contains the SnapshotBroadcaster class, which hands the latest production snapshot to every
+connected dashboard stream. All streams wait on one condition, so a new value is read once and pushed to all of them.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import asyncio
+import threading
+from typing import Any, Dict, Optional, Set, Tuple
+
+
+class SnapshotBroadcaster:
+    """
+    Holds the latest snapshot together with a version number that is increased on every change.
+
+    A reader remembers the version it got last and calls wait_for_update with it, the call
+    returns as soon as there is a newer version or the timeout has passed.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._version = 0
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._async_waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = set()
+
+
+    def publish(self, snapshot: Dict[str, Any]) -> None:
+        """Replaces the snapshot and wakes up every waiting reader."""
+
+        with self._condition:
+            self._snapshot = dict(snapshot)
+            self._version += 1
+            self._notify()
+
+
+    def latest(self) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """Returns the current version and snapshot."""
+
+        with self._condition:
+            return self._version, self._snapshot
+
+
+    def wait_for_update(self, last_version: int, timeout: float) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """
+        Waits until there is a snapshot newer than last_version.
+
+        Parameters
+        ----------
+        last_version - The version the reader already has
+        timeout - Max seconds to wait
+
+        Returns
+        -------
+        The current version and snapshot, the version equals last_version if the wait timed out.
+        """
+
+        with self._condition:
+            self._condition.wait_for(lambda: self._version != last_version, timeout)
+            return self._version, self._snapshot
+
+
+    async def wait_for_update_async(self, last_version: int, timeout: float) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """Same as wait_for_update, but waits on the running event loop instead of blocking a thread."""
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+
+        with self._condition:
+            if self._version != last_version:
+                return self._version, self._snapshot
+            self._async_waiters.add(waiter)
+
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._condition:
+                self._async_waiters.discard(waiter)
+
+        return self.latest()
+
+
+    def _notify(self) -> None:
+        """Wakes up every waiter, called with the condition held."""
+
+        self._condition.notify_all()
+        for loop, future in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(_set_done, future)
+            except RuntimeError:
+                # The loop of the waiter has been closed
+                pass
+        self._async_waiters.clear()
+
+
+def _set_done(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
@@ -1,24 +1,173 @@
+import threading
+import time
+from typing import Any, Callable, Tuple, Optional, Dict, List
+
 import pyodbc
 from pyodbc import Error as PyodbcError
-from typing import Tuple, Optional, Dict
 
 from .data_encrypt import DataEncryptor
 from .create_log import setup_logger
 
+
+class SQLConnectionPool:
+    """Thread-safe pool of pyodbc connections to one database"""
+
+
+    def __init__(
+        self,
+        connection_string: str,
+        timeout_duration: int = 10,
+        min_size: int = 2,
+        max_idle: int = 10,
+        max_lifetime: float = 1800.0,
+        liveness_check_after: float = 30.0
+    ):
+        """
+        :param connection_string: pyodbc connection string
+        :param timeout_duration: login timeout in seconds
+        :param min_size: number of connections opened in the background when the pool is created
+        :param max_idle: max number of idle connections kept in the pool
+        :param max_lifetime: seconds before a connection is closed and replaced
+        :param liveness_check_after: idle seconds after which a connection is checked before it is handed out"""
+
+        self.logger = setup_logger("SQLConnection")
+        self.connection_string = connection_string
+        self.timeout_duration = timeout_duration
+        self.min_size = min_size
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.liveness_check_after = liveness_check_after
+
+        self._lock = threading.Lock()
+        self._idle: List[Tuple[pyodbc.Connection, float, float]] = []
+        self._created: Dict[int, float] = {}
+
+        threading.Thread(target=self._prewarm, daemon=True).start()
+
+
+    def checkout(self) -> pyodbc.Connection:
+        """Returns a live connection from the pool, or a new one if there is no idle connection"""
+
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                cnxn, created, last_used = self._idle.pop()
+
+            now = time.monotonic()
+            if now - created > self.max_lifetime:
+                self._close(cnxn)
+                continue
+
+            if now - last_used > self.liveness_check_after and not self._is_alive(cnxn):
+                self._close(cnxn)
+                continue
+
+            with self._lock:
+                self._created[id(cnxn)] = created
+            return cnxn
+
+        return self._open()
+
+
+    def checkin(self, cnxn: pyodbc.Connection) -> None:
+        """Gives a connection back to the pool, uncommitted work is rolled back"""
+
+        with self._lock:
+            created = self._created.pop(id(cnxn), None)
+
+        if created is None or time.monotonic() - created > self.max_lifetime:
+            self._close(cnxn)
+            return
+
+        try:
+            cnxn.rollback()
+        except pyodbc.Error:
+            self._close(cnxn)
+            return
+
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((cnxn, created, time.monotonic()))
+                return
+
+        self._close(cnxn)
+
+
+    def owns(self, cnxn: pyodbc.Connection) -> bool:
+        with self._lock:
+            return id(cnxn) in self._created
+
+
+    def _open(self) -> pyodbc.Connection:
+        cnxn = pyodbc.connect(self.connection_string, timeout=self.timeout_duration)
+        with self._lock:
+            self._created[id(cnxn)] = time.monotonic()
+        return cnxn
+
+
+    def _prewarm(self) -> None:
+        for _ in range(self.min_size):
+            try:
+                cnxn = pyodbc.connect(self.connection_string, timeout=self.timeout_duration)
+            except pyodbc.Error as exception:
+                self.logger.warning(f"Could not pre-warm database connection: {exception}")
+                return
+
+            now = time.monotonic()
+            with self._lock:
+                keep = len(self._idle) < self.max_idle
+                if keep:
+                    self._idle.append((cnxn, now, now))
+
+            if not keep:
+                self._close(cnxn)
+                return
+
+
+    @staticmethod
+    def _is_alive(cnxn: pyodbc.Connection) -> bool:
+        try:
+            cursor = cnxn.cursor()
+            cursor.execute("SELECT 1").fetchone()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+
+    @staticmethod
+    def _close(cnxn: pyodbc.Connection) -> None:
+        try:
+            cnxn.close()
+        except pyodbc.Error:
+            pass
+
+
 class SQLConnection:
     """Gets database credentials from config file and connects to database"""
 
+    _credentials_cache: Dict[Tuple[str, str], Dict[str, str]] = {}
+    _pools: Dict[str, SQLConnectionPool] = {}
+    _class_lock = threading.Lock()
+
 
     def __init__(self):
         self.logger = setup_logger("SQLConnection")
 
 
     def get_database_credentials(self, config_file_name: str, win_env_key_name: str) -> Dict[str, str]:
-        """Get database credentials from config file
+        """Get database credentials from config file, decrypted credentials are cached for the life of the process
         :param config_file_name: config file name
         :param win_env_key_name: windows environment key name
         :return: database credentials"""
 
+        cache_key = (config_file_name, win_env_key_name)
+        with SQLConnection._class_lock:
+            cached_credentials = SQLConnection._credentials_cache.get(cache_key)
+        if cached_credentials is not None:
+            return dict(cached_credentials)
+
         data_encrypt = DataEncryptor()
         sql_config = data_encrypt.encrypt_credentials(config_file_name, win_env_key_name)
 
@@ -27,13 +176,17 @@ class SQLConnection:
             raise FileNotFoundError("Something went wrong with crypting/decrypting the config file.")
 
         database_config = sql_config.get("database", {})
-        return {
+        credentials = {
             "server": database_config.get("server", ""),
             "database": database_config.get("database_name", ""),
             "username": database_config.get("username", ""),
             "password": database_config.get("password", "")
         }
 
+        with SQLConnection._class_lock:
+            SQLConnection._credentials_cache[cache_key] = credentials
+        return dict(credentials)
+
 
     def connect_to_database(
         self,
@@ -41,18 +194,18 @@ class SQLConnection:
         timeout_duration: int = 10
     ) -> Tuple[Optional[pyodbc.Cursor], Optional[pyodbc.Connection]]:
 
-        """Connect to database
+        """Connect to database, the connection is checked out from a pool
         :param db_credentials: database credentials
         :param timeout_duration: timeout duration in seconds (default: 10)
         :return: cursor and connection objects"""
 
         try:
-            cnxn = pyodbc.connect(
+            connection_string = (
                 f'DRIVER={{SQL Server}};SERVER={db_credentials["server"]};'
                 f'DATABASE={db_credentials["database"]};UID={db_credentials["username"]};'
-                f'PWD={db_credentials["password"]}',
-                timeout=timeout_duration
+                f'PWD={db_credentials["password"]}'
             )
+            cnxn = self.get_pool(connection_string, timeout_duration).checkout()
             cursor = cnxn.cursor()
             return cursor, cnxn
 
@@ -71,8 +224,57 @@ class SQLConnection:
 
 
     def disconnect_from_database(self, cursor: pyodbc.Cursor, cnxn: pyodbc.Connection) -> None:
-        """Disconnects from the database"""
+        """Closes the cursor and gives the connection back to its pool"""
 
         if cursor and cnxn:
-            cursor.close()
+            try:
+                cursor.close()
+            except pyodbc.Error:
+                pass
+
+            with SQLConnection._class_lock:
+                pools = list(SQLConnection._pools.values())
+
+            for pool in pools:
+                if pool.owns(cnxn):
+                    pool.checkin(cnxn)
+                    return
+
             cnxn.close()
+
+
+    def run_with_cursor(
+        self,
+        func: Callable,
+        *args,
+        commit: bool = False,
+        config_file_name: str = "sql_config.json",
+        win_env_key_name: str = "SQL_KEY"
+    ) -> Any:
+        """Runs func(cursor, *args) with a pooled connection and gives the connection back afterwards
+        :param func: function that gets the cursor as first argument
+        :param commit: commit the connection when func returns without raising
+        :return: the return value of func"""
+
+        sql_credentials = self.get_database_credentials(config_file_name, win_env_key_name)
+        cursor, cnxn = self.connect_to_database(sql_credentials)
+
+        try:
+            result = func(cursor, *args)
+            if commit:
+                cnxn.commit()
+            return result
+        finally:
+            self.disconnect_from_database(cursor, cnxn)
+
+
+    @staticmethod
+    def get_pool(connection_string: str, timeout_duration: int = 10) -> SQLConnectionPool:
+        """Returns the connection pool for the connection string, creating it on first use"""
+
+        with SQLConnection._class_lock:
+            pool = SQLConnection._pools.get(connection_string)
+            if pool is None:
+                pool = SQLConnectionPool(connection_string, timeout_duration)
+                SQLConnection._pools[connection_string] = pool
+            return pool
@@ -0,0 +1,201 @@
+"""
+This file contains the TaskDispatcher class, which runs blocking work such as SQL queries and pings on
+worker threads and hands the results back to the Tk main thread.
+Tk widgets may only be touched from the main thread, so results are put in a queue that the main
+thread drains with after().
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import threading
+import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+from typing import Any, Callable, Optional
+
+from .create_log import setup_logger
+
+
+logger = setup_logger("Task_dispatcher")
+
+
+class TaskHandle:
+    """
+    Handle to a submitted task.
+
+    Tasks that are submitted with with_handle=True get the handle as first argument, so they can
+    check cancelled and call report_progress while they run.
+    """
+
+    def __init__(self, dispatcher: "TaskDispatcher", on_progress: Optional[Callable] = None) -> None:
+        self._dispatcher = dispatcher
+        self._on_progress = on_progress
+        self._cancel_event = threading.Event()
+        self.future = None
+
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+
+    def cancel(self) -> None:
+        """Cancels the task. Its callbacks will not be called."""
+
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+
+    def report_progress(self, *args) -> None:
+        """Calls on_progress with the arguments on the main thread."""
+
+        if self._on_progress is not None and not self.cancelled:
+            self._dispatcher.call_soon(self._call_unless_cancelled, self._on_progress, *args)
+
+
+    def _call_unless_cancelled(self, callback: Callable, *args) -> None:
+        if not self.cancelled:
+            callback(*args)
+
+
+class TaskDispatcher:
+    """
+    Runs blocking functions on a thread pool and calls their callbacks on the Tk main thread.
+
+    While any task is running the window shows the "watch" cursor, pressing Escape cancels the
+    running tasks (see cancel_all).
+    """
+
+    def __init__(self, root, max_workers: int = 4, poll_interval_ms: int = 50) -> None:
+        self.root = root
+        self.poll_interval_ms = poll_interval_ms
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gui_task")
+        self._callbacks: Queue = Queue()
+        self._busy_lock = threading.Lock()
+        self._busy_count = 0
+        self._shown_cursor = "arrow"
+        self._handles = set()
+
+        self.root.after(self.poll_interval_ms, self._poll)
+
+
+    def submit(
+        self,
+        func: Callable,
+        *args,
+        on_done: Optional[Callable] = None,
+        on_error: Optional[Callable] = None,
+        on_progress: Optional[Callable] = None,
+        with_handle: bool = False,
+        **kwargs
+    ) -> TaskHandle:
+        """
+        Runs func(*args, **kwargs) on a worker thread.
+
+        Parameters
+        ----------
+        func - The blocking function to run
+        on_done - Called on the main thread with the return value of func
+        on_error - Called on the main thread with the exception if func raised
+        on_progress - Called on the main thread with the arguments given to handle.report_progress
+        with_handle - Give the TaskHandle to func as first argument
+
+        Returns
+        -------
+        The TaskHandle of the task.
+        """
+
+        handle = TaskHandle(self, on_progress)
+        if with_handle:
+            args = (handle,) + args
+
+        self.begin_busy()
+        self._handles.add(handle)
+
+        def run() -> None:
+            try:
+                if handle.cancelled:
+                    return
+                result = func(*args, **kwargs)
+            except Exception as exception:
+                logger.error(f"Task {getattr(func, '__name__', func)} failed: {exception}")
+                if on_error is not None:
+                    self.call_soon(handle._call_unless_cancelled, on_error, exception)
+            else:
+                if on_done is not None:
+                    self.call_soon(handle._call_unless_cancelled, on_done, result)
+            finally:
+                self.call_soon(self._handles.discard, handle)
+                self.end_busy()
+
+        try:
+            handle.future = self._executor.submit(run)
+        except RuntimeError as exception:
+            logger.error(f"Could not submit task: {exception}")
+            self._handles.discard(handle)
+            self.end_busy()
+
+        return handle
+
+
+    def call_soon(self, callback: Callable, *args: Any) -> None:
+        """Calls callback(*args) on the main thread, safe to call from any thread."""
+
+        self._callbacks.put((callback, args))
+
+
+    def begin_busy(self) -> None:
+        """Marks that work is running, the window shows the watch cursor. Safe to call from any thread."""
+
+        with self._busy_lock:
+            self._busy_count += 1
+
+
+    def end_busy(self) -> None:
+        """Marks that a piece of work has finished. Safe to call from any thread."""
+
+        with self._busy_lock:
+            self._busy_count = max(0, self._busy_count - 1)
+
+
+    def cancel_all(self, event=None) -> None:
+        """Cancels every task that has not finished yet."""
+
+        for handle in list(self._handles):
+            handle.cancel()
+            if handle.future is not None and handle.future.cancelled():
+                self._handles.discard(handle)
+                self.end_busy()
+        logger.info("Cancelled running tasks")
+
+
+    def shutdown(self) -> None:
+        self.cancel_all()
+        self._executor.shutdown(wait=False)
+
+
+    def _poll(self) -> None:
+        while True:
+            try:
+                callback, args = self._callbacks.get_nowait()
+            except Empty:
+                break
+
+            try:
+                callback(*args)
+            except Exception as exception:
+                logger.error(f"Error in callback {getattr(callback, '__name__', callback)}: {exception}")
+
+        with self._busy_lock:
+            cursor = "watch" if self._busy_count > 0 else "arrow"
+
+        if cursor != self._shown_cursor:
+            self._shown_cursor = cursor
+            self.root.config(cursor=cursor)
+
+        try:
+            self.root.after(self.poll_interval_ms, self._poll)
+        except tk.TclError:
+            pass
@@ -0,0 +1,207 @@
+"""
+This file contains the UnitHealthMonitor class, which checks the health of every unit on a schedule.
+It measures the ping time, the time to connect to the OPC UA port and the time to read the server state
+over the pooled OPC UA session, and keeps the last samples of every unit so a unit that gets slower
+can be seen before a recipe load fails.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import asyncio
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from asyncua import ua
+from ping3 import ping
+
+from .create_log import setup_logger
+from .config_handler import ConfigHandler
+from .ip_checker import load_unit_addresses
+from .opcua_client import get_opcua_session, invalidate_opcua_session
+
+
+logger = setup_logger("Unit_health")
+
+
+@dataclass(frozen=True)
+class HealthSample:
+    """One check of a unit, a time is None when that check failed."""
+    time: datetime
+    ping_ms: Optional[float]
+    tcp_connect_ms: Optional[float]
+    opcua_read_ms: Optional[float]
+    server_state: Optional[str]
+    error: Optional[str] = None
+
+
+    @property
+    def ok(self) -> bool:
+        return self.opcua_read_ms is not None and self.server_state == "Running"
+
+
+class UnitHealthMonitor:
+    """
+    Checks every unit in ip_addresses.json every interval_seconds, all units at the same time.
+
+    run is started on an event loop, the other methods can be called from any thread.
+    """
+
+    def __init__(
+        self,
+        interval_seconds: float = 30.0,
+        history_size: int = 120,
+        timeout_seconds: float = 2.0
+    ) -> None:
+        """
+        Parameters
+        ----------
+        interval_seconds - Time between two checks of a unit
+        history_size - Number of samples kept per unit
+        timeout_seconds - Max time for each of the checks
+        """
+
+        self.interval_seconds = interval_seconds
+        self.history_size = history_size
+        self.timeout_seconds = timeout_seconds
+
+        self._lock = threading.Lock()
+        self._history: Dict[str, Deque[HealthSample]] = {}
+        self._addresses: Dict[str, str] = {}
+
+
+    async def run(self) -> None:
+        """Checks all units, then waits interval_seconds, forever."""
+
+        while True:
+            started = time.monotonic()
+
+            try:
+                units = load_unit_addresses()
+                await asyncio.gather(*(self._check_and_store(name, ip_address, port)
+                                       for name, ip_address, port in units))
+            except Exception as exeption:
+                logger.error(f"Health check failed: {exeption}")
+
+            await asyncio.sleep(max(0.0, self.interval_seconds - (time.monotonic() - started)))
+
+
+    def latest(self) -> Dict[str, Optional[HealthSample]]:
+        """The newest sample of every unit."""
+
+        with self._lock:
+            return {name: history[-1] if history else None for name, history in self._history.items()}
+
+
+    def history(self, name: str) -> List[HealthSample]:
+        """The samples of a unit, oldest first."""
+
+        with self._lock:
+            return list(self._history.get(name, ()))
+
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        The health of every unit as plain values, for the webserver.
+
+        Returns
+        -------
+        Unit name -> address, the latest sample, the share of ok samples and the mean and max OPC UA read time.
+        """
+
+        with self._lock:
+            histories = {name: list(history) for name, history in self._history.items()}
+            addresses = dict(self._addresses)
+
+        summary = {}
+        for name, history in histories.items():
+            read_times = [sample.opcua_read_ms for sample in history if sample.opcua_read_ms is not None]
+            latest = history[-1] if history else None
+            summary[name] = {
+                "address": addresses.get(name),
+                "latest": {**asdict(latest), "time": latest.time.isoformat(), "ok": latest.ok} if latest else None,
+                "samples": len(history),
+                "availability": sum(sample.ok for sample in history) / len(history) if history else None,
+                "opcua_read_ms_mean": sum(read_times) / len(read_times) if read_times else None,
+                "opcua_read_ms_max": max(read_times) if read_times else None,
+            }
+        return summary
+
+
+    async def _check_and_store(self, name: str, ip_address: str, port: int) -> None:
+        sample = await self.check_unit(ip_address, port)
+
+        with self._lock:
+            history = self._history.get(name)
+            if history is None:
+                history = self._history[name] = deque(maxlen=self.history_size)
+            history.append(sample)
+            self._addresses[name] = f"{ip_address}:{port}"
+
+        if not sample.ok:
+            logger.warning(f"{name} is not healthy: {sample}")
+
+
+    async def check_unit(self, ip_address: str, port: int) -> HealthSample:
+        """Pings a unit, connects to its port and reads the server state over the OPC UA session."""
+
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout_seconds
+        now = datetime.now()
+
+        response_time = await loop.run_in_executor(None, lambda: ping(ip_address, timeout=timeout))
+        ping_ms = response_time * 1000 if response_time else None
+
+        started = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(ip_address, port), timeout)
+            tcp_connect_ms = (time.perf_counter() - started) * 1000
+            writer.close()
+        except (OSError, asyncio.TimeoutError) as exeption:
+            return HealthSample(now, ping_ms, None, None, None, f"Port {port} not reachable: {exeption}")
+
+        url = f"opc.tcp://{ip_address}:{port}"
+        try:
+            # Not cancelled by the timeout, the pool keeps the session for the next checks
+            client = await get_opcua_session(url)
+            if client is None:
+                return HealthSample(now, ping_ms, tcp_connect_ms, None, None, "No OPC UA session")
+
+            started = time.perf_counter()
+            state = await asyncio.wait_for(
+                client.get_node(ua.ObjectIds.Server_ServerStatus_State).read_value(), timeout)
+            opcua_read_ms = (time.perf_counter() - started) * 1000
+
+        except Exception as exeption:
+            # The session may be broken, the next check makes a new one
+            await invalidate_opcua_session(url)
+            return HealthSample(now, ping_ms, tcp_connect_ms, None, None, f"OPC UA read failed: {exeption}")
+
+        try:
+            server_state = ua.ServerState(state).name
+        except ValueError:
+            server_state = str(state)
+        return HealthSample(now, ping_ms, tcp_connect_ms, opcua_read_ms, server_state)
+
+
+def create_unit_health_monitor() -> Optional[UnitHealthMonitor]:
+    """Creates the monitor from configs/unit_health_config.json, None if it is disabled or the file is missing."""
+
+    try:
+        config = ConfigHandler().get_config_data("unit_health_config.json")
+    except (FileNotFoundError, ValueError) as exeption:
+        logger.warning(f"Unit health monitor is off: {exeption}")
+        return None
+
+    if not config.get("enabled", True):
+        return None
+
+    return UnitHealthMonitor(
+        interval_seconds=float(config.get("interval_seconds", 30)),
+        history_size=int(config.get("history_size", 120)),
+        timeout_seconds=float(config.get("timeout_seconds", 2))
+    )
@@ -0,0 +1,515 @@
+"""
+This file contains the VirtualTreeview class, a ttk.Treeview that only creates Tk items for the rows
+that can be seen. All rows live in a Python model, so grids with thousands of rows open and scroll
+as fast as grids with a few.
+version: 1.0.0
+"""
+__version__ = "1.0.0"
+
+
+import itertools
+from dataclasses import dataclass, field
+from tkinter import ttk
+from typing import Any, Callable, Dict, List, Optional, Set
+
+
+@dataclass
+class VirtualRow:
+    iid: str
+    parent: str
+    values: tuple = ()
+    tags: tuple = ()
+    text: str = ""
+    open: bool = False
+    children: List[str] = field(default_factory=list)
+
+
+class VirtualTreeview(ttk.Treeview):
+    """
+    Drop-in ttk.Treeview for large grids.
+
+    insert, delete, move, item, set, get_children, parent, exists, selection, see and yview work on
+    the model like they do on a normal Treeview, so the grid code does not change. Only the rows in
+    view plus margin_rows are created as Tk items, flat and in view order. Children of a row are
+    shown below it while the row is open.
+
+    set_filter shows the rows that match, their open children and their ancestors.
+    """
+
+    def __init__(self, master=None, margin_rows: int = 5, **kwargs):
+        self._user_yscrollcommand: Optional[Callable] = None
+        yscrollcommand = kwargs.pop("yscrollcommand", None)
+
+        super().__init__(master, **kwargs)
+
+        self.margin_rows = margin_rows
+        self._rows: Dict[str, VirtualRow] = {"": VirtualRow("", "")}
+        self._selected: List[str] = []
+        self._filter: Optional[Callable[[VirtualRow], bool]] = None
+        self._visible: Optional[List[str]] = None
+        self._offset = 0
+        self._window: List[str] = []
+        self._window_stale = True
+        self._render_pending = False
+        # Selection changes made by a render, their <<TreeviewSelect>> is not passed on
+        self._own_select_events = 0
+        self._iid_counter = itertools.count(1)
+
+        super().configure(yscrollcommand=self._on_native_scroll)
+        if yscrollcommand is not None:
+            self._user_yscrollcommand = yscrollcommand
+
+        self.bind("<<TreeviewSelect>>", self._sync_selection, add="+")
+        self.bind("<Configure>", lambda event: self._schedule_render(), add="+")
+        self.bind("<MouseWheel>", self._on_mouse_wheel, add="+")
+        self.bind("<Button-4>", lambda event: self._scroll_rows(-3), add="+")
+        self.bind("<Button-5>", lambda event: self._scroll_rows(3), add="+")
+        self.bind("<Up>", lambda event: self._move_selection(-1), add="+")
+        self.bind("<Down>", lambda event: self._move_selection(1), add="+")
+        self.bind("<Prior>", lambda event: self._move_selection(-self._window_size()), add="+")
+        self.bind("<Next>", lambda event: self._move_selection(self._window_size()), add="+")
+
+
+    # Model, same signatures as ttk.Treeview
+
+    def insert(self, parent, index, iid=None, **kw):
+        parent = self._key(parent)
+        if iid is None:
+            iid = f"V{next(self._iid_counter)}"
+        iid = str(iid)
+        if iid in self._rows:
+            raise ValueError(f"Item {iid} already exists")
+
+        row = VirtualRow(iid, parent, tuple(kw.get("values", ())), self._as_tuple(kw.get("tags", ())),
+                         kw.get("text", ""), bool(kw.get("open", False)))
+        self._rows[iid] = row
+
+        siblings = self._rows[parent].children
+        if index == "end":
+            siblings.append(iid)
+        else:
+            siblings.insert(int(index), iid)
+
+        self._changed()
+        return iid
+
+
+    def delete(self, *items):
+        deleted = {str(iid) for iid in items if str(iid) in self._rows and str(iid) != ""}
+        if not deleted:
+            return
+
+        # Rebuild every sibling list once, deleting many rows one by one would be quadratic
+        for parent in {self._rows[iid].parent for iid in deleted}:
+            if parent in self._rows:
+                row = self._rows[parent]
+                row.children = [child for child in row.children if child not in deleted]
+        for iid in deleted:
+            if iid in self._rows:
+                for removed in self._subtree(iid):
+                    del self._rows[removed]
+        self._selected = [iid for iid in self._selected if iid in self._rows]
+        self._changed()
+
+
+    def move(self, item, parent, index):
+        item = str(item)
+        parent = self._key(parent)
+        row = self._rows[item]
+        self._rows[row.parent].children.remove(item)
+        row.parent = parent
+        siblings = self._rows[parent].children
+        if index == "end":
+            siblings.append(item)
+        else:
+            siblings.insert(int(index), item)
+        self._changed()
+
+    reattach = move
+
+
+    def get_children(self, item=None):
+        return tuple(self._rows[self._key(item)].children)
+
+
+    def set_children(self, item, *newchildren):
+        row = self._rows[self._key(item)]
+        for iid in row.children:
+            self._rows[iid].parent = ""
+        row.children = [str(iid) for iid in newchildren]
+        for iid in row.children:
+            self._rows[iid].parent = row.iid
+        self._changed()
+
+
+    def parent(self, item):
+        return self._rows[str(item)].parent
+
+
+    def exists(self, item):
+        return str(item) in self._rows and str(item) != ""
+
+
+    def index(self, item):
+        row = self._rows[str(item)]
+        return self._rows[row.parent].children.index(row.iid)
+
+
+    def item(self, item, option=None, **kw):
+        row = self._rows[str(item)]
+
+        if kw:
+            visible_changed = False
+            if "values" in kw:
+                row.values = tuple(kw["values"])
+            if "tags" in kw:
+                row.tags = self._as_tuple(kw["tags"])
+            if "text" in kw:
+                row.text = kw["text"]
+            if "open" in kw:
+                visible_changed = bool(kw["open"]) != row.open
+                row.open = bool(kw["open"])
+
+            if visible_changed:
+                self._changed()
+            elif row.iid in self._window:
+                super().item(row.iid, values=row.values, tags=row.tags, text=row.text)
+            return None
+
+        data = {"text": row.text, "image": "", "values": row.values, "open": row.open, "tags": row.tags}
+        if option is not None:
+            return data[option]
+        return data
+
+
+    def set(self, item, column=None, value=None):
+        row = self._rows[str(item)]
+        columns = list(self["columns"])
+
+        if column is None:
+            return dict(zip(columns, row.values))
+
+        column_index = columns.index(column) if not isinstance(column, int) else column
+        if value is None:
+            return row.values[column_index] if column_index < len(row.values) else ""
+
+        values = list(row.values) + [""] * (len(columns) - len(row.values))
+        values[column_index] = value
+        self.item(row.iid, values=values)
+        return None
+
+
+    def selection(self, *args):
+        if args:
+            raise TypeError("Use selection_set, selection_add or selection_remove")
+        self._sync_selection()
+        return tuple(self._selected)
+
+
+    def selection_set(self, *items):
+        self._selected = [str(iid) for iid in self._flatten(items) if str(iid) in self._rows]
+        self._apply_selection()
+
+
+    def selection_add(self, *items):
+        for iid in self._flatten(items):
+            if str(iid) in self._rows and str(iid) not in self._selected:
+                self._selected.append(str(iid))
+        self._apply_selection()
+
+
+    def selection_remove(self, *items):
+        removed = {str(iid) for iid in self._flatten(items)}
+        self._selected = [iid for iid in self._selected if iid not in removed]
+        self._apply_selection()
+
+
+    def see(self, item):
+        item = str(item)
+        ancestor = self._rows[item].parent
+        opened = False
+        while ancestor:
+            if not self._rows[ancestor].open:
+                self._rows[ancestor].open = True
+                opened = True
+            ancestor = self._rows[ancestor].parent
+        if opened:
+            self._visible = None
+
+        visible = self._visible_rows()
+        if item not in visible:
+            return
+        position = visible.index(item)
+        size = self._window_size()
+        if position < self._offset:
+            self._offset = position
+        elif position >= self._offset + size:
+            self._offset = position - size + 1
+        self._render()
+
+
+    def yview(self, *args):
+        total = len(self._visible_rows())
+        size = self._window_size()
+
+        if not args:
+            return self._fractions(total, size)
+
+        if args[0] == "moveto":
+            self._offset = int(float(args[1]) * total)
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            self._offset += amount * size if args[2] == "pages" else amount
+        self._render()
+        return None
+
+
+    def yview_moveto(self, fraction):
+        self.yview("moveto", fraction)
+
+
+    def yview_scroll(self, number, what):
+        self.yview("scroll", number, what)
+
+
+    def configure(self, cnf=None, **kw):
+        if isinstance(cnf, dict):
+            kw = {**cnf, **kw}
+            cnf = None
+        if "yscrollcommand" in kw:
+            self._user_yscrollcommand = kw.pop("yscrollcommand")
+            self._report_scroll()
+            if not kw and cnf is None:
+                return None
+        return super().configure(cnf, **kw)
+
+    config = configure
+
+
+    def __setitem__(self, key, value):
+        self.configure({key: value})
+
+
+    # Extras
+
+    def set_filter(self, predicate: Optional[Callable[[VirtualRow], bool]]) -> None:
+        """Shows only the rows that match, their ancestors and the open children of matches. None shows all."""
+
+        self._filter = predicate
+        self._offset = 0
+        self._changed()
+
+
+    def clear(self) -> None:
+        """Deletes all rows."""
+
+        self._rows = {"": VirtualRow("", "")}
+        self._selected = []
+        self._offset = 0
+        self._changed()
+
+
+    def visible_rows(self) -> List[str]:
+        """The iids of the rows that would be shown with enough room, in view order."""
+
+        return list(self._visible_rows())
+
+
+    # Rendering
+
+    def _changed(self) -> None:
+        self._visible = None
+        self._window_stale = True
+        self._schedule_render()
+
+
+    def _schedule_render(self) -> None:
+        if not self._render_pending:
+            self._render_pending = True
+            self.after_idle(self._render)
+
+
+    def _render(self) -> None:
+        self._render_pending = False
+        if not self.winfo_exists():
+            return
+
+        visible = self._visible_rows()
+        size = self._window_size()
+        self._offset = max(0, min(self._offset, len(visible) - size))
+        window = visible[self._offset:self._offset + size + self.margin_rows]
+
+        if self._window_stale or window != self._window:
+            native = super().get_children("")
+            if native:
+                super().delete(*native)
+            for iid in window:
+                row = self._rows[iid]
+                super().insert("", "end", iid=iid, values=row.values, tags=row.tags, text=row.text)
+            self._window = window
+            self._window_stale = False
+
+        super().yview_moveto(0)
+        self._apply_selection()
+        self._report_scroll()
+
+
+    def _visible_rows(self) -> List[str]:
+        if self._visible is not None:
+            return self._visible
+
+        visible: List[str] = []
+
+        if self._filter is None:
+            stack = list(reversed(self._rows[""].children))
+            while stack:
+                iid = stack.pop()
+                visible.append(iid)
+                row = self._rows[iid]
+                if row.open:
+                    stack.extend(reversed(row.children))
+        else:
+            matched = {iid for iid, row in self._rows.items() if iid and self._filter(row)}
+            ancestors = self._ancestors(matched)
+
+            def walk(iid: str, inside_match: bool) -> None:
+                row = self._rows[iid]
+                if not (inside_match or iid in matched or iid in ancestors):
+                    return
+                visible.append(iid)
+                # Ancestors of matches are opened so that the matches can be seen
+                if row.open or iid in ancestors:
+                    for child in row.children:
+                        walk(child, inside_match or iid in matched)
+
+            for root in self._rows[""].children:
+                walk(root, False)
+
+        self._visible = visible
+        return visible
+
+
+    def _ancestors(self, iids: Set[str]) -> Set[str]:
+        result: Set[str] = set()
+        for iid in iids:
+            parent = self._rows[iid].parent
+            while parent and parent not in result:
+                result.add(parent)
+                parent = self._rows[parent].parent
+        return result
+
+
+    def _subtree(self, iid: str) -> List[str]:
+        result = [iid]
+        for child in self._rows[iid].children:
+            result.extend(self._subtree(child))
+        return result
+
+
+    def _window_size(self) -> int:
+        height = self.winfo_height()
+        row_height = ttk.Style().lookup(self.cget("style") or "Treeview", "rowheight") or 20
+        try:
+            row_height = int(row_height)
+        except (TypeError, ValueError):
+            row_height = 20
+        if height <= 1:
+            return int(self.cget("height"))
+        return max(1, height // row_height - 1)
+
+
+    def _fractions(self, total: int, size: int):
+        if total == 0:
+            return 0.0, 1.0
+        return self._offset / total, min(1.0, (self._offset + size) / total)
+
+
+    def _report_scroll(self) -> None:
+        if self._user_yscrollcommand is not None:
+            first, last = self._fractions(len(self._visible_rows()), self._window_size())
+            self._user_yscrollcommand(first, last)
+
+
+    def _on_native_scroll(self, first, last) -> None:
+        # The native view moved inside the window, for example when a half visible row was clicked
+        shift = round(float(first) * len(self._window))
+        if shift:
+            self._offset += shift
+            self._render()
+
+
+    def _on_mouse_wheel(self, event):
+        self._scroll_rows(-3 if event.delta > 0 else 3)
+        return "break"
+
+
+    def _scroll_rows(self, amount: int):
+        self._offset += amount
+        self._render()
+        return "break"
+
+
+    def _move_selection(self, step: int):
+        visible = self._visible_rows()
+        if not visible:
+            return "break"
+
+        self._sync_selection()
+        if self._selected and self._selected[-1] in visible:
+            position = visible.index(self._selected[-1]) + step
+        else:
+            position = self._offset if step > 0 else self._offset + self._window_size() - 1
+
+        iid = visible[max(0, min(position, len(visible) - 1))]
+        self.selection_set(iid)
+        self.see(iid)
+        self.event_generate("<<TreeviewSelect>>")
+        return "break"
+
+
+    def _sync_selection(self, event=None):
+        if event is not None and self._own_select_events > 0:
+            self._own_select_events -= 1
+            return "break"
+
+        native = list(super().selection())
+        window = set(self._window)
+
+        if str(self.cget("selectmode")) == "browse":
+            if native:
+                self._selected = native
+            else:
+                self._selected = [iid for iid in self._selected if iid not in window]
+        else:
+            self._selected = [iid for iid in self._selected if iid not in window] + native
+
+
+    def _apply_selection(self) -> None:
+        window = set(self._window)
+        shown = [iid for iid in self._selected if iid in window]
+        if list(super().selection()) != shown:
+            self._own_select_events += 1
+            super().selection_set(shown)
+
+
+    @staticmethod
+    def _key(item) -> str:
+        return "" if item is None or item == "" else str(item)
+
+
+    @staticmethod
+    def _as_tuple(value: Any) -> tuple:
+        if isinstance(value, str):
+            return (value,) if value else ()
+        return tuple(value)
+
+
+    @staticmethod
+    def _flatten(items) -> List[Any]:
+        flat = []
+        for item in items:
+            if isinstance(item, (list, tuple)):
+                flat.extend(item)
+            else:
+                flat.append(item)
+        return flat
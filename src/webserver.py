@@ -1,7 +1,7 @@
 import json
 import threading
 import asyncio
-from flask import Flask, request, render_template
+from flask import Flask, request, render_template, Response
 from flask_cors import CORS
 from waitress import serve
 from flask_sqlalchemy import SQLAlchemy
@@ -9,12 +9,29 @@ from sqlalchemy.sql import text
 import time
 
 from .create_log import setup_logger
-from .opcua_client import data_to_webserver
+from .opcua_client import data_to_webserver, get_production_unit_url, PRODUCED_NODE_ID, TO_DO_NODE_ID
+from .live_values import LiveValueStore, run_live_subscription
+from .snapshot_broadcaster import SnapshotBroadcaster
+from .production_estimator import ThroughputEstimator
+from .asgi_webserver import create_asgi_app, serve_asgi, uvicorn
 from .data_encrypt import DataEncryptor
+from .unit_health import create_unit_health_monitor
 
-produced_global = 0
-to_do_global = 0
-estimated_time_remaining_global = 0
+# Long-lived loop that owns the pooled OPC UA sessions and runs the production poller
+opcua_loop = asyncio.new_event_loop()
+
+# Latest values read by poll_production_data, the routes and streams only read this
+production_broadcaster = SnapshotBroadcaster()
+active_recipe_name_global = None
+
+# Parts per hour and time left, fed with every counter change
+throughput_estimator = ThroughputEstimator()
+
+# Counters and KPI values pushed by the PLC through a subscription
+live_values = LiveValueStore()
+
+# Ping, port and OPC UA latency of every unit, None if turned off in unit_health_config.json
+unit_health_monitor = create_unit_health_monitor()
 
 logger = setup_logger('webserver')
 
@@ -23,6 +40,19 @@ with open ("configs/webserver_config.json", encoding="UTF8") as host_info:
 
     host_adress = json_data["host"]
     host_port = json_data["port"]
+    server_mode = json_data.get("mode", "wsgi")
+    poll_interval_seconds = float(json_data.get("poll_interval_seconds", 2))
+    snapshot_max_age_seconds = float(json_data.get("snapshot_max_age_seconds", 15))
+    subscription_config = json_data.get("subscription", {})
+    publishing_interval_ms = int(subscription_config.get("publishing_interval_ms", 500))
+    kpi_nodes = subscription_config.get("kpi_nodes", {})
+    server_threads = int(json_data.get("threads", 16))
+    # Each open stream holds a waitress thread, the rest are kept free for /get_data and the page
+    max_streams = max(1, min(int(json_data.get("max_streams", server_threads - 4)), server_threads - 1))
+    stream_keep_alive_seconds = float(json_data.get("stream_keep_alive_seconds", 15))
+
+# Free places for /stream in the waitress mode
+stream_slots = threading.BoundedSemaphore(max_streams)
 
 app = Flask(__name__, template_folder='../templates', static_folder="../static")
 
@@ -57,111 +87,262 @@ def main_page():
     return render_template('index.html')
 
 
+def snapshot_payload(snapshot):
+    """Returns the values sent to the dashboards, or None if there is no recent snapshot."""
+
+    if snapshot is None:
+        return None
+
+    if time.time() - snapshot["timestamp"] > snapshot_max_age_seconds:
+        return None
+
+    return {
+        "produced": snapshot["produced"],
+        "to_do": snapshot["to_do"],
+        "name": snapshot["name"],
+        "estimated_time": snapshot["estimated_time"],
+        "parts_per_hour": snapshot["parts_per_hour"],
+        "estimate_confidence": snapshot["estimate_confidence"],
+        "stopped": snapshot["stopped"],
+        "kpi": snapshot["kpi"]
+    }
+
+
 @app.route('/get_data', methods=['GET'])
 def get_data():
 
     """
     Get Data Route
-    Fetches data from the database and runs an asynchronous task to retrieve additional data.
-    Returns the response as JSON.
+    Returns the latest production values read by the background poller as JSON.
     """
-    global produced_global, to_do_global, estimated_time_remaining_global
 
-    produced = None
-    to_do = None
-    response = None
-    headers = None
+    _, snapshot = production_broadcaster.latest()
+    payload = snapshot_payload(snapshot)
 
-    try:
-        query = text('SELECT * FROM tblActiveRecipeList')
-        active_recipe_name = db.session.execute(query).fetchall()[0][0]
-
-    except Exception as exeption:
-        db.session.rollback()
-        logger.warning("Database error occurred", exeption)
+    if payload is None:
+        logger.warning("No recent data received from the opcua server")
         return "Server error", 500
-    finally:
-        db.session.close()
-        logger.info("Database session closed")
 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    result = loop.run_until_complete(data_to_webserver())
+    headers = {"Content-Type": "application/json"}
+
+    return json.dumps(payload), 200, headers
+
+
+@app.route('/stream', methods=['GET'])
+def stream():
+
+    """
+    Stream Route
+    Pushes the production values to the dashboard as Server-Sent Events whenever they change.
+    A comment line is sent every stream_keep_alive_seconds so that closed connections are noticed.
+    When max_streams streams are open the answer is 503, which makes the dashboard poll /get_data instead.
+    """
+
+    if not stream_slots.acquire(blocking=False):
+        logger.warning(f"{max_streams} streams are open, the dashboard has to poll")
+        return "Too many streams", 503
+
+    def events():
+        version = -1
+        last_data = None
+        last_sent = time.time()
+
+        while True:
+            version, snapshot = production_broadcaster.wait_for_update(version, stream_keep_alive_seconds)
+            payload = snapshot_payload(snapshot)
+            data = json.dumps(payload) if payload is not None else None
+
+            if data is not None and data != last_data:
+                last_data = data
+                last_sent = time.time()
+                yield f"data: {data}\n\n"
+
+            elif time.time() - last_sent >= stream_keep_alive_seconds:
+                last_sent = time.time()
+                yield ": keep-alive\n\n"
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    response = Response(events(), mimetype="text/event-stream", headers=headers)
+    # Called by waitress when the client is gone, also if the stream never started
+    response.call_on_close(stream_slots.release)
+    return response
+
+
+def health_payload():
+    """The health of every unit, None if the health monitor is turned off."""
+
+    if unit_health_monitor is None:
+        return None
+    return unit_health_monitor.summary()
+
+
+@app.route('/health', methods=['GET'])
+def health():
+
+    """
+    Health Route
+    Returns the latest health check and the latency history summary of every unit as JSON.
+    """
+
+    payload = health_payload()
+
+    if payload is None:
+        return "Health monitor is turned off", 404
+
+    headers = {"Content-Type": "application/json"}
+
+    return json.dumps(payload), 200, headers
 
-    if result is not None:
+
+def read_active_recipe_name():
+    """Reads the name of the active recipe, runs on a worker thread of the opcua loop."""
+
+    with app.app_context():
         try:
-            produced, to_do = result
-            produced_global = produced
-            to_do_global = to_do
-            response = json.dumps({
-            "produced": produced,
-            "to_do": to_do,
-            "name": active_recipe_name,
-            "estimated_time": estimated_time_remaining_global
-            })
-            headers = {"Content-Type": "application/json"}
-        except TypeError as exeption:
-            logger.warning("Error occurred", exeption)
-            return "Server error", 500
-    else:
-        logger.warning("No data received from the opcua server")
-        return "Server error", 500
+            query = text('SELECT * FROM tblActiveRecipeList')
+            return db.session.execute(query).fetchall()[0][0]
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.close()
 
-    return response or "", 200, headers or {}
 
+def publish_snapshot(produced, to_do, active_recipe_name):
+    """Publishes new production values for the routes."""
 
-def calculate_time_to_produce():
-    global produced_global, to_do_global, estimated_time_remaining_global
+    throughput_estimator.update(produced, to_do, active_recipe_name)
+    estimate = throughput_estimator.estimate()
 
-    timestamps = []
-    counts = []
+    live = live_values.snapshot()
+    kpi = {name: live.get(name) for name in kpi_nodes}
+
+    production_broadcaster.publish({
+        "produced": produced,
+        "to_do": to_do,
+        "name": active_recipe_name,
+        "estimated_time": estimate.eta_text,
+        "parts_per_hour": round(estimate.parts_per_hour, 1) if estimate.parts_per_hour else None,
+        "estimate_confidence": estimate.confidence,
+        "stopped": estimate.stopped,
+        "kpi": kpi,
+        "timestamp": time.time()
+    })
+
+
+def on_live_value_changed(name, value):
+    """Publishes the pushed counters right away instead of waiting for the next poll."""
+
+    if not live_values.connected:
+        return
+
+    produced = live_values.get("produced")
+    to_do = live_values.get("to_do")
+    if produced is not None and to_do is not None:
+        publish_snapshot(produced, to_do, active_recipe_name_global)
 
-    while True:
-        produced = produced_global
-        to_do = to_do_global
 
-        current_time = time.time()
-        timestamps.append(current_time)
-        counts.append(produced)
+async def poll_production_data():
+    """
+    Reads the active recipe from the database every poll_interval_seconds and publishes it in
+    production_broadcaster together with the counters.
+    While the live value subscription is running the counters come from it, otherwise they are
+    read from the PLC. This is the only place that talks to the PLC and the database for the
+    dashboards, however many of them are connected.
+    """
+
+    global active_recipe_name_global
 
-        if len(timestamps) > 2 and max(counts) > 1:
-            try:
-                time_diff = timestamps[-1] - timestamps[0]
-                count_diff = counts[-1] - counts[0]
+    loop = asyncio.get_running_loop()
 
-                avg_time_per_item = time_diff / count_diff
-                remaining_items = to_do - produced
-                estimated_time_remaining_seconds = avg_time_per_item * remaining_items
-                hours, remainder = divmod(estimated_time_remaining_seconds, 3600)
-                minutes = remainder // 60
-                estimated_time_remaining_global = f"{str(int(hours)).zfill(2)}:{str(int(minutes)).zfill(2)}"
+    while True:
+        try:
+            active_recipe_name_global = await loop.run_in_executor(None, read_active_recipe_name)
 
-                if len(timestamps) > 10:
-                    timestamps.pop(0)
-                    counts.pop(0)
+            produced = live_values.get("produced")
+            to_do = live_values.get("to_do")
 
-            except ZeroDivisionError:
-                pass
-            except Exception as exeption:
-                logger.warning("Error occurred", exeption)
+            if not live_values.connected or produced is None or to_do is None:
+                result = await data_to_webserver()
+                produced, to_do = result if result is not None else (None, None)
 
-        time.sleep(5)
+            if produced is not None and to_do is not None:
+                publish_snapshot(produced, to_do, active_recipe_name_global)
+            else:
+                logger.warning("No data received from the opcua server")
+
+        except Exception as exeption:
+            logger.warning(f"Error while polling production data: {exeption}")
+
+        await asyncio.sleep(poll_interval_seconds)
 
 
 def run_server():
-    serve(app, host=host_adress, port=host_port)
+    # Every open stream holds a thread, send_bytes=1 sends each event as soon as it is written
+    serve(app, host=host_adress, port=host_port, threads=server_threads, send_bytes=1)
 
 
-def main_webserver():
-    url = f'http://{host_adress}:{host_port}'
+def run_opcua_loop():
+    asyncio.set_event_loop(opcua_loop)
+    live_values.add_listener(on_live_value_changed)
+    live_nodes = {"produced": PRODUCED_NODE_ID, "to_do": TO_DO_NODE_ID, **kpi_nodes}
+    opcua_loop.create_task(run_live_subscription(live_values, get_production_unit_url, live_nodes,
+                                                 publishing_interval_ms))
+    opcua_loop.create_task(poll_production_data())
+    if unit_health_monitor is not None:
+        opcua_loop.create_task(unit_health_monitor.run())
+    opcua_loop.run_forever()
 
+
+def start_asgi_server():
+    """Serves the dashboard with uvicorn on opcua_loop, returns False if uvicorn is not installed."""
+
+    if uvicorn is None:
+        logger.warning("mode is asgi but uvicorn is not installed, using waitress")
+        return False
+
+    asgi_app = create_asgi_app(snapshot_payload, production_broadcaster, stream_keep_alive_seconds,
+                               [host_adress + ":" + host_port], health_payload)
+    future = asyncio.run_coroutine_threadsafe(serve_asgi(asgi_app, host_adress, int(host_port)), opcua_loop)
+    future.add_done_callback(on_asgi_server_stopped)
+    logger.info("Serving the dashboard with uvicorn")
+    return True
+
+
+def on_asgi_server_stopped(future):
+    """Starts waitress when uvicorn could not start, called on the opcua loop thread."""
+
+    if future.cancelled():
+        return
+
+    try:
+        started = future.result()
+    except Exception as exeption:
+        logger.error(f"uvicorn stopped with an error: {exeption}")
+        started = False
+
+    if not started:
+        logger.warning("uvicorn could not start, using waitress")
+        start_wsgi_server()
+
+
+def start_wsgi_server():
     server_thread = threading.Thread(target=run_server)
     server_thread.daemon = True
     server_thread.start()
 
-    time_calc_thread = threading.Thread(target=calculate_time_to_produce)
-    time_calc_thread.daemon = True
-    time_calc_thread.start()
+
+def main_webserver():
+    url = f'http://{host_adress}:{host_port}'
+
+    opcua_loop_thread = threading.Thread(target=run_opcua_loop)
+    opcua_loop_thread.daemon = True
+    opcua_loop_thread.start()
+
+    if server_mode == "asgi" and start_asgi_server():
+        return
+
+    start_wsgi_server()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,16 @@
+"""
+src/__init__.py imports the GUI and the webserver, which need the database and OPC UA configs.
+The src package is registered without running it, so the modules with plain logic can be tested on their own.
+"""
+
+import sys
+import types
+from pathlib import Path
+
+
+SRC_PATH = Path(__file__).parent.parent / "src"
+
+if "src" not in sys.modules:
+    package = types.ModuleType("src")
+    package.__path__ = [str(SRC_PATH)]
+    sys.modules["src"] = package
@@ -0,0 +1,94 @@
+import math
+
+import pytest
+
+from src.recipe_verifier import ChangedTag, parse_db_value, values_equal, compare_unit, verify_recipe
+
+
+def test_missing_extra_and_changed_tags():
+    db_rows = [
+        (1, "Speed", "10"),
+        (1, "Name", "Step 1"),
+        (1, "OnlyInDatabase", "1"),
+        (2, "Enabled", "true"),
+    ]
+    plc_values_by_unit = {
+        1: {"Speed": 12, "Name": "Step 1", "OnlyInUnit": 5},
+        2: {"Enabled": True},
+    }
+
+    result = verify_recipe(db_rows, plc_values_by_unit)
+
+    assert result.missing == [(1, "OnlyInDatabase")]
+    assert result.extra == [(1, "OnlyInUnit")]
+    assert result.changed == [ChangedTag(1, "Speed", "10", 12)]
+    assert result.checked == 4
+
+
+def test_units_that_were_not_read_are_skipped():
+    result = verify_recipe([(1, "Speed", "10"), (2, "Speed", "20")], {1: {"Speed": 10}})
+
+    assert not (result.missing or result.extra or result.changed)
+    assert result.checked == 1
+
+
+def test_unit_without_stored_rows_reports_every_tag_as_extra():
+    result = compare_unit(3, {}, {"A": 1, "B": 2.0}, 1e-6)
+
+    assert sorted(result.extra) == [(3, "A"), (3, "B")]
+
+
+@pytest.mark.parametrize("db_value, plc_value, expected", [
+    ("1.0000001", 1.0, True),
+    ("1.001", 1.0, False),
+    ("0.0000001", 0.0, True),
+    ("nan", math.nan, True),
+    ("1.5", math.nan, False),
+    ("abc", 1.0, False),
+])
+def test_float_tolerance(db_value, plc_value, expected):
+    assert values_equal(db_value, plc_value, 1e-6) is expected
+
+
+@pytest.mark.parametrize("db_value, plc_value, expected", [
+    ("True", True, True),
+    ("true", True, True),
+    (" 1 ", True, True),
+    ("False", False, True),
+    ("0", False, True),
+    ("False", True, False),
+    ("yes", True, False),
+])
+def test_bool_texts(db_value, plc_value, expected):
+    assert values_equal(db_value, plc_value, 1e-6) is expected
+
+
+def test_large_ints_are_compared_exactly():
+    stored = str(2**63 - 1)
+
+    assert parse_db_value(stored, 0) == 2**63 - 1
+    assert values_equal(stored, 2**63 - 1, 1e-6)
+    assert not values_equal(stored, 2**63 - 2, 1e-6)
+    assert not values_equal(str(2**53 + 1), 2**53, 1e-6)
+
+
+def test_int_texts_with_a_fraction():
+    assert values_equal("5.0", 5, 1e-6)
+    assert not values_equal("5.5", 5, 1e-6)
+
+    with pytest.raises(ValueError):
+        parse_db_value("5.5", 5)
+
+
+def test_none_values():
+    assert values_equal(None, None, 1e-6)
+    assert not values_equal("1", None, 1e-6)
+
+
+def test_messages_are_limited():
+    result = compare_unit(1, {f"Tag{index}": "1" for index in range(5)}, {}, 1e-6)
+
+    messages = result.messages(max_messages=3)
+
+    assert len(messages) == 4
+    assert messages[-1] == "... and 2 more differences"